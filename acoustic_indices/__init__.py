@@ -14,6 +14,51 @@ try:
 except ImportError:
     import acoustic_indices_calculation
 
+try:
+    from . import runner
+except ImportError:
+    import runner
+
+try:
+    from . import streaming
+except ImportError:
+    import streaming
+
+try:
+    from . import batch
+except ImportError:
+    import batch
+
+try:
+    from . import precision
+except ImportError:
+    import precision
+
+try:
+    from . import cache
+except ImportError:
+    import cache
+
+try:
+    from . import profiling
+except ImportError:
+    import profiling
+
+try:
+    from . import jobs
+except ImportError:
+    import jobs
+
+try:
+    from . import tuning
+except ImportError:
+    import tuning
+
+try:
+    from . import distributed
+except ImportError:
+    import distributed
+
 
 # Disponibilizar no namespace
-__all__ = ['acoustic_indices_calculation']
+__all__ = ['acoustic_indices_calculation', 'runner', 'streaming', 'batch', 'precision', 'cache', 'profiling', 'jobs', 'tuning', 'distributed']
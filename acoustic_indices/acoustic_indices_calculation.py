@@ -1,73 +1,362 @@
 from maad import sound, util, features
 from maui import visualizations, acoustic_indices, io, eda, utils
 import numpy as np
+import hashlib
+import maad
+from functools import partial
 
-class AcousticIndices(object):
-    """docstring for AcousticIndices"""
-    def __init__(self):
-        self.available_indices =  {
-            "ACI": "ACI",
-            "Spectral Events": "spectral_events",
-            "Spectral Activity": "spectral_activity",
-            "Temporal Entropy": "temporal_entropy",
-            "Frequency Entropy": "frequency_entropy",
+from acoustic_indices import batch
+from acoustic_indices.profiling import StageProfiler, maybe_stage
+from acoustic_indices.streaming import StreamingIndices
+
+
+class Intermediate(object):
+    """
+    Declaration of a pre-calculation step.
+
+    Parameters
+    ----------
+    outputs : tuple of str
+        Names of the values returned by ``func``, in order. ``None`` discards
+        an output that no index consumes.
+    inputs : tuple of str
+        Names of the values passed positionally to ``func``.
+    func : callable
+        Function computing the outputs.
+    **params
+        Keyword arguments forwarded to ``func``.
+    """
+    def __init__(self, outputs, inputs, func, **params):
+        self.outputs = outputs
+        self.inputs = inputs
+        self.func = func
+        self.params = params
+
+    def compute(self, values):
+        results = self.func(*[values[name] for name in self.inputs], **self.params)
+        if len(self.outputs) == 1:
+            results = (results,)
+        return {name: value for name, value in zip(self.outputs, results) if name is not None}
+
+
+INTERMEDIATES = [
+    # ----------------------- ACI -----------------------
+    Intermediate(
+        ("Sxx", "tn", "fn", "ext"), ("s", "fs"), sound.spectrogram,
+        window='hann', nperseg=1024, noverlap=512, mode='amplitude'
+    ),
+    Intermediate(
+        ("Sxx_pcen", None, None), ("Sxx",), sound.pcen,
+        gain=0.8, bias=2, power=0.5, b=0.025, eps=1e-6
+    ),
+    Intermediate(
+        ("Sxx_nb", None, None), ("Sxx_pcen",), sound.remove_background,
+        gauss_win=50, gauss_std=25, beta1=1, beta2=1, llambda=1
+    ),
+    Intermediate(("Sxx_eq",), ("Sxx_nb",), sound.median_equalizer),
+    # ------------------- Power family -------------------
+    Intermediate(
+        ("Sxx_power", "tn_power", "fn_power", "ext_power"), ("s", "fs"), sound.spectrogram
+    ),
+    Intermediate(("Sxx_dB",), ("Sxx_power",), util.power2dB),
+    Intermediate(
+        ("Sxx_dB_noNoise", None), ("Sxx_dB",), sound.remove_background_along_axis, mode='ale'
+    ),
+    Intermediate(("Sxx_power_noNoise",), ("Sxx_dB_noNoise",), util.dB2power),
+    # -------------------- Envelope --------------------
+    Intermediate(("env",), ("s",), sound.envelope, mode='fast', Nt=512),
+]
+
+
+def _qualname(func):
+    return f"{func.__module__}.{func.__qualname__}"
+
+
+class Index(Intermediate):
+    """
+    Declaration of a selectable acoustic index.
+
+    Parameters
+    ----------
+    name : str
+        Identifier of the index, as passed to ``AcousticIndices.set_indices``.
+    label : str
+        Name shown in the UI.
+    outputs : tuple of str
+        Names of the values returned by ``func``, in order.
+    inputs : tuple of str
+        Intermediates passed positionally to ``func``.
+    func : callable
+        Function computing the outputs of a single file.
+    batch_func : callable
+        Counterpart of ``func`` along a leading batch axis (see ``batch``).
+    **params
+        Keyword arguments forwarded to ``func`` and ``batch_func``.
+    """
+    def __init__(self, name, label, outputs, inputs, func, batch_func, **params):
+        super().__init__(outputs, inputs, func, **params)
+        self.name = name
+        self.label = label
+        self.batch_func = batch_func
+
+    def compute(self, values, batched=False):
+        if not batched:
+            return super().compute(values)
+        results = self.batch_func(*[values[name] for name in self.inputs], **self.params)
+        if len(self.outputs) == 1:
+            results = (results,)
+        return dict(zip(self.outputs, results))
+
+
+def _spectral_events(Sxx_dB, tn, ext, **params):
+    return features.spectral_events(Sxx_dB, dt=tn[1] - tn[0], display=False, extent=ext, **params)
+
+
+def _temporal_entropy(env):
+    # features.temporal_entropy with the envelope in float64: util.entropy
+    # replaces zeros with the smallest float64, which underflows in float32
+    return util.entropy(env.astype(np.float64)**2)
+
+
+def _acoustic_entropy(env, Sxx_power):
+    # H = Ht x Hf (Sueur et al., 2008), Hf from the mean power spectrum
+    return _temporal_entropy(env) * util.entropy(np.mean(Sxx_power, axis=1, dtype=np.float64))
+
+
+INDICES = [
+    Index(
+        "ACI", "ACI", ('aci_xx', 'aci_per_bin', 'aci_sum'), ("Sxx_eq",),
+        features.acoustic_complexity_index, batch.acoustic_complexity_index
+    ),
+    Index(
+        "spectral_events", "Spectral Events",
+        ('EVNspFract_per_bin', 'EVNspMean_per_bin', 'EVNspCount_per_bin', 'EVNsp'),
+        ("Sxx_dB_noNoise", "tn_power", "ext_power"), _spectral_events, batch.spectral_events,
+        dB_threshold=6, rejectDuration=0.1
+    ),
+    Index(
+        "spectral_activity", "Spectral Activity", ('LFC', 'MFC', 'HFC'), ("Sxx_dB_noNoise", "fn_power"),
+        features.spectral_cover, batch.spectral_cover
+    ),
+    Index(
+        "temporal_entropy", "Temporal Entropy", ('Ht',), ("env",),
+        _temporal_entropy, batch.temporal_entropy
+    ),
+    Index(
+        "frequency_entropy", "Frequency Entropy", ('Hf', 'Ht_per_bin'), ("Sxx_power_noNoise",),
+        features.frequency_entropy, batch.frequency_entropy
+    ),
+    # ----------------- Soundscape indices -----------------
+    Index(
+        "ADI", "Acoustic Diversity Index", ('ADI',), ("Sxx", "fn"),
+        features.acoustic_diversity_index, batch.acoustic_diversity_index,
+        fmin=0, fmax=20000, bin_step=1000, dB_threshold=-50
+    ),
+    Index(
+        "AEI", "Acoustic Evenness Index", ('AEI',), ("Sxx", "fn"),
+        features.acoustic_eveness_index, batch.acoustic_eveness_index,
+        fmin=0, fmax=20000, bin_step=500, dB_threshold=-50
+    ),
+    Index(
+        "NDSI", "Soundscape Index (NDSI)", ('NDSI', 'rBA', 'AnthroEnergy', 'BioEnergy'), ("Sxx_power", "fn_power"),
+        features.soundscape_index, batch.soundscape_index,
+        flim_bioPh=(1000, 10000), flim_antroPh=(0, 1000), R_compatible='soundecology'
+    ),
+    Index(
+        "BI", "Bioacoustics Index", ('BI',), ("Sxx", "fn"),
+        features.bioacoustics_index, batch.bioacoustics_index,
+        flim=(2000, 15000), R_compatible='soundecology'
+    ),
+    Index(
+        "H", "Acoustic Entropy", ('H',), ("env", "Sxx_power"),
+        _acoustic_entropy, batch.acoustic_entropy
+    ),
+]
+
+INDEX_REGISTRY = {index.name: index for index in INDICES}
+
+
+def plan_intermediates(indices, intermediates=INTERMEDIATES):
+    """
+    Returns the intermediates required by ``indices``, in dependency order.
+
+    Parameters
+    ----------
+    indices : list of Index
+        Selected indices.
+    intermediates : list of Intermediate, optional
+        Declared graph.
+
+    Returns
+    -------
+    list of Intermediate
+        Every step consumed, directly or through another step, by the
+        indices. Spectrograms that no selected index reaches are left out.
+    """
+    producers = {
+        name: step for step in intermediates for name in step.outputs if name is not None
+    }
+    planned = []
+
+    def visit(names):
+        for name in names:
+            step = producers.get(name)
+            if step is not None and step not in planned:
+                visit(step.inputs)
+                planned.append(step)
+
+    for index in indices:
+        visit(index.inputs)
+    return planned
+
+
+class PreCalcVars(dict):
+    """
+    Per-file map of pre-calculated variables, evaluated on first access.
+
+    Missing keys are resolved through the intermediate that declares them,
+    recursively pulling its inputs, and the results are stored in the dict so
+    every intermediate is computed at most once per file. Only ``[]`` access
+    triggers a computation; ``in`` and ``get`` see what was already built.
+    With a ``profiler``, each intermediate is recorded as a stage.
+    """
+    def __init__(self, intermediates, profiler=None, **values):
+        super().__init__(**values)
+        self.producers = {
+            name: step for step in intermediates for name in step.outputs if name is not None
         }
+        self.profiler = profiler
+
+    def resolve(self, names):
+        """Computes the named values, so a stage timed next only covers its own function."""
+        for name in names:
+            self[name]
+
+    def __missing__(self, key):
+        if key not in self.producers:
+            raise KeyError(key)
+        step = self.producers[key]
+        if self.profiler is None:
+            self.update(step.compute(self))
+        else:
+            self.resolve(step.inputs)
+            with self.profiler.stage("intermediate", f"{step.outputs[0]} ({step.func.__name__})"):
+                self.update(step.compute(self))
+        return dict.__getitem__(self, key)
+
+
+class AcousticIndices(object):
+    """
+    Acoustic indices selectable in the UI, declared in ``INDICES`` and
+    computed from lazily evaluated intermediates.
+
+    Parameters
+    ----------
+    compact : bool, optional
+        If True, array outputs are kept as contiguous float32 ndarrays instead
+        of nested Python lists, so they can be written as typed Arrow columns.
+    dtype : numpy dtype, optional
+        Precision of the signal and of every intermediate. The maad functions
+        promote to float64, so other precisions evaluate the graph with the
+        dtype-preserving implementations of ``batch``. ``np.float32`` halves
+        the memory of the spectrograms; see ``precision.compare_precision``
+        for its error against float64.
+    profile : bool, optional
+        If True, ``profiler`` records the time and peak allocation of every
+        intermediate and index (see ``profiling.StageProfiler``).
+    """
+    def __init__(self, compact=False, dtype=np.float64, profile=False):
+        self.available_indices = {index.label: index.name for index in INDICES}
         self.indices = None
+        self.selected = []
         self.acoustic_indices_methods = []
+        self.compact = compact
+        self.dtype = np.dtype(dtype)
+        if self.dtype == np.float64:
+            self.intermediates = list(INTERMEDIATES)
+        else:
+            self.intermediates = batch.batch_intermediates(INTERMEDIATES)
+        self.plan = list(self.intermediates)
+        self.profiler = StageProfiler() if profile else None
 
     def set_indices(self, indices: list):
+        """
+        Selects the indices to calculate, by name (see ``INDICES``), and plans
+        the intermediates they share.
+        """
         self.indices = indices
-        self.acoustic_indices_methods = []
-        for idx in indices:
-            if idx == "ACI": self.acoustic_indices_methods.append(self.get_aci)
-            if idx == "spectral_events": self.acoustic_indices_methods.append(self.get_spectral_events)
-            if idx == "spectral_activity": self.acoustic_indices_methods.append(self.get_spectral_activity)
-            if idx == "temporal_entropy": self.acoustic_indices_methods.append(self.get_temporal_entropy)
-            if idx == "frequency_entropy": self.acoustic_indices_methods.append(self.get_frequency_entropy)
+        self.selected = [INDEX_REGISTRY[idx] for idx in indices]
+        self.plan = plan_intermediates(self.selected, self.intermediates)
+        self.acoustic_indices_methods = [partial(self.calculate_index, index) for index in self.selected]
 
     def pre_calculation_method(self, s, fs):
-        pre_calc_vars = {"s": s, "fs": fs}
-        # ----------------------- ACI -----------------------
-        if "ACI" in self.indices:
-            Sxx, tn, fn, ext = sound.spectrogram(
-                s, fs,
-                window='hann', nperseg=1024, noverlap=512,
-                mode='amplitude'
-            )
-            Sxx_pcen, enhance_profile, PCENxx = sound.pcen(
-                Sxx,
-                gain=0.8, bias=2, power=0.5,
-                b=0.025, eps=1e-6
-            )
-            Sxx_nb, noise_profile, BGNxx = sound.remove_background(
-                Sxx_pcen,
-                gauss_win=50, gauss_std=25,
-                beta1=1, beta2=1, llambda=1
-            )
-            Sxx_eq = sound.median_equalizer(Sxx_nb)
-            pre_calc_vars["Sxx"] = Sxx
-            pre_calc_vars["Sxx_eq"] = Sxx_eq
-            pre_calc_vars["tn"] = tn
-            pre_calc_vars["fn"] = fn
-            pre_calc_vars["ext"] = ext
-        # ----------------- Spectral Events -----------------
-        if (
-            "spectral_events" in self.indices or
-            "frequency_entropy" in self.indices or
-            "spectral_activity" in self.indices
-        ):
-            Sxx_power, tn_power, fn_power, ext_power = sound.spectrogram(s, fs)
-            Sxx_dB = util.power2dB(Sxx_power)
-            Sxx_dB_noNoise,_ = sound.remove_background_along_axis(Sxx_dB, mode='ale')   
-            Sxx_power_noNoise = util.dB2power(Sxx_dB_noNoise)
-            pre_calc_vars["Sxx_power"] = Sxx_power
-            pre_calc_vars["tn_power"] = tn_power
-            pre_calc_vars["fn_power"] = fn_power
-            pre_calc_vars["ext_power"] = ext_power
-            pre_calc_vars["Sxx_dB"] = Sxx_dB
-            pre_calc_vars["Sxx_dB_noNoise"] = Sxx_dB_noNoise
-            pre_calc_vars["Sxx_power_noNoise"] = Sxx_power_noNoise
-        return pre_calc_vars
+        """
+        Returns the lazy intermediate map of a single file.
+
+        Nothing is computed here: each intermediate is built the first time an
+        index reads it and is then memoized, so only the spectrogram stages
+        required by the selected indices are ever evaluated.
+        """
+        return PreCalcVars(self.plan, profiler=self.profiler, s=np.asarray(s, dtype=self.dtype), fs=fs)
+
+    def calculate_streaming(self, file_path, block_duration=60.0, indices=None):
+        """
+        Calculates the selected indices (or ``indices``) of one file in blocks
+        of ``block_duration`` seconds, without loading the whole recording.
+        Matrix outputs (``aci_xx``, ``EVNsp``) are not produced.
+        """
+        streaming = StreamingIndices(
+            self.intermediates, INDICES, block_duration=block_duration, dtype=self.dtype
+        )
+        with maybe_stage(self.profiler, "streaming", "StreamingIndices.calculate"):
+            raw_indices = streaming.calculate(file_path, self.indices if indices is None else indices)
+        return self.format_indices(raw_indices)
+
+    def calculate_batch(self, signals, fs, indices=None):
+        """
+        Calculates the selected indices (or ``indices``) of N signals with the
+        same length and sampling rate, stacked as an ``(N, L)`` array, in
+        vectorized calls along the first axis.
+
+        Returns a list with the indices dict of each signal, as returned by
+        the per-file methods.
+        """
+        signals = np.atleast_2d(np.asarray(signals, dtype=self.dtype))
+        pre_calc_vars = PreCalcVars(batch.batch_intermediates(self.plan), profiler=self.profiler, s=signals, fs=fs)
+        raw_indices = {}
+        for idx in (self.indices if indices is None else indices):
+            index = INDEX_REGISTRY[idx]
+            pre_calc_vars.resolve(index.inputs)
+            with maybe_stage(self.profiler, "index", index.name):
+                raw_indices.update(index.compute(pre_calc_vars, batched=True))
+        return [
+            self.format_indices({k: v[i] for k, v in raw_indices.items()})
+            for i in range(len(signals))
+        ]
+
+    def result_cache_entries(self, streaming=False):
+        """
+        Returns, for each selected index, the fingerprint of everything that
+        changes its outputs (index, the intermediates it consumes, precision,
+        output format and maad version) and the names of its outputs, as expected by
+        ``cache.ResultCache``. Batch results equal the per-file ones, block
+        streaming ones lack the matrix outputs.
+        """
+        entries = {}
+        for index in self.selected:
+            graph = [
+                (step.outputs, step.inputs, _qualname(step.func), sorted(step.params.items()))
+                for step in plan_intermediates([index], self.intermediates)
+            ]
+            outputs = index.outputs
+            if streaming:
+                outputs = tuple(key for key in outputs if key not in ('aci_xx', 'EVNsp'))
+            config = repr((
+                index.name, _qualname(index.func), sorted(index.params.items()), graph,
+                str(self.dtype), self.compact, outputs, maad.__version__
+            ))
+            entries[index.name] = (hashlib.sha1(config.encode()).hexdigest(), outputs)
+        return entries
 
     def to_serializable(self, obj):
         """
@@ -86,38 +375,26 @@ class AcousticIndices(object):
         else:
             return obj
 
-    def get_aci(self, pre_calc_vars):
-        aci_xx, aci_per_bin, aci_sum  = features.acoustic_complexity_index(pre_calc_vars['Sxx_eq'])
-        raw_indices = {'aci_xx': aci_xx, 'aci_per_bin': aci_per_bin, 'aci_sum': aci_sum}
-        indices = {k: self.to_serializable(v) for k, v in raw_indices.items()}
-        return indices
-
-    def get_spectral_events(self, pre_calc_vars):
-        EVNspFract_per_bin, EVNspMean_per_bin, EVNspCount_per_bin, EVNsp = features.spectral_events(
-                    pre_calc_vars['Sxx_dB_noNoise'],
-                    dt=pre_calc_vars['tn_power'][1] - pre_calc_vars['tn_power'][0],
-                    dB_threshold=6,
-                    rejectDuration=0.1,
-                    display=False,
-                    extent=pre_calc_vars['ext_power'])
-        raw_indices = {'EVNspFract_per_bin': EVNspFract_per_bin, 'EVNspMean_per_bin': EVNspMean_per_bin, 'EVNspCount_per_bin': EVNspCount_per_bin, 'EVNsp': EVNsp}
-        indices = {k: self.to_serializable(v) for k, v in raw_indices.items()}
-        return indices
-
-    def get_frequency_entropy(self, pre_calc_vars):
-        Hf, Ht_per_bin = features.frequency_entropy(pre_calc_vars['Sxx_power_noNoise'])
-        raw_indices = {'Hf': Hf, 'Ht_per_bin': Ht_per_bin}
-        indices = {k: self.to_serializable(v) for k, v in raw_indices.items()}
-        return indices
-
-    def get_temporal_entropy(self, pre_calc_vars):
-        Ht = features.temporal_entropy(pre_calc_vars['s'])
-        raw_indices = {'Ht': Ht}
-        indices = {k: self.to_serializable(v) for k, v in raw_indices.items()}
-        return indices
-
-    def get_spectral_activity(self, pre_calc_vars):
-        LFC, MFC, HFC = features.spectral_cover(pre_calc_vars['Sxx_dB_noNoise'], pre_calc_vars['fn_power'])
-        raw_indices = {'LFC': LFC, 'MFC': MFC, 'HFC': HFC}
-        indices = {k: self.to_serializable(v) for k, v in raw_indices.items()}
-        return indices
+    def to_compact(self, obj):
+        """
+        Mantém arrays como ndarrays float32 contíguos e converte scalars numpy
+        para tipos nativos Python.
+        """
+        if isinstance(obj, (np.ndarray, list)):
+            return np.ascontiguousarray(obj, dtype=np.float32)
+        elif isinstance(obj, np.generic):
+            return obj.item()
+        else:
+            return obj
+
+    def format_indices(self, raw_indices):
+        convert = self.to_compact if self.compact else self.to_serializable
+        return {k: convert(v) for k, v in raw_indices.items()}
+
+    def calculate_index(self, index, pre_calc_vars):
+        """Calculates one declared index from the intermediates of a file."""
+        if self.profiler is None:
+            return self.format_indices(index.compute(pre_calc_vars))
+        pre_calc_vars.resolve(index.inputs)
+        with self.profiler.stage("index", index.name):
+            return self.format_indices(index.compute(pre_calc_vars))
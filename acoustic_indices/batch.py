@@ -0,0 +1,320 @@
+"""
+Batched computation of the acoustic indices for equal-length signals.
+
+Segmented datasets (``scale_02`` ... ``scale_60``) hold thousands of signals
+with the same duration, where the per-call Python overhead of the maad
+functions dominates. Here the N signals are stacked into an ``(N, L)`` array
+and every intermediate and index is computed along the leading batch axis in
+single vectorized calls: spectrograms are ``(N, F, T)`` arrays and per-bin
+outputs ``(N, F)``.
+
+Each step of the intermediate graph maps to a batched counterpart with the
+same signature, so the batched graph is evaluated lazily by ``PreCalcVars``
+just like the per-file one. Secondary outputs that the graph discards
+(``enhance_profile``, ``PCENxx``, ``BGNxx``) are not computed. The index
+functions at the end are the batched counterparts declared by each
+``acoustic_indices_calculation.Index``.
+
+Unlike the maad functions, which promote to float64, these keep the dtype of
+the input signal, so they also back the float32 mode of ``AcousticIndices``
+for single files. Zeros replaced before logarithms use the smallest normal
+number of that dtype.
+"""
+
+import numpy as np
+from scipy import ndimage, signal
+
+from maad import sound, util
+
+
+def _tiny(x):
+    return np.finfo(x.dtype).tiny
+
+
+def spectrogram(s, fs, window='hann', nperseg=1024, noverlap=None, mode='psd'):
+    """``sound.spectrogram`` of each row of ``s``."""
+    if noverlap is None:
+        noverlap = nperseg // 2
+    K = s.shape[-1] // (nperseg - noverlap) - 1
+    fn, tn, Sxx_complex = signal.spectrogram(
+        s, fs, window=window, nperseg=nperseg, noverlap=noverlap, nfft=nperseg,
+        mode='complex', detrend='constant', scaling='density', axis=-1
+    )
+    Sxx_complex = Sxx_complex * Sxx_complex.real.dtype.type(np.sqrt(2 * (fs / nperseg)))
+    if mode == 'complex':
+        Sxx_out = Sxx_complex
+    elif mode == 'amplitude':
+        Sxx_out = np.abs(Sxx_complex)
+    else:
+        Sxx_out = np.abs(Sxx_complex)**2
+    Sxx_out, tn = Sxx_out[..., :-1, :K], tn[:K]
+    fn = fn[:-1]
+    return Sxx_out, tn, fn, [tn[0], tn[-1], fn[0], fn[-1]]
+
+
+def pcen(Sxx, gain=0.98, bias=2, power=0.5, b=0.025, eps=1e-6):
+    """``sound.pcen`` of each spectrogram of ``Sxx``."""
+    M = signal.lfilter(np.array([b], Sxx.dtype), np.array([1, b - 1], Sxx.dtype), Sxx, axis=-1)
+    smooth = (eps + M)**(-gain)
+    return (Sxx * smooth + bias)**power - bias**power, None, None
+
+
+def remove_background(Sxx, gauss_win=50, gauss_std=25, beta1=1, beta2=1, llambda=1):
+    """``sound.remove_background`` of each spectrogram of ``Sxx``."""
+    mean_profile = np.mean(Sxx, axis=-1)
+    selem = signal.windows.gaussian(gauss_win, gauss_std)
+    # The structure only spans the frequency axis, so profiles stay independent
+    structure = selem.reshape((1,) * (mean_profile.ndim - 1) + (-1,))
+    noise_profile = ndimage.grey_opening(mean_profile, structure=structure)
+    noise_profile[..., -2:] = mean_profile[..., -2:]
+    noise_profile[..., :2] = mean_profile[..., :2]
+    noise_profile[noise_profile == 0] = _tiny(noise_profile)
+
+    SNR_est = Sxx / noise_profile[..., np.newaxis]
+    SNR_est = SNR_est * (SNR_est > 0)
+    an_lk = (1 - llambda * ((1. / (SNR_est + 1))**beta1))**beta2
+    an_lk = an_lk * (an_lk > 0)
+    Sxx_out = an_lk * Sxx
+    Sxx_out[Sxx_out < 0] = 0
+    return Sxx_out, noise_profile, None
+
+
+def power2dB(x, db_range=None, db_gain=0):
+    """``util.power2dB`` of an array."""
+    x = np.abs(x)
+    x[x == 0] = _tiny(x)
+    y = 10 * np.log10(x)
+    if db_gain:
+        y = y + db_gain
+    if db_range is not None:
+        y[y > 0] = 0
+        y[y < -(db_range)] = -db_range
+    return y
+
+
+def median_equalizer(Sxx):
+    """``sound.median_equalizer`` of each spectrogram of ``Sxx``."""
+    median = np.median(Sxx, axis=-1)
+    norm = median - np.min(Sxx, axis=-1)
+    # the fallback is the maximum of each spectrogram, not of the batch
+    Sxx_max = np.broadcast_to(Sxx.max(axis=(-2, -1))[..., np.newaxis], norm.shape)
+    norm[norm <= 0] = Sxx_max[norm <= 0]
+    Sxx_out = (Sxx - median[..., np.newaxis]) / norm[..., np.newaxis]
+    Sxx_out[Sxx_out < 1] = 1
+    return Sxx_out
+
+
+def ale_profile(Sxx, N=7, N_bins=50):
+    """Per-row 'ale' modal value of ``util.get_unimode`` along the last axis."""
+    # The histogram is always taken in float64: with float32 edges, values near
+    # a bin edge fall in the neighbouring bin and the modal value moves by a bin
+    X = Sxx.reshape(-1, Sxx.shape[-1]).astype(np.float64)
+    first, last = X.min(axis=1), X.max(axis=1)
+    same = first == last
+    first[same] -= 0.5
+    last[same] += 0.5
+    edges = np.linspace(first, last, N_bins + 1, axis=1)
+
+    # Same bin assignment as np.histogram with equal-width bins
+    norm = N_bins / (last - first)
+    idx = ((X - first[:, np.newaxis]) * norm[:, np.newaxis]).astype(np.intp)
+    idx[idx == N_bins] -= 1
+    idx[X < np.take_along_axis(edges, idx, axis=1)] -= 1
+    increment = (X >= np.take_along_axis(edges, idx + 1, axis=1)) & (idx != N_bins - 1)
+    idx[increment] += 1
+    flat = idx + (np.arange(len(X)) * N_bins)[:, np.newaxis]
+    hist = np.bincount(flat.ravel(), minlength=len(X) * N_bins).reshape(len(X), N_bins)
+
+    hist_smooth = ndimage.uniform_filter1d(hist, size=N, axis=1, mode="nearest")
+    imax = np.argmax(hist_smooth, axis=1)
+    return edges[np.arange(len(X)), imax].reshape(Sxx.shape[:-1]).astype(Sxx.dtype, copy=False)
+
+
+def remove_background_along_axis(Sxx, mode='median', N=25, N_bins=50):
+    """``sound.remove_background_along_axis`` (along time) of each spectrogram of ``Sxx``."""
+    if mode == 'ale':
+        noise_profile = ale_profile(Sxx, N=7, N_bins=N_bins)
+    elif mode == 'median':
+        noise_profile = np.median(Sxx, axis=-1)
+    elif mode == 'mean':
+        noise_profile = np.mean(Sxx, axis=-1)
+    noise_profile = ndimage.uniform_filter1d(noise_profile, size=N, axis=-1, mode="nearest")
+    Sxx_out = Sxx - noise_profile[..., np.newaxis]
+    Sxx_out[Sxx_out < 0] = 0
+    return Sxx_out, noise_profile
+
+
+def envelope(s, mode='fast', Nt=512):
+    """``sound.envelope`` (``mode='fast'``) of each row of ``s``."""
+    if mode != 'fast':
+        raise ValueError("Only the 'fast' envelope is batched")
+    K = s.shape[-1] // Nt
+    return np.max(np.abs(s[..., :K * Nt].reshape(s.shape[:-1] + (K, Nt))), axis=-1)
+
+
+# Batched counterpart of each function used by the intermediate graph
+BATCH_FUNCTIONS = {
+    sound.spectrogram: spectrogram,
+    sound.pcen: pcen,
+    sound.remove_background: remove_background,
+    sound.median_equalizer: median_equalizer,
+    sound.remove_background_along_axis: remove_background_along_axis,
+    util.power2dB: power2dB,
+    util.dB2power: util.dB2power,
+    sound.envelope: envelope,
+}
+
+
+def _batched(func):
+    if func in BATCH_FUNCTIONS.values():
+        return func
+    return BATCH_FUNCTIONS[func]
+
+
+def batch_intermediates(intermediates):
+    """Returns the intermediate graph with every step replaced by its batched counterpart."""
+    return [
+        type(step)(step.outputs, step.inputs, _batched(step.func), **step.params)
+        for step in intermediates
+    ]
+
+
+def entropy(x, axis=-1):
+    """``util.entropy`` of each series of ``x`` along ``axis``."""
+    n = x.shape[axis]
+    if n == 1:
+        return np.zeros(np.delete(x.shape, axis))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pmf = x / np.sum(x, axis=axis, keepdims=True)
+    pmf[pmf == 0] = _tiny(pmf)
+    H = -np.sum(pmf * np.log(pmf), axis=axis) / np.log(n)
+    # series with only zeros have an entropy of 1
+    return np.where(np.any(x, axis=axis), H, 1.0)[()]
+
+
+def acoustic_complexity_index(Sxx):
+    aci_xx = np.abs(np.diff(Sxx, axis=-1)) / np.sum(Sxx, axis=-1)[..., np.newaxis]
+    aci_per_bin = np.sum(aci_xx, axis=-1)
+    return aci_xx, aci_per_bin, np.sum(aci_per_bin, axis=-1)
+
+
+def spectral_events(Sxx_dB, tn, ext, dB_threshold=6, rejectDuration=0.1):
+    dt = tn[1] - tn[0]
+    n_frames = Sxx_dB.shape[-1]
+
+    EVN = Sxx_dB >= dB_threshold
+    kernel = np.ones((1,) * (EVN.ndim - 1) + (int(round(rejectDuration / dt)) + 1,))
+    EVN = ndimage.binary_erosion(EVN, structure=kernel)
+    EVN = ndimage.binary_dilation(EVN, structure=kernel)
+
+    total = np.sum(EVN, axis=-1)
+    count = np.sum(EVN[..., 1:] & ~EVN[..., :-1], axis=-1) + EVN[..., 0]
+    EVNsum = total * dt
+    return (
+        EVNsum / (dt * n_frames),
+        np.where(count > 0, total / np.maximum(count, 1) * dt, 0),
+        count / ((n_frames - 1) * dt),
+        EVN,
+    )
+
+
+def spectral_cover(Sxx_dB, fn, dB_threshold=3, flim_LF=(0, 1000), flim_MF=(1000, 10000),
+                   flim_HF=(10000, 20000)):
+    cover = np.mean(Sxx_dB >= dB_threshold, axis=-1)
+    return tuple(np.mean(cover[..., util.index_bw(fn, band)], axis=-1) for band in (flim_LF, flim_MF, flim_HF))
+
+
+def frequency_entropy(X):
+    return entropy(np.mean(X, axis=-1)), entropy(X)
+
+
+def temporal_entropy(env):
+    return entropy(env**2)
+
+
+def acoustic_entropy(env, Sxx_power):
+    return temporal_entropy(env) * entropy(np.mean(Sxx_power, axis=-1))
+
+
+def _band_scores(Sxx, fn, fmin, fmax, bin_step, dB_threshold):
+    """
+    Fraction of the cells of each frequency band at most ``-dB_threshold`` dB
+    below the maximum of the spectrogram, as in the maad ADI and AEI.
+    """
+    ratio = Sxx / Sxx.max(axis=(-2, -1), keepdims=True)
+    ratio[ratio == 0] = _tiny(ratio)
+    above = 20 * np.log10(ratio) >= dB_threshold
+    scores = []
+    for ii in range(int((fmax - fmin) // bin_step)):
+        f0 = int(fmin + bin_step * ii)
+        rows = util.index_bw(fn, (f0, int(f0 + bin_step)))
+        band = above[..., rows, :]
+        scores.append(np.mean(np.sum(band, axis=-2) / band.shape[-2], axis=-1))
+    return np.stack(scores, axis=-1)
+
+
+def diversity(s, index="shannon"):
+    """Diversity of the band scores ``s`` along the last axis, as in the maad ADI."""
+    if index == "shannon":
+        return entropy(s) * np.log(s.shape[-1])
+    p = (s / np.sum(s, axis=-1, keepdims=True))**2
+    if index == "simpson":
+        return 1 - np.sum(p, axis=-1)
+    return 1 / np.sum(p, axis=-1)
+
+
+def gini(s):
+    """Gini coefficient of the band scores ``s`` along the last axis, as in the maad AEI."""
+    s = np.sort(s, axis=-1)
+    n = s.shape[-1]
+    total = np.sum(s, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        G = (2 * np.sum(s * np.arange(1, n + 1), axis=-1) / total - (n + 1)) / n
+    # Gini of null scores is 0
+    return np.where(total == 0, 0, G)
+
+
+def acoustic_diversity_index(Sxx, fn, fmin=0, fmax=20000, bin_step=1000, dB_threshold=-50, index="shannon"):
+    return diversity(_band_scores(Sxx, fn, fmin, fmax, bin_step, dB_threshold), index)
+
+
+def acoustic_eveness_index(Sxx, fn, fmin=0, fmax=20000, bin_step=500, dB_threshold=-50):
+    return gini(_band_scores(Sxx, fn, fmin, fmax, bin_step, dB_threshold))
+
+
+def soundscape_index(Sxx_power, fn, flim_bioPh=(1000, 10000), flim_antroPh=(0, 1000), R_compatible='soundecology'):
+    if R_compatible == 'soundecology':
+        bin_step = flim_antroPh[1] - flim_antroPh[0]
+    else:
+        bin_step = 1000
+    # util.into_bins along the frequency axis
+    edges = np.arange(fn[0], fn[-1] + bin_step, bin_step)
+    rows = [(fn >= b0) & (fn < b1) for b0, b1 in zip(edges[:-1], edges[1:])]
+    Sxx_bins = np.stack([np.mean(Sxx_power[..., r, :], axis=-2) for r in rows], axis=-2)
+    Sxx_bins = Sxx_bins * np.mean([np.sum(r) for r in rows])
+    bins = edges[:-1]
+    if R_compatible != 'soundecology':
+        Sxx_bins = Sxx_bins[..., bins >= 1000, :]
+        bins = bins[bins >= 1000]
+
+    bioPh = np.sum(Sxx_bins[..., util.index_bw(bins, flim_bioPh), :], axis=(-2, -1))
+    antroPh = np.sum(Sxx_bins[..., util.index_bw(bins, flim_antroPh), :], axis=(-2, -1))
+    return (bioPh - antroPh) / (bioPh + antroPh), bioPh / antroPh, antroPh, bioPh
+
+
+def bioacoustics_index(Sxx, fn, flim=(2000, 15000), R_compatible='soundecology'):
+    Sxx_max = Sxx.max(axis=(-2, -1), keepdims=True)
+    if R_compatible == 'soundecology':
+        return bioacoustics_from_mean(np.mean(Sxx / Sxx_max, axis=-1), fn, flim)
+    meanPSDxx_norm = np.mean(Sxx**2 / Sxx_max**2, axis=-1)
+    return np.sqrt(np.sum(meanPSDxx_norm, axis=-1)) * (fn[1] - fn[0])
+
+
+def bioacoustics_from_mean(meanSxx, fn, flim=(2000, 15000)):
+    """soundecology BI from the time average of the spectrogram normalized by its maximum."""
+    indf = util.index_bw(fn, flim)
+    meanSxx = meanSxx.copy()
+    meanSxx[meanSxx == 0] = _tiny(meanSxx)
+    meanSxxdB = 20 * np.log10(meanSxx)[..., indf]
+    meanSxxdB = meanSxxdB - np.min(meanSxxdB, axis=-1, keepdims=True)
+    return np.sum(meanSxxdB, axis=-1) / (fn[1] - fn[0])
@@ -0,0 +1,175 @@
+"""
+Persistent cache of per-file index results.
+
+Entries are keyed by the identity of the audio file (resolved path, size and
+modification time, or a hash of its content), the index name and a
+fingerprint of everything that changes its outputs (see
+``AcousticIndices.result_cache_entries``). A run with one more selected index
+only computes the missing (file, index) pairs and reads the others back.
+
+The store is a single SQLite database, safe to share between the worker
+processes of the runner and between threads: each thread (and each process)
+opens its own connection. Entries are evicted least recently used first when
+the total size of the stored values exceeds ``max_bytes``.
+"""
+
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+DEFAULT_MAX_BYTES = 2 * 1024**3
+
+# Eviction is checked after this fraction of max_bytes has been written
+_EVICTION_STEP = 0.01
+
+
+class ResultCache(object):
+    """
+    On-disk cache of index outputs per audio file.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory of the cache database, created if needed.
+    entries : dict
+        Selected indices, in output order, mapping each index name to its
+        parameter fingerprint and the names of its outputs.
+    max_bytes : int, optional
+        Size limit of the stored values.
+    hash_content : bool, optional
+        If True, files are identified by a hash of their content instead of
+        path, size and modification time, so moved or copied files still hit.
+    """
+    def __init__(self, cache_dir, entries, max_bytes=DEFAULT_MAX_BYTES, hash_content=False):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db_path = os.path.join(cache_dir, "index_results.sqlite")
+        self.entries = dict(entries)
+        self.indices = list(self.entries)
+        self.max_bytes = max_bytes
+        self.hash_content = hash_content
+        self._local = threading.local()
+        self._written = 0
+
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " file_key TEXT, index_key TEXT, data BLOB, size INTEGER, last_access REAL,"
+                " PRIMARY KEY (file_key, index_key))"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access)"
+            )
+
+    def __getstate__(self):
+        # Each process opens its own connections
+        state = self.__dict__.copy()
+        del state["_local"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        """SQLite connection of the calling thread, opened on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=60)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def file_key(self, file_path):
+        if self.hash_content:
+            digest = hashlib.blake2b(digest_size=20)
+            with open(file_path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+            return "blake2b:" + digest.hexdigest()
+        stat = os.stat(file_path)
+        return f"{os.path.realpath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+    def _index_key(self, name):
+        return f"{name}:{self.entries[name][0]}"
+
+    def lookup(self, file_path):
+        """
+        Returns the cached outputs of a file, merged in one dict, and the
+        names of the selected indices that are not cached.
+        """
+        file_key = self.file_key(file_path)
+        keys = {self._index_key(name): name for name in self.indices}
+        rows = self.connection.execute(
+            f"SELECT index_key, data FROM results WHERE file_key = ? AND index_key IN ({','.join('?' * len(keys))})",
+            [file_key, *keys],
+        ).fetchall()
+
+        cached, hits = {}, set()
+        for index_key, data in rows:
+            cached.update(pickle.loads(data))
+            hits.add(keys[index_key])
+        if rows:
+            with self.connection:
+                self.connection.executemany(
+                    "UPDATE results SET last_access = ? WHERE file_key = ? AND index_key = ?",
+                    [(time.time(), file_key, index_key) for index_key, _ in rows],
+                )
+        return cached, [name for name in self.indices if name not in hits]
+
+    def store(self, file_path, values):
+        """Stores the outputs of a file, split per index. Partial indices are skipped."""
+        file_key = self.file_key(file_path)
+        now = time.time()
+        records = []
+        for name in self.indices:
+            outputs = self.entries[name][1]
+            if not outputs or not all(key in values for key in outputs):
+                continue
+            data = pickle.dumps({key: values[key] for key in outputs}, protocol=pickle.HIGHEST_PROTOCOL)
+            records.append((file_key, self._index_key(name), data, len(data), now))
+        if not records:
+            return
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)", records
+            )
+        self._written += sum(record[3] for record in records)
+        if self._written >= self.max_bytes * _EVICTION_STEP:
+            self.evict()
+
+    def order(self, values):
+        """Orders merged outputs as the selected indices."""
+        ordered = {
+            key: values[key]
+            for name in self.indices for key in self.entries[name][1] if key in values
+        }
+        ordered.update((key, value) for key, value in values.items() if key not in ordered)
+        return ordered
+
+    def evict(self):
+        """Deletes the least recently used entries until the cache fits ``max_bytes``."""
+        self._written = 0
+        with self.connection:
+            total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            excess = total - self.max_bytes
+            doomed = []
+            for file_key, index_key, size in self.connection.execute(
+                "SELECT file_key, index_key, size FROM results ORDER BY last_access"
+            ):
+                doomed.append((file_key, index_key))
+                excess -= size
+                if excess <= 0:
+                    break
+            self.connection.executemany(
+                "DELETE FROM results WHERE file_key = ? AND index_key = ?", doomed
+            )
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute("DELETE FROM results")
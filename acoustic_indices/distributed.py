@@ -0,0 +1,363 @@
+"""
+Index runs shared by several hosts through a shared directory.
+
+The coordinator (``plan``) splits a run into work units and writes them in
+the dataset directory of the run, next to the input DataFrame and the index
+configuration. Workers (``work``), on any host that sees the directory,
+claim units through lease files, calculate them with the runner and write
+each one as a part of the same partitioned dataset as a local run
+(``part-<unit>.parquet``), so ``io_utils.load_df_indices_parquet`` reads the
+result, partial or complete, as usual.
+
+A lease is created atomically (hard link of a fully written file) and
+renewed by its worker while the unit is calculated. A lease that has not been
+renewed for ``lease_seconds`` belongs to a dead worker and is taken over by
+the next worker that finds it; a unit calculated twice writes the same part
+twice, so the takeover is safe even when the first worker was only slow.
+Expiry uses the wall clocks of the hosts, so ``lease_seconds`` must be well
+above their skew. No other service is needed: several worker processes on
+one machine behave like several hosts.
+
+Layout of the run directory::
+
+    manifest.json      run identity (see ``runner``)
+    config.json        indices, precision, mode and file path column
+    input.parquet      rows to calculate, with their positions
+    units.json         row positions of each unit, longest first
+    leases/unit-<n>    current owner and expiry of a unit being calculated
+    part-<n>.parquet   results of unit n
+"""
+
+import glob
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+import warnings
+from functools import partial
+
+import numpy as np
+
+from acoustic_indices import runner
+from acoustic_indices.acoustic_indices_calculation import AcousticIndices
+from acoustic_indices.tuning import probe_files
+from utils import bin_store, io_utils
+
+CONFIG_NAME = "config.json"
+INPUT_NAME = "input.parquet"
+UNITS_NAME = "units.json"
+LEASES_DIR = "leases"
+
+# Audio per work unit: long enough to amortize the claim, short enough to
+# balance the hosts and to lose little work to a dead worker
+DEFAULT_UNIT_AUDIO_SECONDS = 1800.0
+DEFAULT_LEASE_SECONDS = 300.0
+DEFAULT_POLL_SECONDS = 5.0
+
+
+def _write_json(path, obj):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def plan(df_init, file_path_col, aidx, dataset_path, mode="file", block_duration=60.0,
+         unit_audio_seconds=DEFAULT_UNIT_AUDIO_SECONDS):
+    """
+    Prepares a distributed run of the indices selected in ``aidx`` over
+    ``df_init`` in ``dataset_path``, and returns the number of units.
+
+    Planning the same run again (same rows and configuration) keeps its
+    units and completed parts, so the workers resume; another run in the
+    same directory replaces it. A local run (``runner``) of the same rows and
+    configuration has the same identity, but its parts hold other rows than
+    the units: the parts of an unfinished local run are removed, with a
+    warning, and a completed local run is left untouched (``ValueError``).
+
+    Parameters
+    ----------
+    df_init : pd.DataFrame
+        Rows to calculate; the audio paths must be valid on every host.
+    file_path_col : str
+        Column with the audio file paths.
+    aidx : AcousticIndices
+        Instance with the selected indices (``set_indices``).
+    dataset_path : str
+        Shared directory of the run and of its results.
+    mode : str, optional
+        'file', 'batch' or 'streaming', as in the indices page.
+    block_duration : float, optional
+        Block duration of the streaming mode, in seconds.
+    unit_audio_seconds : float, optional
+        Audio duration per unit. Units hold at least one file.
+
+    Raises
+    ------
+    ValueError
+        If ``dataset_path`` holds the completed local run of the same rows
+        and configuration.
+    """
+    key = runner.checkpoint_key(aidx, mode, block_duration)
+    manifest = runner._open_run(
+        dataset_path, runner._run_id(df_init, file_path_col, key), key, len(df_init)
+    )
+    units_path = os.path.join(dataset_path, UNITS_NAME)
+    if os.path.exists(units_path):
+        return len(_read_json(units_path))
+
+    # Parts of a local run of the same configuration hold other rows
+    parts = sorted(glob.glob(os.path.join(dataset_path, io_utils.DATASET_PART_PATTERN)))
+    if parts and manifest.get("complete"):
+        raise ValueError(
+            f"{dataset_path} already holds the completed results of this run, calculated locally; "
+            "remove it to calculate them again"
+        )
+    if parts:
+        warnings.warn(
+            f"Removing {len(parts)} part(s) of an unfinished local run in {dataset_path}; "
+            "the distributed run calculates all the rows again"
+        )
+    for part_path in parts:
+        os.remove(part_path)
+    os.makedirs(os.path.join(dataset_path, LEASES_DIR), exist_ok=True)
+    _write_json(os.path.join(dataset_path, CONFIG_NAME), {
+        "indices": list(aidx.indices),
+        "dtype": np.dtype(aidx.dtype).name,
+        "compact": aidx.compact,
+        "mode": mode,
+        "block_duration": float(block_duration),
+        "file_path_col": file_path_col,
+        "checkpoint_key": key,
+        "run_id": manifest["run_id"],
+    })
+    df_rows = df_init.assign(**{io_utils.DATASET_ROW_COL: np.arange(len(df_init))})
+    io_utils.save_df_complex_parquet(df_rows, os.path.join(dataset_path, INPUT_NAME))
+
+    # Longest files first, cut into units of about unit_audio_seconds
+    durations, _ = probe_files(df_init, file_path_col)
+    order = np.argsort(-durations, kind="stable")
+    units, unit, unit_seconds = [], [], 0.0
+    for position in order:
+        if unit and unit_seconds + durations[position] > unit_audio_seconds:
+            units.append(unit)
+            unit, unit_seconds = [], 0.0
+        unit.append(int(position))
+        unit_seconds += durations[position]
+    if unit:
+        units.append(unit)
+    # Written last: workers wait for it
+    _write_json(units_path, units)
+    return len(units)
+
+
+class _Lease(object):
+    """Lease file of one unit, owned by ``token`` once ``acquire`` succeeds."""
+    def __init__(self, run_dir, unit, token, lease_seconds):
+        self.path = os.path.join(run_dir, LEASES_DIR, f"unit-{unit:06d}")
+        self.token = token
+        self.lease_seconds = lease_seconds
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _content(self):
+        return {
+            "owner": self.token,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "expires": time.time() + self.lease_seconds,
+        }
+
+    def _create(self):
+        tmp_path = f"{self.path}.{self.token}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._content(), f)
+        try:
+            # link() fails if the lease exists, also on network file systems
+            os.link(tmp_path, self.path)
+            return True
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(tmp_path)
+
+    def _expired(self):
+        try:
+            expires = _read_json(self.path)["expires"]
+        except FileNotFoundError:
+            return True
+        except (OSError, ValueError, KeyError):
+            return False
+        return expires < time.time()
+
+    def acquire(self):
+        if self._create():
+            return True
+        if not self._expired():
+            return False
+        # Only one of the workers finding the expired lease renames it away
+        stale_path = f"{self.path}.{self.token}.stale"
+        try:
+            os.rename(self.path, stale_path)
+        except FileNotFoundError:
+            return False
+        try:
+            expires = _read_json(stale_path)["expires"]
+        except (OSError, ValueError, KeyError):
+            expires = 0
+        if expires >= time.time():
+            # Another worker took the unit over in the meantime: give its lease back
+            try:
+                os.link(stale_path, self.path)
+            except FileExistsError:
+                pass
+            os.remove(stale_path)
+            return False
+        os.remove(stale_path)
+        return self._create()
+
+    def renew(self):
+        try:
+            if _read_json(self.path).get("owner") != self.token:
+                return False
+        except (OSError, ValueError):
+            return False
+        _write_json(self.path, self._content())
+        return True
+
+    def release(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            if _read_json(self.path).get("owner") == self.token:
+                os.remove(self.path)
+        except (OSError, ValueError):
+            pass
+
+    def keep_alive(self):
+        """Renews the lease in the background until ``release``."""
+        def beat():
+            while not self._stop.wait(self.lease_seconds / 3):
+                if not self.renew():
+                    return
+        self._thread = threading.Thread(target=beat, daemon=True)
+        self._thread.start()
+
+
+def status(run_dir):
+    """Counts the units of a run that are done, leased and pending, and lists the pending ones."""
+    units = _read_json(os.path.join(run_dir, UNITS_NAME))
+    is_done = [os.path.exists(runner._part_path(run_dir, unit)) for unit in range(len(units))]
+    done = sum(is_done)
+    leased = len([name for name in os.listdir(os.path.join(run_dir, LEASES_DIR)) if name.startswith("unit-")
+                  and "." not in name])
+    rows_done = sum(len(rows) for rows, ok in zip(units, is_done) if ok)
+    return {
+        "units": len(units),
+        "done": done,
+        "leased": leased,
+        "pending": len(units) - done,
+        "pending_units": [unit for unit, ok in enumerate(is_done) if not ok],
+        "rows": sum(len(rows) for rows in units),
+        "rows_done": rows_done,
+    }
+
+
+def _finish(run_dir):
+    manifest = _read_json(os.path.join(run_dir, runner.MANIFEST_NAME))
+    if not manifest.get("complete"):
+        manifest.update(complete=True, n_parts=len(_read_json(os.path.join(run_dir, UNITS_NAME))))
+        runner._write_manifest(run_dir, manifest)
+        bin_store.write(run_dir)
+
+
+def work(run_dir, lease_seconds=DEFAULT_LEASE_SECONDS, wait=True, poll_seconds=DEFAULT_POLL_SECONDS,
+         audio_cache=None):
+    """
+    Claims and calculates units of the run in ``run_dir`` until none is left,
+    and returns the number of units calculated by this worker.
+
+    Parameters
+    ----------
+    run_dir : str
+        Run directory prepared by ``plan``.
+    lease_seconds : float, optional
+        Time after which the unit of a worker that stopped renewing its
+        lease is taken over.
+    wait : bool, optional
+        If True, the worker waits while units are leased by other workers,
+        until every unit is done, so it can take over those of dead workers.
+        Otherwise it returns as soon as it finds nothing to claim.
+    poll_seconds : float, optional
+        Interval between scans while waiting.
+    audio_cache : audio_cache.AudioCache, optional
+        Local cache of decoded audio.
+    """
+    units_path = os.path.join(run_dir, UNITS_NAME)
+    while not os.path.exists(units_path):
+        if not wait:
+            return 0
+        time.sleep(poll_seconds)
+    config = _read_json(os.path.join(run_dir, CONFIG_NAME))
+    units = _read_json(units_path)
+    df_rows = io_utils.load_df_complex_parquet(os.path.join(run_dir, INPUT_NAME))
+
+    aidx = AcousticIndices(compact=config["compact"], dtype=np.dtype(config["dtype"]))
+    aidx.set_indices(config["indices"])
+    if runner.checkpoint_key(aidx, config["mode"], config["block_duration"]) != config["checkpoint_key"]:
+        # Another maad version or index definition would mix different results
+        raise RuntimeError(f"The index configuration of this host does not match the run in {run_dir}")
+
+    streaming_method = None
+    batch_method = None
+    if config["mode"] == "streaming":
+        streaming_method = partial(aidx.calculate_streaming, block_duration=config["block_duration"])
+    elif config["mode"] == "batch":
+        batch_method = aidx.calculate_batch
+
+    token = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    calculated = 0
+    while True:
+        pending = [unit for unit in range(len(units)) if not os.path.exists(runner._part_path(run_dir, unit))]
+        if not pending:
+            _finish(run_dir)
+            return calculated
+
+        claimed = False
+        for unit in pending:
+            lease = _Lease(run_dir, unit, token, lease_seconds)
+            if not lease.acquire():
+                continue
+            claimed = True
+            lease.keep_alive()
+            try:
+                # Done by another worker between the scan and the claim
+                if not os.path.exists(runner._part_path(run_dir, unit)):
+                    runner._extract_indices_worker(
+                        (df_rows.iloc[units[unit]], unit),
+                        file_path_col=config["file_path_col"],
+                        acoustic_indices_methods=aidx.acoustic_indices_methods,
+                        pre_calculation_method=aidx.pre_calculation_method,
+                        temp_dir=run_dir,
+                        streaming_method=streaming_method,
+                        batch_method=batch_method,
+                        checkpoint=True,
+                        audio_cache=audio_cache,
+                    )
+                    calculated += 1
+            finally:
+                lease.release()
+            break
+
+        if not claimed:
+            if not wait:
+                return calculated
+            time.sleep(poll_seconds)
@@ -0,0 +1,152 @@
+"""
+Local background jobs for long index computations and dataset loads.
+
+The UI submits ``runner.calculate_acoustic_indices`` runs (and directory
+scans, see ``pages/load_data.py``) here instead of holding a server thread
+for the whole computation. Each job runs in its own
+thread of the server process (parallel runs still fan out to a process
+pool), reports the files processed through the runner's ``progress`` hook and
+is cancelled through its ``cancel_event``. The pages poll ``status`` for the
+progress, throughput and ETA, and ``partial`` for whatever the job has
+published so far (e.g. the first rows of a dataset being loaded).
+"""
+
+import threading
+import time
+import traceback
+import uuid
+
+from acoustic_indices.runner import Cancelled
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class Job(object):
+    """State of one submitted job."""
+    def __init__(self, job_id, total):
+        self.id = job_id
+        self.total = total
+        self.done = 0
+        self.status = QUEUED
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.partial = None
+        self.error = None
+        self.cancel_event = threading.Event()
+
+    def progress(self, done, total=None, partial=None):
+        self.done = done
+        if total is not None:
+            self.total = total
+        if partial is not None:
+            self.partial = partial
+
+    def snapshot(self):
+        """Returns the job state as a JSON-serializable dict."""
+        elapsed = 0.0
+        if self.started is not None:
+            elapsed = (self.finished or time.time()) - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / rate if rate > 0 and self.total is not None else None
+        return {
+            "id": self.id,
+            "status": self.status,
+            "done": self.done,
+            "total": self.total,
+            "elapsed_s": elapsed,
+            "files_per_s": rate,
+            "eta_s": eta,
+            "error": self.error,
+        }
+
+
+class JobManager(object):
+    """
+    Runs submitted jobs in background threads, at most ``max_running`` at a
+    time; the others wait in the ``queued`` state.
+
+    Parameters
+    ----------
+    max_running : int, optional
+        Number of jobs running concurrently.
+    keep_finished : int, optional
+        Number of finished jobs kept for ``status`` and ``result``.
+    """
+    def __init__(self, max_running=1, keep_finished=20):
+        self.keep_finished = keep_finished
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(max_running)
+
+    def submit(self, func, total, *args, **kwargs):
+        """
+        Starts ``func(*args, progress=..., cancel_event=..., **kwargs)`` in
+        the background and returns the job id. ``total`` is the number of
+        files, used for the ETA until ``func`` reports its own; None if it is
+        not known in advance.
+        """
+        job = Job(uuid.uuid4().hex, total)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._forget_finished()
+        thread = threading.Thread(
+            target=self._run, args=(job, func, args, kwargs), name=f"job-{job.id[:8]}", daemon=True
+        )
+        thread.start()
+        return job.id
+
+    def _run(self, job, func, args, kwargs):
+        with self._slots:
+            if job.cancel_event.is_set():
+                job.status = CANCELLED
+                job.finished = time.time()
+                return
+            job.status = RUNNING
+            job.started = time.time()
+            try:
+                job.result = func(*args, progress=job.progress, cancel_event=job.cancel_event, **kwargs)
+                job.status = DONE
+            except Cancelled:
+                job.status = CANCELLED
+            except Exception as e:
+                traceback.print_exc()
+                job.error = f"{type(e).__name__}: {e}"
+                job.status = FAILED
+            finally:
+                job.finished = time.time()
+
+    def _forget_finished(self):
+        finished = [job for job in self._jobs.values() if job.finished is not None]
+        finished.sort(key=lambda job: job.finished)
+        for job in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job.id]
+
+    def status(self, job_id):
+        """Returns the snapshot of a job, or None if it is unknown."""
+        job = self._jobs.get(job_id)
+        return None if job is None else job.snapshot()
+
+    def result(self, job_id):
+        """Returns the value returned by a finished job."""
+        job = self._jobs.get(job_id)
+        return None if job is None else job.result
+
+    def partial(self, job_id):
+        """Returns the last partial result published by a job through ``progress``."""
+        job = self._jobs.get(job_id)
+        return None if job is None else job.partial
+
+    def cancel(self, job_id):
+        """Requests the cancellation of a job; it stops at its next check."""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            job.cancel_event.set()
+
+
+# Job manager shared by the pages of the app
+JOBS = JobManager()
@@ -0,0 +1,117 @@
+"""
+Accuracy of the reduced-precision index pipeline against float64.
+
+``compare_precision`` runs the selected indices twice on the same files,
+once with the default float64 graph and once with ``dtype``, and reports
+the error of every output. Measured with ``np.float32`` and all the
+available indices (error relative to the largest float64 magnitude of each
+output) on five 60 s, 44.1 kHz recordings and on sixty 2 s segments of
+them:
+
+================== ======= ======= ==========================================
+Output             60 s    2 s     Notes
+================== ======= ======= ==========================================
+aci_xx             6.5e-05 9.6e-05
+aci_per_bin        3.6e-05 3.7e-04
+aci_sum            1.5e-06 2.0e-06
+EVNspFract_per_bin 1.6e-03 0       a few frames flip at the 6 dB threshold
+EVNspMean_per_bin  5.9e-04 0
+EVNspCount_per_bin 0       0
+EVNsp              1       0       1.5e-07 of the cells differ
+LFC                1.1e-03 2.2e-03 frames flip at the 3 dB threshold
+MFC                1.3e-03 3.4e-04
+HFC                3.0e-03 4.4e-03
+Ht                 1.5e-09 1.5e-08 envelope entropy is taken in float64
+Hf                 1.6e-04 7.8e-05
+Ht_per_bin         4.0e-04 1.4e-03
+ADI                0       3.0e-06
+AEI                0       1.4e-04
+NDSI               1.5e-06 4.0e-07
+rBA                1.0e-08 9.1e-08
+AnthroEnergy       7.7e-08 1.2e-07
+BioEnergy          6.8e-08 7.9e-08
+BI                 1.0e-06 5.3e-07
+H                  2.4e-09 1.5e-08
+================== ======= ======= ==========================================
+
+The 'ale' noise profile histogram is taken in float64 in both modes, but
+its range comes from the dB spectrogram, whose quietest cells are rounded
+(or flushed to zero) in float32. The outputs that depend on the noise
+profile (spectral events, spectral cover, ``Hf``, ``Ht_per_bin``) therefore
+depend on the recordings: errors of about 1e-1 on ``LFC`` and 1e-2 on
+``Ht_per_bin`` have been measured on other datasets, and recordings with
+digital silence (runs of exact zeros) give errors of order 1 on the cover
+indices. Run ``compare_precision`` on a sample of the dataset before using
+float32 for these outputs; the other indices stay within about 1e-4.
+"""
+
+import numpy as np
+import pandas as pd
+
+from maad import sound
+
+from acoustic_indices.acoustic_indices_calculation import AcousticIndices
+
+
+def _calculate(aidx, s, fs):
+    pre_calc_vars = aidx.pre_calculation_method(s, fs)
+    indices = {}
+    for method in aidx.acoustic_indices_methods:
+        indices.update(method(pre_calc_vars))
+    return indices
+
+
+def compare_precision(file_paths, indices=None, dtype=np.float32):
+    """
+    Compares the indices calculated in ``dtype`` with the float64 ones.
+
+    Parameters
+    ----------
+    file_paths : list of str
+        Audio files used in the comparison.
+    indices : list of str, optional
+        Index identifiers, as in ``AcousticIndices.set_indices``. Defaults to
+        all the available indices.
+    dtype : numpy dtype, optional
+        Precision being evaluated.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per output with the maximum absolute error, the maximum
+        error relative to the largest float64 magnitude of the output and
+        the mean absolute error, over all the files.
+    """
+    reference = AcousticIndices(compact=True)
+    reduced = AcousticIndices(compact=True, dtype=dtype)
+    if indices is None:
+        indices = list(reference.available_indices.values())
+    reference.set_indices(indices)
+    reduced.set_indices(indices)
+
+    errors = {}
+    for file_path in file_paths:
+        s, fs = sound.load(file_path)
+        expected = _calculate(reference, s, fs)
+        actual = _calculate(reduced, s, fs)
+        for key, value in expected.items():
+            value = np.asarray(value, dtype=np.float64)
+            diff = np.abs(np.asarray(actual[key], dtype=np.float64) - value)
+            scale = np.max(np.abs(value)) if value.size else 0.0
+            stats = errors.setdefault(key, {"max_abs_error": 0.0, "max_rel_error": 0.0, "sum": 0.0, "n": 0})
+            if diff.size == 0:
+                continue
+            stats["max_abs_error"] = max(stats["max_abs_error"], np.nanmax(diff))
+            stats["max_rel_error"] = max(stats["max_rel_error"], np.nanmax(diff) / scale if scale else 0.0)
+            stats["sum"] += np.nansum(diff)
+            stats["n"] += diff.size
+
+    return pd.DataFrame([
+        {
+            "output": key,
+            "max_abs_error": stats["max_abs_error"],
+            "max_rel_error": stats["max_rel_error"],
+            "mean_abs_error": stats["sum"] / stats["n"] if stats["n"] else 0.0,
+        }
+        for key, stats in errors.items()
+    ]).set_index("output")
@@ -0,0 +1,141 @@
+"""
+Per-stage instrumentation of the index pipeline.
+
+A ``StageProfiler`` attached to ``AcousticIndices`` records, for every file,
+the wall time, CPU time and peak traced allocation of each intermediate
+(``sound.spectrogram``, ``sound.pcen``, ``sound.remove_background``...) and
+of each index. Intermediates are timed after their inputs are resolved, so
+stages never nest and their times add up. Allocations are traced with
+``tracemalloc``, which numpy reports to; tracing slows small Python
+allocations down, so the profiler is off unless requested.
+
+``summarize`` aggregates the records of a run into one row per stage.
+"""
+
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+import pandas as pd
+
+RECORD_COLUMNS = ["file", "kind", "stage", "wall_s", "cpu_s", "peak_mb"]
+
+
+class StageProfiler(object):
+    """
+    Collects the stage records of the files processed in this process.
+
+    Parameters
+    ----------
+    trace_memory : bool, optional
+        If True, the peak allocation of each stage is traced.
+    """
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.records = []
+        self.current_file = None
+        self._tracing = False
+
+    @contextmanager
+    def file(self, label):
+        """Tags the stages recorded inside the block with ``label``."""
+        previous, self.current_file = self.current_file, label
+        try:
+            yield
+        finally:
+            self.current_file = previous
+
+    @contextmanager
+    def stage(self, kind, name):
+        """Records the block as one stage of the current file."""
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            record = {
+                "file": self.current_file,
+                "kind": kind,
+                "stage": name,
+                "wall_s": time.perf_counter() - wall,
+                "cpu_s": time.process_time() - cpu,
+                "peak_mb": None,
+            }
+            if self.trace_memory:
+                record["peak_mb"] = (tracemalloc.get_traced_memory()[1] - base) / 1024**2
+            self.records.append(record)
+
+    def stop(self):
+        """Stops the allocation tracing started by this profiler."""
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+    def drain(self):
+        """Returns and clears the records collected so far."""
+        records, self.records = self.records, []
+        return records
+
+    def to_frame(self):
+        return pd.DataFrame(self.records, columns=RECORD_COLUMNS)
+
+
+def maybe_stage(profiler, kind, name):
+    """``profiler.stage(kind, name)``, or a no-op when ``profiler`` is None."""
+    return nullcontext() if profiler is None else profiler.stage(kind, name)
+
+
+def maybe_file(profiler, label):
+    """``profiler.file(label)``, or a no-op when ``profiler`` is None."""
+    return nullcontext() if profiler is None else profiler.file(label)
+
+
+def summarize(records):
+    """
+    Aggregates stage records into one row per stage.
+
+    Parameters
+    ----------
+    records : pd.DataFrame
+        Records with the ``RECORD_COLUMNS``, e.g. ``StageProfiler.to_frame()``.
+
+    Returns
+    -------
+    pd.DataFrame
+        Per stage: number of calls, total and mean wall time, total CPU time,
+        maximum peak allocation and share of the total wall time, sorted by
+        total wall time.
+    """
+    if records.empty:
+        return pd.DataFrame(columns=[
+            "kind", "stage", "calls", "wall_total_s", "wall_mean_ms",
+            "cpu_total_s", "peak_max_mb", "wall_share_pct",
+        ])
+    summary = records.groupby(["kind", "stage"], sort=False).agg(
+        calls=("wall_s", "size"),
+        wall_total_s=("wall_s", "sum"),
+        wall_mean_ms=("wall_s", "mean"),
+        cpu_total_s=("cpu_s", "sum"),
+        peak_max_mb=("peak_mb", "max"),
+    ).reset_index()
+    summary["wall_mean_ms"] *= 1000
+    summary["wall_share_pct"] = 100 * summary["wall_total_s"] / summary["wall_total_s"].sum()
+    return summary.sort_values("wall_total_s", ascending=False, ignore_index=True)
+
+
+def save_profile(records, output_dir):
+    """
+    Writes the stage records and their summary next to the indices dataset,
+    as ``acoustic_indices_profile.parquet`` and
+    ``acoustic_indices_profile_summary.csv``. Returns the summary.
+    """
+    summary = summarize(records)
+    records.to_parquet(os.path.join(output_dir, "acoustic_indices_profile.parquet"), index=False)
+    summary.to_csv(os.path.join(output_dir, "acoustic_indices_profile_summary.csv"), index=False)
+    return summary
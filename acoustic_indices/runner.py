@@ -0,0 +1,608 @@
+"""
+Acoustic index runner used by the UI.
+
+Same contract as ``maui.acoustic_indices.calculate_acoustic_indices``, but the
+per-chunk results are written as Parquet through ``io_utils`` instead of CSV,
+so array outputs (``aci_per_bin``, ``EVNspCount_per_bin``...) keep their
+numpy dtype end to end instead of being stringified and parsed back. Given a
+``dataset_path``, the chunks form a partitioned Parquet dataset written as the
+run goes, so the results are never held in memory all at once.
+"""
+
+import gc
+import hashlib
+import json
+import os
+import queue
+import shutil
+import time
+import multiprocessing as mp
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from acoustic_indices.profiling import maybe_file, maybe_stage
+from acoustic_indices.tuning import MIN_CHUNKS_PER_WORKER, probe_files
+from utils import audio_cache as audio_cache_utils, bin_store, dataset_store, io_utils
+
+
+class Cancelled(Exception):
+    """Raised by ``calculate_acoustic_indices`` when its cancel event is set."""
+
+
+MANIFEST_NAME = "manifest.json"
+# A run that replaces the results of another one is written here first
+STAGING_SUFFIX = ".partial"
+
+
+def _part_path(run_dir, fidx):
+    return os.path.join(run_dir, f"part-{fidx:06d}.parquet")
+
+
+def _completed_parts(run_dir):
+    """
+    Returns ``{fidx: positions}`` for the parts already written in
+    ``run_dir``, and the next free part number.
+    """
+    completed = {
+        int(os.path.basename(path)[len("part-"):-len(".parquet")]): positions
+        for path, positions in io_utils.read_parts_rows(run_dir).items()
+    }
+    return completed, max(completed, default=-1) + 1
+
+
+def _write_durably(df, path):
+    """Writes the chunk to a temporary name, syncs it and renames it into place."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    io_utils.save_df_indices_parquet(df, tmp_path)
+    with open(tmp_path, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _run_id(df_init, file_path_col, checkpoint_key):
+    """
+    Identifies a run by ``checkpoint_key``, the file list and the columns,
+    so only an identical run resumes. Each part records the rows it holds,
+    so the chunk size and order may change between runs.
+    """
+    identity = json.dumps({
+        "checkpoint_key": checkpoint_key,
+        "columns": [str(col) for col in df_init.columns],
+        "files": df_init[file_path_col].astype(str).tolist(),
+    })
+    return hashlib.sha1(identity.encode()).hexdigest()[:16]
+
+
+def checkpoint_key(aidx, mode="file", block_duration=60.0):
+    """
+    Identity of the index configuration of ``aidx`` computed in ``mode``
+    ('file', 'batch' or 'streaming'), used as the ``checkpoint_key`` of
+    ``calculate_acoustic_indices``.
+    """
+    return json.dumps({
+        "indices": aidx.result_cache_entries(streaming=mode == "streaming"),
+        "mode": mode,
+        "block_duration": float(block_duration) if mode == "streaming" else None,
+    })
+
+
+def _write_manifest(run_dir, manifest):
+    manifest_path = os.path.join(run_dir, MANIFEST_NAME)
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def _read_manifest(run_dir):
+    manifest_path = os.path.join(run_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def _open_run(run_dir, run_id, checkpoint_key, n_rows, resume=True):
+    """
+    Prepares the dataset directory of a run and returns its manifest. The
+    parts of a different run (or of any run, if not ``resume``) are removed.
+    """
+    manifest = _read_manifest(run_dir) if resume else None
+    if manifest is not None and manifest.get("run_id") != run_id:
+        manifest = None
+    if manifest is None:
+        if os.path.isdir(run_dir):
+            shutil.rmtree(run_dir)
+        os.makedirs(run_dir)
+        manifest = {
+            "run_id": run_id,
+            "checkpoint_key": checkpoint_key,
+            "n_rows": n_rows,
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "complete": False,
+        }
+        _write_manifest(run_dir, manifest)
+    return manifest
+
+
+def _staging_path(dataset_path):
+    return os.path.normpath(dataset_path) + STAGING_SUFFIX
+
+
+def _run_dir_for(dataset_path, run_id, resume):
+    """
+    Directory in which a run writes its parts: ``dataset_path`` itself when
+    it is empty or holds the same run (resumed), otherwise the staging
+    directory, so the previous results stay readable until the new run is
+    complete (see ``_publish``).
+    """
+    if not os.path.isdir(dataset_path) or not os.listdir(dataset_path):
+        return dataset_path
+    manifest = _read_manifest(dataset_path)
+    if resume and manifest is not None and manifest.get("run_id") == run_id:
+        return dataset_path
+    return _staging_path(dataset_path)
+
+
+def _publish(run_dir, dataset_path):
+    """Replaces ``dataset_path`` with the completed run in ``run_dir``, if it was staged."""
+    if run_dir == dataset_path:
+        return
+    old_path = os.path.normpath(dataset_path) + ".old"
+    shutil.rmtree(old_path, ignore_errors=True)
+    os.rename(dataset_path, old_path)
+    os.rename(run_dir, dataset_path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    # Derived columns belong to the previous results
+    shutil.rmtree(dataset_store.sidecar_dir(dataset_path), ignore_errors=True)
+
+
+def _load(path, profiler, audio_cache=None):
+    with maybe_file(profiler, path), maybe_stage(profiler, "load", "sound.load"):
+        return audio_cache_utils.load(path, audio_cache)
+
+
+def _calculate_batched(file_paths, batch_method, missing, profiler=None, audio_cache=None):
+    """
+    Loads the files and calculates the indices of each group of signals with
+    the same length, sampling rate and missing indices in a single
+    ``batch_method`` call. ``missing`` holds, per file, the indices still to
+    calculate, or None for all of them.
+    """
+    rows = [{} for _ in file_paths]
+    signals = {}
+    groups = {}
+    for i, (path, names) in enumerate(zip(file_paths, missing)):
+        if names == []:
+            continue
+        s, fs = _load(path, profiler, audio_cache)
+        if len(s) == 0:
+            print(
+                f"Sound loading failed or the file {path} "
+                "is corrupted. Acoustic indices not calculated."
+            )
+            continue
+        signals[i] = s
+        groups.setdefault((fs, len(s), None if names is None else tuple(names)), []).append(i)
+
+    for (fs, _, names), positions in groups.items():
+        with maybe_file(profiler, f"batch of {len(positions)} files"):
+            if names is None:
+                batch_rows = batch_method(np.stack([signals[i] for i in positions]), fs)
+            else:
+                batch_rows = batch_method(np.stack([signals[i] for i in positions]), fs, indices=list(names))
+        for i, indices in zip(positions, batch_rows):
+            rows[i] = indices
+    return rows
+
+
+def _extract_indices_worker(
+    df_chunk,
+    file_path_col: str,
+    acoustic_indices_methods,
+    pre_calculation_method,
+    temp_dir: str,
+    streaming_method=None,
+    batch_method=None,
+    cache=None,
+    profiler=None,
+    on_file=None,
+    checkpoint=False,
+    audio_cache=None,
+) -> tuple:
+    """
+    Calculates the indices of one chunk of the DataFrame and stores the
+    result as a temporary Parquet file.
+
+    Parameters
+    ----------
+    df_chunk : tuple of (pd.DataFrame, int)
+        Chunk of the DataFrame and its number in the run.
+    file_path_col : str
+        Column with the audio file paths.
+    acoustic_indices_methods : list of callables
+        Methods receiving the output of ``pre_calculation_method`` and
+        returning a dict of index names and values.
+    pre_calculation_method : callable
+        Method receiving ``(s, fs)`` and returning the pre-calculated
+        variables consumed by the index methods.
+    temp_dir : str
+        Directory where the temporary file is written.
+    streaming_method : callable, optional
+        Method receiving a file path and returning the indices of the file
+        computed block by block. When given, files are not loaded whole.
+    batch_method : callable, optional
+        Method receiving an ``(N, L)`` array of signals and their sampling
+        rate and returning one indices dict per signal. When given, the
+        signals of the chunk with equal length are calculated together.
+    cache : cache.ResultCache, optional
+        Cache of per-file results. Only the indices missing from it are
+        calculated, and the new results are stored.
+    profiler : profiling.StageProfiler, optional
+        Profiler used by the index methods; file loads are recorded too.
+    on_file : callable, optional
+        Called without arguments after each file of the per-file loop.
+    checkpoint : bool, optional
+        If True, ``temp_dir`` is the dataset directory of the run and the
+        chunk is written there durably, as ``part-<number>.parquet``.
+    audio_cache : audio_cache.AudioCache, optional
+        Cache of decoded audio the files are loaded from.
+
+    Returns
+    -------
+    tuple of (str, list, float)
+        Path of the temporary Parquet file, the stage records of the chunk
+        and its calculation time in seconds.
+    """
+    started = time.perf_counter()
+    df, fidx = df_chunk
+    df = df.copy()
+
+    file_paths = df[file_path_col].tolist()
+    cached = [{} for _ in file_paths]
+    missing = [None] * len(file_paths)
+    if cache is not None:
+        for i, path in enumerate(file_paths):
+            cached[i], missing[i] = cache.lookup(path)
+        methods_by_name = dict(zip(cache.indices, acoustic_indices_methods))
+
+    if batch_method is not None:
+        rows = _calculate_batched(file_paths, batch_method, missing, profiler, audio_cache)
+    else:
+        rows = []
+        for path, names in zip(file_paths, missing):
+            if names == []:
+                rows.append({})
+                if on_file is not None:
+                    on_file()
+                continue
+
+            if streaming_method is not None:
+                with maybe_file(profiler, path):
+                    if names is None:
+                        rows.append(streaming_method(path))
+                    else:
+                        rows.append(streaming_method(path, indices=names))
+                if on_file is not None:
+                    on_file()
+                continue
+
+            s, fs = _load(path, profiler, audio_cache)
+            indices = {}
+
+            if len(s) == 0:
+                print(
+                    f"Sound loading failed or the file {path} "
+                    "is corrupted. Acoustic indices not calculated."
+                )
+            else:
+                methods = acoustic_indices_methods
+                if names is not None:
+                    methods = [methods_by_name[name] for name in names]
+                with maybe_file(profiler, path):
+                    pre_calc_vars = pre_calculation_method(s, fs)
+                    for method in methods:
+                        indices.update(method(pre_calc_vars))
+                del pre_calc_vars
+            rows.append(indices)
+            if on_file is not None:
+                on_file()
+
+    if cache is not None:
+        for path, indices in zip(file_paths, rows):
+            if indices:
+                cache.store(path, indices)
+        rows = [
+            cache.order({**hits, **indices}) if hits or indices else {}
+            for hits, indices in zip(cached, rows)
+        ]
+
+    keys = list(dict.fromkeys(key for indices in rows for key in indices))
+    for key in keys:
+        df[key] = pd.Series([indices.get(key) for indices in rows], index=df.index, dtype=object)
+
+    if checkpoint:
+        temp_file_path = _part_path(temp_dir, fidx)
+        _write_durably(df, temp_file_path)
+    else:
+        temp_file_path = os.path.join(temp_dir, f"temp_{os.getpid()}_{fidx}.parquet")
+        io_utils.save_df_indices_parquet(df, temp_file_path)
+
+    del rows
+    gc.collect()
+
+    records = []
+    if profiler is not None:
+        records = profiler.drain()
+        profiler.stop()
+    return temp_file_path, records, time.perf_counter() - started
+
+
+def calculate_acoustic_indices(
+    df_init: pd.DataFrame,
+    file_path_col: str,
+    acoustic_indices_methods: list,
+    pre_calculation_method,
+    parallel: bool,
+    chunk_size: int = None,
+    temp_dir: str = "./tmp_maui_ac_files/",
+    streaming_method=None,
+    batch_method=None,
+    cache=None,
+    profiler=None,
+    progress=None,
+    cancel_event=None,
+    checkpoint_key: str = None,
+    tuner=None,
+    dataset_path: str = None,
+    audio_cache=None,
+):
+    """
+    Calculate acoustic indices for the audio files of a DataFrame.
+
+    Parameters
+    ----------
+    df_init : pd.DataFrame
+        DataFrame with the file paths and any other metadata.
+    file_path_col : str
+        Column with the audio file paths.
+    acoustic_indices_methods : list of callables
+        Methods computing the indices (see ``AcousticIndices.set_indices``).
+    pre_calculation_method : callable
+        Method computing the shared intermediates of a file.
+    parallel : bool
+        If True, chunks are processed by a pool with one process per core.
+        Files are then dispatched longest first (duration times sampling
+        rate), each chunk to the next idle worker, so the longest files do
+        not end up in the last chunks. Chunks are sized by cost: a chunk
+        holds files up to an even share of the total cost (a single file
+        if it is longer than that), so the long files are spread over the
+        workers instead of sharing the first chunk.
+    chunk_size : int, optional
+        Number of rows per chunk (the maximum, when parallel). Defaults to
+        an even split across cores, capped at 20.
+    temp_dir : str, optional
+        Directory for the per-chunk temporary files when the results are
+        assembled in memory (no ``dataset_path``).
+    streaming_method : callable, optional
+        Block-streaming alternative to ``pre_calculation_method`` for long
+        recordings (see ``AcousticIndices.calculate_streaming``).
+    batch_method : callable, optional
+        Vectorized alternative for equal-length segments (see
+        ``AcousticIndices.calculate_batch``). Larger chunks give larger
+        batches.
+    cache : cache.ResultCache, optional
+        Persistent cache of per-file results; its entries must list the
+        indices of ``acoustic_indices_methods`` in the same order (see
+        ``AcousticIndices.result_cache_entries``).
+    profiler : profiling.StageProfiler, optional
+        Profiler of the ``AcousticIndices`` providing the methods. The stage
+        records of every worker are gathered back into it.
+    progress : callable, optional
+        Called as ``progress(done, total)`` with the number of files
+        processed, after each file when sequential and after each chunk when
+        parallel.
+    cancel_event : threading.Event, optional
+        When set, the run stops at the next file (sequential) or chunk
+        (parallel), its temporary files are removed and ``Cancelled`` is
+        raised.
+    checkpoint_key : str, optional
+        Identity of the index configuration (methods, parameters, mode),
+        used with ``dataset_path``: the parts written are kept when the run
+        is cancelled or interrupted, and calling again with the same key
+        and DataFrame resumes from them, whatever the chunk size.
+    tuner : tuning.AutoTuner, optional
+        Chooses the number of workers and the size of each chunk, instead
+        of ``parallel`` and ``chunk_size``, and is updated with the measured
+        chunk times as the run goes.
+    dataset_path : str, optional
+        Directory of a partitioned Parquet dataset to write the results to,
+        one ``part-<number>.parquet`` per chunk as soon as it is calculated,
+        instead of assembling them in memory. The rows written so far can be
+        read with ``io_utils.load_df_indices_parquet(dataset_path)`` while
+        the run goes. With ``checkpoint_key``, an identical run resumes from
+        its parts. A different run does not touch the results already in
+        ``dataset_path``: it is written to ``dataset_path + STAGING_SUFFIX``
+        (where its rows can be read while it goes, and from which it
+        resumes) and replaces ``dataset_path`` only once complete.
+    audio_cache : audio_cache.AudioCache, optional
+        Cache of decoded audio shared with the other pages: files are
+        decoded once and read back as memory maps. Not used by
+        ``streaming_method``, which maps the WAV files directly.
+
+    Returns
+    -------
+    pd.DataFrame or str
+        The original rows with one column per calculated index, or
+        ``dataset_path`` when given.
+    """
+    os.makedirs(temp_dir, exist_ok=True)
+
+    num_processes = mp.cpu_count()
+    if tuner is not None:
+        parallel = tuner.parallel
+        num_processes = tuner.workers
+
+    if chunk_size is None:
+        chunk_size = min(len(df_init) // num_processes + 1, 20)
+
+    run_dir = None
+    completed = {}
+    next_fidx = 0
+    pending = np.arange(len(df_init))
+    if dataset_path is not None:
+        run_id = _run_id(df_init, file_path_col, checkpoint_key)
+        resume = checkpoint_key is not None
+        run_dir = _run_dir_for(dataset_path, run_id, resume)
+        manifest = _open_run(run_dir, run_id, checkpoint_key, len(df_init), resume=resume)
+        completed, next_fidx = _completed_parts(run_dir)
+        if completed:
+            covered = np.zeros(len(df_init), dtype=bool)
+            for positions in completed.values():
+                covered[positions] = True
+            pending = pending[~covered]
+            print(f"Resuming from {covered.sum()} of {len(df_init)} checkpointed rows...")
+
+    if parallel and len(pending):
+        # Longest job first: the short files fill the gaps at the end of the run
+        if tuner is not None:
+            samples = tuner.samples
+        else:
+            durations, fs = probe_files(df_init, file_path_col)
+            samples = durations * fs
+        pending = pending[np.argsort(-samples[pending], kind="stable")]
+        # Cost of a chunk: enough chunks for every worker to stay busy until the end
+        chunk_budget = float(np.sum(samples[pending])) / (num_processes * MIN_CHUNKS_PER_WORKER)
+
+    # Every part carries the positions of its rows, so it can be written in
+    # any order and reassembled (or resumed) from the parts alone
+    df_rows = df_init.assign(**{io_utils.DATASET_ROW_COL: np.arange(len(df_init))})
+
+    def chunk_size_by_cost():
+        """Number of the next ``pending`` rows, at most ``chunk_size``, within ``chunk_budget``."""
+        head = pending[:chunk_size]
+        size = int(np.searchsorted(np.cumsum(samples[head]), chunk_budget, side="right"))
+        return max(size, 1)
+
+    def next_chunk():
+        """Takes the next rows of ``pending`` as a chunk."""
+        nonlocal pending, next_fidx
+        if tuner is not None:
+            size = tuner.chunk_size(pending)
+        elif parallel:
+            size = chunk_size_by_cost()
+        else:
+            size = chunk_size
+        positions, pending = pending[:size], pending[size:]
+        fidx, next_fidx = next_fidx, next_fidx + 1
+        return (df_rows.iloc[positions], fidx), positions
+
+    print("Calculating acoustic indices...")
+
+    total = len(df_init)
+    done = total - len(pending)
+    if progress is not None and done:
+        progress(done, total)
+
+    def check_cancel():
+        if cancel_event is not None and cancel_event.is_set():
+            raise Cancelled()
+
+    def file_done():
+        nonlocal done
+        done += 1
+        if progress is not None:
+            progress(done, total)
+        check_cancel()
+
+    worker = partial(
+        _extract_indices_worker,
+        file_path_col=file_path_col,
+        acoustic_indices_methods=acoustic_indices_methods,
+        pre_calculation_method=pre_calculation_method,
+        temp_dir=temp_dir if run_dir is None else run_dir,
+        streaming_method=streaming_method,
+        batch_method=batch_method,
+        cache=cache,
+        profiler=profiler,
+        checkpoint=run_dir is not None,
+        audio_cache=audio_cache,
+    )
+
+    results = []
+    try:
+        if parallel:
+            # Chunks wait in a short queue and go to whichever worker is free
+            # first; they are sized when submitted, so the tuner's latest
+            # estimates apply
+            finished = queue.Queue()
+            with mp.Pool(processes=num_processes) as pool:
+                in_flight = 0
+                while len(pending) or in_flight:
+                    limit = 2 * num_processes if tuner is None else tuner.max_in_flight()
+                    while len(pending) and in_flight < limit:
+                        df_chunk, positions = next_chunk()
+                        pool.apply_async(
+                            worker, (df_chunk,),
+                            callback=lambda result, p=positions: finished.put((p, result, None)),
+                            error_callback=lambda error, p=positions: finished.put((p, None, error)),
+                        )
+                        in_flight += 1
+                    positions, result, error = finished.get()
+                    in_flight -= 1
+                    if error is not None:
+                        raise error
+                    results.append((positions, result))
+                    if tuner is not None:
+                        tuner.observe(positions, result[2])
+                    done += len(positions)
+                    if progress is not None:
+                        progress(done, total)
+                    check_cancel()
+        else:
+            # Batch mode only reports once the whole chunk is calculated
+            per_file = batch_method is None
+            while len(pending):
+                check_cancel()
+                df_chunk, positions = next_chunk()
+                result = worker(df_chunk, on_file=file_done if per_file else None)
+                results.append((positions, result))
+                if tuner is not None:
+                    tuner.observe(positions, result[2])
+                if not per_file:
+                    done += len(positions)
+                    if progress is not None:
+                        progress(done, total)
+    except Cancelled:
+        # Checkpointed chunks are kept for the next run
+        if run_dir is None:
+            for _, (temp_file, _, _) in results:
+                os.remove(temp_file)
+        if profiler is not None:
+            profiler.stop()
+        print("Acoustic indices calculation cancelled.")
+        raise
+
+    if profiler is not None:
+        for _, (_, records, _) in results:
+            profiler.records.extend(records)
+
+    if cache is not None:
+        cache.evict()
+
+    if dataset_path is not None:
+        manifest.update(complete=True, n_parts=len(_completed_parts(run_dir)[0]))
+        _write_manifest(run_dir, manifest)
+        _publish(run_dir, dataset_path)
+        # Per-bin matrices ready for the plots (see utils.bin_store)
+        bin_store.write(dataset_path)
+        return dataset_path
+
+    print("Preparing final dataframe and removing temporary files...")
+
+    temp_files = [temp_file for _, (temp_file, _, _) in results]
+    combined_df = io_utils.load_df_indices_parts(temp_files)
+    for file in temp_files:
+        os.remove(file)
+    return combined_df
@@ -0,0 +1,601 @@
+"""
+Block-streaming computation of the acoustic indices for long recordings.
+
+``AcousticIndices.pre_calculation_method`` needs the whole decoded signal and
+keeps several full-length spectrograms alive at once. Here the WAV file is
+memory-mapped and read in overlapping blocks aligned to the STFT hop, so every
+frame is identical to the one of the whole-file spectrogram, and each index is
+reduced to per-frequency accumulators updated block by block. Peak memory is
+bounded by the block size, not by the recording length.
+
+Statistics over the whole recording (the 'ale' noise profile, the PCEN mean
+profile and the per-bin median of ``median_equalizer``) are gathered in early
+passes and applied in the later ones: the power family takes three passes over
+the file, ACI four and the soundscape indices one (two for ADI and AEI),
+sharing the STFT when they run together. Medians are resolved
+from histograms to about 1e-6 of their value; everything else matches the
+whole-file computation. Matrix outputs (``aci_xx``, ``EVNsp``) are not
+produced.
+"""
+
+import warnings
+
+import numpy as np
+from scipy import ndimage, signal
+from scipy.io import wavfile
+
+from maad import util
+
+from acoustic_indices import batch
+
+_MIN_ = np.finfo(float).tiny
+
+# Outputs of each index, in the order of the whole-file methods
+OUTPUTS = {
+    "ACI": ['aci_per_bin', 'aci_sum'],
+    "spectral_events": ['EVNspFract_per_bin', 'EVNspMean_per_bin', 'EVNspCount_per_bin'],
+    "spectral_activity": ['LFC', 'MFC', 'HFC'],
+    "temporal_entropy": ['Ht'],
+    "frequency_entropy": ['Hf', 'Ht_per_bin'],
+    "ADI": ['ADI'],
+    "AEI": ['AEI'],
+    "NDSI": ['NDSI', 'rBA', 'AnthroEnergy', 'BioEnergy'],
+    "BI": ['BI'],
+    "H": ['H'],
+}
+
+# Bins of the histograms used to locate and then refine the medians
+MEDIAN_BINS = 4096
+# Dynamic range below the row maximum covered by the log-spaced bins
+MEDIAN_RANGE = 1e-9
+
+
+class _Signal(object):
+    """
+    Memory-mapped WAV file read with the normalization of ``sound.load``,
+    in blocks of ``dtype`` samples.
+    """
+    def __init__(self, file_path, channel='left', block_len=2**20, dtype=np.float64):
+        self.dtype = np.dtype(dtype)
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore")
+            try:
+                self.fs, raw = wavfile.read(file_path, mmap=True)
+            except ValueError:
+                # 24-bit files cannot be memory-mapped
+                self.fs, raw = wavfile.read(file_path)
+        if raw.ndim == 2:
+            raw = raw[:, 0] if channel == 'left' else raw[:, 1]
+        self.raw = raw
+        self.scale = {
+            np.dtype(np.int32): 2**31, np.dtype(np.int16): 2**15, np.dtype(np.uint8): 2**8
+        }.get(raw.dtype, 1)
+
+        # sound.load removes the DC offset of the whole signal
+        self.mean = 0.0
+        total = sum(self.read(i, i + block_len).sum(dtype=np.float64) for i in range(0, len(raw), block_len))
+        self.mean = total / len(raw) if len(raw) else 0.0
+
+    def __len__(self):
+        return len(self.raw)
+
+    def read(self, start, stop):
+        x = np.asarray(self.raw[start:stop], dtype=self.dtype) / self.dtype.type(self.scale)
+        x -= self.dtype.type(self.mean)
+        return x
+
+
+def _spectrogram_config(step):
+    params = step.params
+    nperseg = params.get('nperseg', 1024)
+    noverlap = params.get('noverlap')
+    if noverlap is None:
+        noverlap = nperseg // 2
+    return params.get('window', 'hann'), nperseg, noverlap
+
+
+def _spectrogram_blocks(sig, config, frames_per_block):
+    """
+    Yields the amplitude spectrogram of ``sig`` as consecutive blocks of
+    frames, with the same scaling and frame count as ``sound.spectrogram``.
+    """
+    window, nperseg, noverlap = config
+    hop = nperseg - noverlap
+    n_frames = min(len(sig) // hop - 1, (len(sig) - nperseg) // hop + 1)
+    for first in range(0, n_frames, frames_per_block):
+        m = min(frames_per_block, n_frames - first)
+        x = sig.read(first * hop, first * hop + (m - 1) * hop + nperseg)
+        _, _, Sxx = signal.spectrogram(
+            x, sig.fs, window=window, nperseg=nperseg, noverlap=noverlap,
+            nfft=nperseg, mode='complex', detrend='constant', scaling='density'
+        )
+        yield np.abs(Sxx[:-1, :m]) * sig.dtype.type(np.sqrt(2 * (sig.fs / nperseg)))
+
+
+def _entropy_from_sums(S1, S2, n):
+    """
+    ``util.entropy`` of non-negative series of length ``n`` given their sum
+    ``S1`` and the sum ``S2`` of x*log(x).
+    """
+    if n <= 1:
+        return np.zeros_like(S1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        H = -(S2 / S1 - np.log(S1)) / np.log(n)
+    return np.where(S1 > 0, H, 1.0)
+
+
+def _xlogx(x):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(x > 0, x * np.log(x), 0.0)
+
+
+def _band_scores(counts, n, fn, fmin, fmax, bin_step, dB_threshold):
+    """Per-band scores of the maad ADI and AEI from the per-bin counts above the threshold."""
+    scores = []
+    for ii in range(int((fmax - fmin) // bin_step)):
+        f0 = int(fmin + bin_step * ii)
+        rows = util.index_bw(fn, (f0, int(f0 + bin_step)))
+        scores.append(np.sum(counts[rows]) / (np.sum(rows) * n))
+    return np.asarray(scores)
+
+
+def _row_bincount(idx, nbins):
+    """Counts of ``idx`` (rows x frames) per row, for indices in ``[0, nbins)``."""
+    rows = idx.shape[0]
+    flat = idx + (np.arange(rows) * nbins)[:, np.newaxis]
+    return np.bincount(flat.ravel(), minlength=rows * nbins).reshape(rows, nbins)
+
+
+class _RowHistogram(object):
+    """
+    Per-row ``np.histogram(x, bins, range=(min, max))`` of a spectrogram seen
+    block by block; ``update_range`` runs over the whole recording first.
+    """
+    def __init__(self, nrows, bins):
+        self.bins = bins
+        self.min = np.full(nrows, np.inf)
+        self.max = np.full(nrows, -np.inf)
+        self.counts = np.zeros((nrows, bins), dtype=np.int64)
+
+    def update_range(self, X):
+        self.min = np.minimum(self.min, X.min(axis=1))
+        self.max = np.maximum(self.max, X.max(axis=1))
+
+    def set_edges(self):
+        first, last = self.min.copy(), self.max.copy()
+        same = first == last
+        first[same] -= 0.5
+        last[same] += 0.5
+        self.first, self.last = first, last
+        self.edges = np.linspace(first, last, self.bins + 1, axis=1)
+
+    def update(self, X):
+        # Same bin assignment as np.histogram with equal-width bins
+        norm = self.bins / (self.last - self.first)
+        idx = ((X - self.first[:, np.newaxis]) * norm[:, np.newaxis]).astype(np.intp)
+        idx[idx == self.bins] -= 1
+        idx[X < np.take_along_axis(self.edges, idx, axis=1)] -= 1
+        increment = (X >= np.take_along_axis(self.edges, idx + 1, axis=1)) & (idx != self.bins - 1)
+        idx[increment] += 1
+        self.counts += _row_bincount(idx, self.bins)
+
+
+class _RowMedian(object):
+    """
+    Per-row median of a non-negative spectrogram below a known per-row
+    maximum. ``locate`` finds the bin of each middle rank in a log-spaced
+    histogram and ``refine`` splits that bin in ``MEDIAN_BINS`` linear bins.
+    """
+    def __init__(self, upper):
+        self.upper = np.maximum(upper, _MIN_)
+        self.lower = self.upper * MEDIAN_RANGE
+        self.log_step = np.log(1 / MEDIAN_RANGE) / MEDIAN_BINS
+        self.min = np.full(len(upper), np.inf)
+        self.max = -np.inf
+        self.n = 0
+        self.counts = np.zeros((len(upper), MEDIAN_BINS + 2), dtype=np.int64)
+
+    def _log_bin(self, X):
+        # 0 holds the values below the grid and MEDIAN_BINS + 1 the maximum
+        lower = self.lower[:, np.newaxis]
+        pos = np.log(np.maximum(X, lower) / lower) / self.log_step
+        pos[X < lower] = -1
+        return np.clip(np.floor(pos), -1, MEDIAN_BINS).astype(np.intp) + 1
+
+    def locate(self, X):
+        self.min = np.minimum(self.min, X.min(axis=1))
+        self.max = max(self.max, X.max())
+        self.n += X.shape[1]
+        self.counts += _row_bincount(self._log_bin(X), MEDIAN_BINS + 2)
+
+    def set_windows(self):
+        self.ranks = np.array([(self.n - 1) // 2, self.n // 2])
+        cum = np.cumsum(self.counts, axis=1)
+        rows = np.arange(len(cum))[:, np.newaxis]
+        self.bin = np.stack([np.argmax(cum > rank, axis=1) for rank in self.ranks], axis=1)
+        self.before = (cum - self.counts)[rows, self.bin]
+
+        edges = self.lower[:, np.newaxis] * np.exp(np.arange(MEDIAN_BINS + 1) * self.log_step)
+        left = np.column_stack([np.minimum(self.min, self.lower), edges, self.upper])
+        right = np.column_stack([self.lower, edges[:, 1:], self.upper, self.upper])
+        self.left, self.right = left[rows, self.bin], right[rows, self.bin]
+        self.fine = np.zeros((2, len(self.counts), MEDIAN_BINS), dtype=np.int64)
+
+    def refine(self, X):
+        log_bin = self._log_bin(X)
+        for k in range(2):
+            left = self.left[:, k, np.newaxis]
+            width = (self.right[:, k] - self.left[:, k])[:, np.newaxis]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                pos = np.where(width > 0, (X - left) / width * MEDIAN_BINS, 0)
+            idx = np.clip(np.floor(pos), 0, MEDIAN_BINS - 1).astype(np.intp)
+            # values outside the located bin go to an extra column, dropped below
+            idx[log_bin != self.bin[:, k, np.newaxis]] = MEDIAN_BINS
+            self.fine[k] += _row_bincount(idx, MEDIAN_BINS + 1)[:, :MEDIAN_BINS]
+
+    def median(self):
+        values = np.empty(self.bin.shape)
+        rows = np.arange(len(self.bin))
+        for k, rank in enumerate(self.ranks):
+            cum = np.cumsum(self.fine[k], axis=1)
+            inner = rank - self.before[:, k]
+            b = np.argmax(cum > inner[:, np.newaxis], axis=1)
+            counts = self.fine[k][rows, b]
+            inside = (inner - (cum[rows, b] - counts) + 0.5) / counts
+            width = (self.right[:, k] - self.left[:, k]) / MEDIAN_BINS
+            values[:, k] = self.left[:, k] + width * (b + inside)
+        return values.mean(axis=1)
+
+
+class _EventRuns(object):
+    """
+    Runs of above-threshold frames per frequency bin, carried across blocks.
+
+    The binary opening of ``spectral_events`` removes exactly the runs shorter
+    than its kernel, so only runs of at least ``min_length`` frames are kept.
+    """
+    def __init__(self, nbins, min_length):
+        self.min_length = min_length
+        self.open = np.zeros(nbins, dtype=np.int64)
+        self.count = np.zeros(nbins, dtype=np.int64)
+        self.total = np.zeros(nbins, dtype=np.int64)
+
+    def _close(self, rows, lengths):
+        keep = lengths >= self.min_length
+        np.add.at(self.count, rows[keep], 1)
+        np.add.at(self.total, rows[keep], lengths[keep])
+
+    def update(self, active):
+        nbins, T = active.shape
+        padded = np.zeros((nbins, T + 2), dtype=np.int8)
+        padded[:, 1:-1] = active
+        d = np.diff(padded, axis=1)
+        # np.nonzero is row-major, so starts and ends of each row pair up
+        rows, starts = np.nonzero(d == 1)
+        _, ends = np.nonzero(d == -1)
+        lengths = ends - starts
+
+        carried = starts == 0
+        lengths[carried] += self.open[rows[carried]]
+        interrupted = np.nonzero((self.open > 0) & ~active[:, 0])[0]
+        self._close(interrupted, self.open[interrupted])
+
+        still_open = ends == T
+        self._close(rows[~still_open], lengths[~still_open])
+        self.open = np.zeros(nbins, dtype=np.int64)
+        self.open[rows[still_open]] = lengths[still_open]
+
+    def finish(self):
+        rows = np.nonzero(self.open > 0)[0]
+        self._close(rows, self.open[rows])
+        self.open[:] = 0
+
+
+class StreamingIndices(object):
+    """
+    Streaming counterpart of ``AcousticIndices`` for a single file.
+
+    Parameters
+    ----------
+    intermediates : list of Intermediate
+        Declared intermediates; the spectrogram, PCEN, background removal
+        and equalization parameters are read from them.
+    index_declarations : list of Index
+        Declared indices (``acoustic_indices_calculation.INDICES``); the
+        thresholds, bands and frequency limits are read from them.
+    block_duration : float, optional
+        Duration in seconds of the audio held in memory at a time.
+    dtype : numpy dtype, optional
+        Precision of the samples and of the spectrogram blocks, as
+        ``AcousticIndices.dtype``. The accumulators stay in float64.
+
+    Raises
+    ------
+    ValueError
+        If the declarations use a configuration without a streaming
+        counterpart (background removal other than 'ale', envelope other
+        than 'fast', BI not soundecology-compatible).
+    """
+    def __init__(self, intermediates, index_declarations, block_duration=60.0, dtype=np.float64):
+        self.dtype = np.dtype(dtype)
+        self.steps = {
+            name: step for step in intermediates for name in step.outputs if name is not None
+        }
+        self.declarations = {index.name: index for index in index_declarations}
+        self.block_duration = block_duration
+
+        # Checked here, before any file is read, rather than in the middle of a run
+        if self._step_params("Sxx_dB_noNoise", mode='median')['mode'] != 'ale':
+            raise ValueError("Block streaming only supports the 'ale' background removal.")
+        if self._step_params("env", mode='fast')['mode'] != 'fast':
+            raise ValueError("Block streaming only supports the 'fast' envelope.")
+        if self._index_params("BI", R_compatible='soundecology')['R_compatible'] != 'soundecology':
+            raise ValueError("Block streaming only supports the soundecology-compatible BI.")
+
+    def _step_params(self, name, **defaults):
+        """Parameters of the intermediate producing ``name``, over the defaults of its function."""
+        params = dict(defaults)
+        params.update(self.steps[name].params)
+        return params
+
+    def _index_params(self, name, **defaults):
+        """Parameters of the index ``name``, over the defaults of its function."""
+        params = dict(defaults)
+        params.update(self.declarations[name].params)
+        return params
+
+    def _run_passes(self, sig, families):
+        """
+        Runs the families, generators yielding one block consumer per pass
+        over the file and returning their indices. Families sharing a
+        spectrogram configuration share the STFT of each pass.
+        """
+        results = {}
+        pending = [(config, family, next(family)) for config, family in families]
+        while pending:
+            by_config = {}
+            for config, _, consumer in pending:
+                by_config.setdefault(config, []).append(consumer)
+            for config, consumers in by_config.items():
+                _, nperseg, noverlap = config
+                frames_per_block = max(2, int(self.block_duration * sig.fs / (nperseg - noverlap)))
+                for Sxx in _spectrogram_blocks(sig, config, frames_per_block):
+                    for consumer in consumers:
+                        consumer(Sxx)
+
+            remaining = []
+            for config, family, _ in pending:
+                try:
+                    remaining.append((config, family, next(family)))
+                except StopIteration as done:
+                    results.update(done.value)
+            pending = remaining
+        return results
+
+    def _pcen(self):
+        """Returns a stateful ``sound.pcen`` applied block by block."""
+        params = self._step_params("Sxx_pcen", gain=0.98, bias=2, power=0.5, b=0.025, eps=1e-6)
+        b = params["b"]
+        state = {}
+
+        def pcen(Sxx):
+            zi = state.get("zi", np.zeros((Sxx.shape[0], 1)))
+            M, state["zi"] = signal.lfilter([b], [1, b - 1], Sxx, axis=-1, zi=zi)
+            smooth = (params["eps"] + M)**(-params["gain"])
+            return (Sxx * smooth + params["bias"])**params["power"] - params["bias"]**params["power"]
+        return pcen
+
+    def _background_removal(self, mean_profile):
+        """Returns ``sound.remove_background`` with the noise profile of the whole recording."""
+        params = self._step_params("Sxx_nb", gauss_win=50, gauss_std=25, beta1=1, beta2=1, llambda=1)
+        selem = signal.windows.gaussian(params["gauss_win"], params["gauss_std"])
+        noise_profile = ndimage.grey_opening(mean_profile, structure=selem)
+        noise_profile[-2:] = mean_profile[-2:]
+        noise_profile[:2] = mean_profile[:2]
+        noise_profile[noise_profile == 0] = _MIN_
+        noise_profile = noise_profile[:, np.newaxis]
+
+        def remove_background(Sxx):
+            SNR_est = Sxx / noise_profile
+            SNR_est = SNR_est * (SNR_est > 0)
+            an_lk = (1 - params["llambda"] * ((1. / (SNR_est + 1))**params["beta1"]))**params["beta2"]
+            an_lk = an_lk * (an_lk > 0)
+            Sxx_out = an_lk * Sxx
+            Sxx_out[Sxx_out < 0] = 0
+            return Sxx_out
+        return remove_background
+
+    def _aci(self):
+        # Pass 1: PCEN mean profile (background noise) and maximum per bin
+        pcen = self._pcen()
+        acc = {"sum": 0.0, "max": 0.0, "n": 0}
+
+        def profile(Sxx):
+            Sxx_pcen = pcen(Sxx)
+            acc["sum"] = acc["sum"] + Sxx_pcen.sum(axis=1)
+            acc["max"] = np.maximum(acc["max"], Sxx_pcen.max(axis=1))
+            acc["n"] += Sxx.shape[1]
+        yield profile
+        remove_background = self._background_removal(acc["sum"] / acc["n"])
+
+        # Passes 2 and 3: median of the denoised spectrogram per bin
+        median = _RowMedian(acc["max"])
+        pcen = self._pcen()
+        yield lambda Sxx: median.locate(remove_background(pcen(Sxx)))
+        median.set_windows()
+        pcen = self._pcen()
+        yield lambda Sxx: median.refine(remove_background(pcen(Sxx)))
+        Sxx_median = median.median()
+        norm = Sxx_median - median.min
+        norm[norm <= 0] = median.max
+        Sxx_median, norm = Sxx_median[:, np.newaxis], norm[:, np.newaxis]
+
+        # Pass 4: ACI over the equalized spectrogram, carrying the last frame
+        pcen = self._pcen()
+        acc = {"abs_diff": 0.0, "sum": 0.0, "last": None}
+
+        def aci(Sxx):
+            Sxx_eq = (remove_background(pcen(Sxx)) - Sxx_median) / norm
+            Sxx_eq[Sxx_eq < 1] = 1
+            frames = Sxx_eq if acc["last"] is None else np.concatenate([acc["last"], Sxx_eq], axis=1)
+            acc["abs_diff"] = acc["abs_diff"] + np.abs(np.diff(frames, axis=1)).sum(axis=1)
+            acc["sum"] = acc["sum"] + Sxx_eq.sum(axis=1)
+            acc["last"] = Sxx_eq[:, -1:]
+        yield aci
+
+        aci_per_bin = acc["abs_diff"] / acc["sum"]
+        return {'aci_per_bin': aci_per_bin, 'aci_sum': np.sum(aci_per_bin)}
+
+    def _power_family(self, fs, config, indices):
+        _, nperseg, noverlap = config
+        dt = (nperseg - noverlap) / fs
+        fn = np.arange(nperseg // 2) * fs / nperseg
+        nbins = len(fn)
+        params = self._step_params("Sxx_dB_noNoise", mode='median', N=25, N_bins=50)
+        events = self._index_params("spectral_events", dB_threshold=6, rejectDuration=None)
+        cover = self._index_params(
+            "spectral_activity", dB_threshold=3, flim_LF=(0, 1000), flim_MF=(1000, 10000), flim_HF=(10000, 20000)
+        )
+
+        # Passes 1 and 2: histogram of the dB spectrogram for the 'ale' noise profile
+        hist = _RowHistogram(nbins, params['N_bins'])
+        yield lambda Sxx: hist.update_range(util.power2dB(Sxx**2))
+        hist.set_edges()
+        yield lambda Sxx: hist.update(util.power2dB(Sxx**2))
+        modes = [np.argmax(util.running_mean(counts, 7)) for counts in hist.counts]
+        noise_profile = util.running_mean(hist.edges[np.arange(nbins), modes], params['N'])
+        noise_profile = noise_profile[:, np.newaxis]
+
+        # Pass 3: indices over the denoised spectrogram
+        reject = events['rejectDuration']
+        runs = _EventRuns(nbins, int(round(reject / dt)) + 1 if reject else 1)
+        acc = {"active": 0, "S1": 0.0, "S2": 0.0, "n": 0}
+
+        def update(Sxx):
+            Sxx_dB_noNoise = util.power2dB(Sxx**2) - noise_profile
+            Sxx_dB_noNoise[Sxx_dB_noNoise < 0] = 0
+            acc["n"] += Sxx.shape[1]
+            if "spectral_events" in indices:
+                runs.update(Sxx_dB_noNoise >= events['dB_threshold'])
+            if "spectral_activity" in indices:
+                acc["active"] = acc["active"] + (Sxx_dB_noNoise >= cover['dB_threshold']).sum(axis=1)
+            if "frequency_entropy" in indices:
+                Sxx_power_noNoise = util.dB2power(Sxx_dB_noNoise)
+                acc["S1"] = acc["S1"] + Sxx_power_noNoise.sum(axis=1)
+                acc["S2"] = acc["S2"] + _xlogx(Sxx_power_noNoise).sum(axis=1)
+        yield update
+        n = acc["n"]
+
+        results = {}
+        if "spectral_events" in indices:
+            runs.finish()
+            results['EVNspFract_per_bin'] = runs.total / n
+            results['EVNspMean_per_bin'] = np.where(
+                runs.count > 0, runs.total / np.maximum(runs.count, 1) * dt, 0
+            )
+            results['EVNspCount_per_bin'] = runs.count / ((n - 1) * dt)
+        if "spectral_activity" in indices:
+            active = acc["active"] / n
+            for key, band in (("LFC", "flim_LF"), ("MFC", "flim_MF"), ("HFC", "flim_HF")):
+                results[key] = np.mean(active[util.index_bw(fn, cover[band])])
+        if "frequency_entropy" in indices:
+            results['Hf'] = util.entropy(acc["S1"] / n)
+            results['Ht_per_bin'] = _entropy_from_sums(acc["S1"], acc["S2"], n)
+        return results
+
+    def _soundscape(self, fs, config, indices):
+        _, nperseg, _ = config
+        fn = np.arange(nperseg // 2) * fs / nperseg
+
+        # Pass 1: maximum of the spectrogram, sums of amplitude and power per bin
+        acc = {"max": 0.0, "S": 0.0, "P": 0.0, "n": 0}
+
+        def sums(Sxx):
+            acc["max"] = max(acc["max"], Sxx.max())
+            acc["S"] = acc["S"] + Sxx.sum(axis=1)
+            acc["P"] = acc["P"] + (Sxx**2).sum(axis=1)
+            acc["n"] += Sxx.shape[1]
+        yield sums
+        n = acc["n"]
+
+        # Pass 2: cells above the ADI and AEI thresholds, relative to the maximum
+        bands = {
+            idx: self._index_params(idx, fmin=0, fmax=20000, bin_step=bin_step, dB_threshold=-50)
+            for idx, bin_step in (("ADI", 1000), ("AEI", 500)) if idx in indices
+        }
+        thresholds = {idx: params["dB_threshold"] for idx, params in bands.items()}
+        counts = dict.fromkeys(thresholds, 0)
+        if thresholds:
+            def above(Sxx):
+                ratio = Sxx / acc["max"]
+                ratio[ratio == 0] = _MIN_
+                Sxx_dB = 20 * np.log10(ratio)
+                for idx, thr in thresholds.items():
+                    counts[idx] = counts[idx] + (Sxx_dB >= thr).sum(axis=1)
+            yield above
+
+        results = {}
+        if "ADI" in indices:
+            results['ADI'] = float(batch.diversity(_band_scores(counts["ADI"], n, fn, **bands["ADI"])))
+        if "AEI" in indices:
+            results['AEI'] = float(batch.gini(_band_scores(counts["AEI"], n, fn, **bands["AEI"])))
+        if "BI" in indices:
+            flim = self._index_params("BI", flim=(2000, 15000))["flim"]
+            results['BI'] = float(batch.bioacoustics_from_mean(acc["S"] / n / acc["max"], fn, flim))
+        if "NDSI" in indices:
+            # the band energies are sums over time, so the per-bin sums give the same ratios
+            NDSI, rBA, antroPh, bioPh = batch.soundscape_index(acc["P"][:, np.newaxis], fn, **self.declarations["NDSI"].params)
+            results.update({'NDSI': NDSI, 'rBA': rBA, 'AnthroEnergy': antroPh, 'BioEnergy': bioPh})
+        if "H" in indices:
+            results['Hf_power'] = util.entropy(acc["P"] / n)
+        return results
+
+    def _temporal_entropy(self, sig):
+        Nt = self._step_params("env", Nt=512)['Nt']
+        end = len(sig) // Nt * Nt
+        step = Nt * (int(self.block_duration * sig.fs) // Nt + 1)
+        S1, S2 = 0.0, 0.0
+        for start in range(0, end, step):
+            env = np.abs(sig.read(start, min(start + step, end)).reshape(-1, Nt)).max(axis=1)
+            S1 += np.sum(env**2)
+            S2 += np.sum(_xlogx(env**2))
+        return {'Ht': float(_entropy_from_sums(S1, S2, end // Nt))}
+
+    def calculate(self, file_path, indices):
+        """
+        Calculates the selected indices of one file.
+
+        Parameters
+        ----------
+        file_path : str
+            Path to a WAV file.
+        indices : list of str
+            Index identifiers, as in ``AcousticIndices.set_indices``.
+
+        Returns
+        -------
+        dict
+            Index outputs, with the same keys as the whole-file methods
+            except the matrix outputs.
+        """
+        sig = _Signal(file_path, dtype=self.dtype)
+        families = []
+        if "ACI" in indices:
+            families.append((_spectrogram_config(self.steps["Sxx"]), self._aci()))
+        power = [i for i in ("spectral_events", "spectral_activity", "frequency_entropy") if i in indices]
+        if power:
+            config = _spectrogram_config(self.steps["Sxx_power"])
+            families.append((config, self._power_family(sig.fs, config, power)))
+
+        for step, names in (("Sxx", ("ADI", "AEI", "BI")), ("Sxx_power", ("NDSI", "H"))):
+            soundscape = [i for i in names if i in indices]
+            if soundscape:
+                config = _spectrogram_config(self.steps[step])
+                families.append((config, self._soundscape(sig.fs, config, soundscape)))
+
+        results = self._run_passes(sig, families)
+        if "temporal_entropy" in indices or "H" in indices:
+            results.update(self._temporal_entropy(sig))
+        if "H" in indices:
+            results['H'] = results['Ht'] * results.pop('Hf_power')
+        return {key: results[key] for idx in indices for key in OUTPUTS.get(idx, [])}
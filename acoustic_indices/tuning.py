@@ -0,0 +1,209 @@
+"""
+Automatic worker count and chunk size for index runs.
+
+The cost of a file is proportional to its number of samples (duration times
+sampling rate), read from the ``duration`` column of the DataFrame and from
+the WAV headers of a sample of the files. The peak memory of a file is its
+number of samples times the size of the full-length arrays kept by the
+planned intermediates. From these, ``AutoTuner`` picks as many workers as
+the cores and the available memory allow, and sizes each chunk so that it
+takes about ``TARGET_CHUNK_SECONDS``, with enough chunks to balance the
+workers. During the run it refines the time per sample from the measured
+chunk times, and lowers the number of chunks in flight when memory runs low.
+"""
+
+import os
+import sys
+
+import numpy as np
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from utils.audio_scan import wav_header
+
+# Time per sample and per planned intermediate, measured on one core for
+# 60 s, 44.1 kHz files; replaced by the measured throughput during the run
+SECONDS_PER_SAMPLE_STEP = 7e-8
+# Short-lived arrays alive next to the intermediates of a file
+TRANSIENT_ARRAYS = 3
+# Interpreter, libraries and pickled chunk of each worker process
+WORKER_OVERHEAD_BYTES = 250 * 1024**2
+# Share of the available memory the workers may use
+MEMORY_FRACTION = 0.7
+TARGET_CHUNK_SECONDS = 15.0
+MIN_CHUNKS_PER_WORKER = 4
+MAX_CHUNK_SIZE = 100
+# Number of WAV headers probed for the sampling rates
+MAX_PROBED_FILES = 64
+
+
+def available_memory():
+    """Returns the available physical memory in bytes, or None if unknown."""
+    if psutil is not None:
+        return psutil.virtual_memory().available
+    if sys.platform.startswith("linux"):
+        try:
+            with open("/proc/meminfo") as f:
+                for line in f:
+                    if line.startswith("MemAvailable:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    if sys.platform == "win32":
+        import ctypes
+
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [
+                ("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong),
+                ("ullTotalPhys", ctypes.c_ulonglong), ("ullAvailPhys", ctypes.c_ulonglong),
+                ("ullTotalPageFile", ctypes.c_ulonglong), ("ullAvailPageFile", ctypes.c_ulonglong),
+                ("ullTotalVirtual", ctypes.c_ulonglong), ("ullAvailVirtual", ctypes.c_ulonglong),
+                ("ullAvailExtendedVirtual", ctypes.c_ulonglong),
+            ]
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullAvailPhys
+    return None
+
+
+def probe_files(df, file_path_col, duration_col="duration", max_probed=None, seed=0):
+    """
+    Estimates the duration and sampling rate of every file of ``df``.
+
+    Durations come from ``duration_col`` when present. Sampling rates (and
+    the durations otherwise) come from the WAV headers of up to
+    ``max_probed`` files; the other files get the median of the probed ones.
+    By default, ``MAX_PROBED_FILES`` headers are read when the durations are
+    known and all of them otherwise.
+
+    Returns
+    -------
+    durations, fs : arrays of float
+    """
+    paths = df[file_path_col].astype(str).to_numpy()
+    n = len(paths)
+    if max_probed is None:
+        max_probed = MAX_PROBED_FILES if duration_col in df.columns else n
+    rng = np.random.default_rng(seed)
+    probed = rng.choice(n, size=min(n, max_probed), replace=False) if n else np.array([], dtype=int)
+    headers = {i: wav_header(paths[i]) for i in probed}
+    headers = {i: h for i, h in headers.items() if h is not None and h["fs"] > 0}
+
+    fs = np.full(n, np.median([h["fs"] for h in headers.values()]) if headers else 44100.0)
+    for i, h in headers.items():
+        fs[i] = h["fs"]
+
+    if duration_col in df.columns:
+        durations = np.asarray(df[duration_col], dtype=float)
+    else:
+        durations = np.full(n, np.nan)
+        for i, h in headers.items():
+            durations[i] = h["n_frames"] / h["fs"]
+    known = np.isfinite(durations)
+    fill = np.median(durations[known]) if known.any() else 60.0
+    return np.where(known, durations, fill), fs
+
+
+class AutoTuner(object):
+    """
+    Chooses and adapts the worker count and chunk size of a run.
+
+    Parameters
+    ----------
+    samples : array of float
+        Estimated number of samples of each row (see ``probe_files``).
+    bytes_per_sample : float
+        Peak memory of a file per sample held in memory.
+    seconds_per_sample : float
+        Initial estimate of the time per sample on one core.
+    batch : bool, optional
+        If True, a whole chunk is held in memory at once (batch mode), so the
+        chunk size is also bounded by the memory of each worker.
+    n_cpus : int, optional
+        Cores available. Defaults to ``os.cpu_count()``.
+    available_bytes : int, optional
+        Available memory. Defaults to ``available_memory()``.
+    memory_samples : array of float, optional
+        Samples of each row held in memory at once, when less than the whole
+        file (block streaming).
+    """
+    def __init__(self, samples, bytes_per_sample, seconds_per_sample, batch=False,
+                 n_cpus=None, available_bytes=None, memory_samples=None):
+        self.samples = np.asarray(samples, dtype=float)
+        self.memory_samples = self.samples if memory_samples is None else np.asarray(memory_samples, dtype=float)
+        self.bytes_per_sample = bytes_per_sample
+        self.seconds_per_sample = seconds_per_sample
+        self.batch = batch
+        n_cpus = n_cpus or os.cpu_count() or 1
+        if available_bytes is None:
+            available_bytes = available_memory()
+        self.budget = None if available_bytes is None else available_bytes * MEMORY_FRACTION
+
+        peak_file = (self.memory_samples.max() if len(self.samples) else 0) * bytes_per_sample
+        self.worker_bytes = peak_file + WORKER_OVERHEAD_BYTES
+        workers = n_cpus
+        if self.budget is not None:
+            workers = min(workers, max(1, int(self.budget // self.worker_bytes)))
+        self.workers = max(1, min(workers, len(self.samples)))
+        self.in_flight = self.workers
+
+    @classmethod
+    def for_run(cls, df, file_path_col, aidx, mode="file", block_duration=60.0, **kwargs):
+        """
+        Tuner for calculating the indices selected in ``aidx`` over ``df``
+        in the given computation mode ('file', 'batch' or 'streaming').
+        """
+        durations, fs = probe_files(df, file_path_col)
+        samples = durations * fs
+        n_steps = max(1, len(aidx.plan))
+        memory_samples = None
+        if mode == "streaming":
+            # Memory is bounded by the block, not by the file
+            memory_samples = np.minimum(samples, fs * block_duration)
+        return cls(
+            samples, aidx.dtype.itemsize * (n_steps + TRANSIENT_ARRAYS), SECONDS_PER_SAMPLE_STEP * n_steps,
+            batch=mode == "batch", memory_samples=memory_samples, **kwargs
+        )
+
+    @property
+    def parallel(self):
+        return self.workers > 1
+
+    def chunk_size(self, pending):
+        """
+        Number of the next ``pending`` rows (array of positions) to put in a
+        chunk, so that the chunk takes about ``TARGET_CHUNK_SECONDS``.
+        """
+        if not len(pending):
+            return 0
+        head = pending[:MAX_CHUNK_SIZE]
+        # Enough work left for every worker to stay busy until the end
+        target = min(
+            TARGET_CHUNK_SECONDS / self.seconds_per_sample,
+            float(np.sum(self.samples[pending])) / (self.workers * MIN_CHUNKS_PER_WORKER),
+        )
+        size = int(np.searchsorted(np.cumsum(self.samples[head]), target, side="right"))
+        if self.batch and self.budget is not None:
+            file_bytes = float(np.max(self.memory_samples[head])) * self.bytes_per_sample
+            size = min(size, int((self.budget / self.workers - WORKER_OVERHEAD_BYTES) / max(file_bytes, 1.0)))
+        return max(size, 1)
+
+    def observe(self, positions, elapsed):
+        """Updates the time per sample with a chunk of ``positions`` that took ``elapsed`` seconds."""
+        n_samples = float(np.sum(self.samples[positions]))
+        if n_samples > 0 and elapsed > 0:
+            self.seconds_per_sample = 0.5 * self.seconds_per_sample + 0.5 * elapsed / n_samples
+
+    def max_in_flight(self):
+        """Number of chunks to keep submitted, lowered while memory is short."""
+        available = available_memory()
+        if available is not None:
+            if available < self.worker_bytes and self.in_flight > 1:
+                self.in_flight -= 1
+            elif available > 2 * self.worker_bytes and self.in_flight < self.workers:
+                self.in_flight += 1
+        return self.in_flight
@@ -0,0 +1,364 @@
+"""
+Headless pipeline: load -> segment -> acoustic indices, without Dash.
+
+Runs the same steps as the Load Data, Audio Segmentation and Acoustic Indices
+pages with the same parameters, and writes the same outputs to the output
+directory, so the UI can open the results of a scheduled run:
+
+- ``original_dataset.parquet``
+- ``audio_segments/`` and ``segmented_dataset.parquet`` (with ``--segment``)
+- ``acoustic_indices_dataset/`` (partitioned Parquet)
+- ``acoustic_indices_profile*`` (with ``--profile``)
+
+The index run is checkpointed in its dataset directory: rerunning the same
+command after an interruption resumes from the completed chunks.
+
+With ``--distributed``, the output directory must be shared between hosts:
+the index run is split into work units there (see
+``acoustic_indices.distributed``) and calculated by local worker processes
+and by ``maui-indices-worker`` on any other host.
+
+Example::
+
+    maui-indices /data/recordings -o /data/out --format-name LEEC_FILE_FORMAT \\
+        --segment scale_60 --indices ACI ADI NDSI --mode batch
+    maui-indices-worker /data/out/acoustic_indices_dataset   # on other hosts
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import sys
+import time
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from acoustic_indices import distributed, profiling, runner, tuning
+from acoustic_indices.acoustic_indices_calculation import INDICES, AcousticIndices
+from acoustic_indices.cache import ResultCache
+from utils import audio_cache, audio_scan, dataset_store, definitions, random_utils
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="maui-indices",
+        description="Load a recording dataset, optionally segment it and calculate acoustic indices.",
+    )
+    parser.add_argument("dataset", help="audio file or directory (or a .parquet dataset with --from-parquet)")
+    parser.add_argument("-o", "--output-dir", required=True, help="directory of the outputs")
+
+    load = parser.add_argument_group("loading")
+    load.add_argument("--format-name", help="file name format of the recordings (required unless --from-parquet)")
+    load.add_argument("--format-file", help="YAML file with the formats (default: the formats bundled with maui)")
+    load.add_argument("--sample-percentage", type=float, default=100, help="percentage of the files to load")
+    load.add_argument("--no-duration", action="store_true", help="do not calculate the file durations")
+    load.add_argument("--from-parquet", action="store_true", help="DATASET is an already loaded (or segmented) dataset")
+
+    seg = parser.add_argument_group("segmentation")
+    seg.add_argument("--segment", choices=definitions.AVAILABLE_UNITS, help="segment the files in this time unit")
+    seg.add_argument("--datetime-col", default="timestamp_init", help="start time column used by the segmentation")
+
+    idx = parser.add_argument_group("acoustic indices")
+    idx.add_argument("--indices", nargs="+", help="index names or labels (default: all)")
+    idx.add_argument("--file-path-col", help="column with the audio paths (default: file_path, or segment_file_path when segmenting)")
+    idx.add_argument("--mode", choices=["file", "batch", "streaming"], default="file", help="computation mode")
+    idx.add_argument("--block-duration", type=float, default=60.0, help="block duration in seconds (streaming mode)")
+    idx.add_argument("--float32", action="store_true", help="compute in float32")
+    idx.add_argument("--workers", type=int, help="maximum number of worker processes (default: all cores); "
+                     "with --chunk-size, 1 runs sequentially and anything else uses all cores")
+    idx.add_argument("--chunk-size", type=int, help="fixed chunk size, instead of the automatic one")
+    idx.add_argument("--temp-dir", default="./tmp_maui_ac_files/", help="directory for temporary files")
+    idx.add_argument("--result-cache", help="directory of the persistent per-file result cache")
+    idx.add_argument("--result-cache-size", type=float, default=2, help="result cache size limit (GB)")
+    idx.add_argument("--audio-cache", action="store_true", help="cache the decoded audio (shared with the UI)")
+    idx.add_argument("--audio-cache-size", type=float, default=10, help="decoded audio cache size limit (GB)")
+    idx.add_argument("--profile", action="store_true", help="record and save per-stage timings")
+
+    dist = parser.add_argument_group("distributed")
+    dist.add_argument("--distributed", action="store_true",
+                      help="split the index run into work units that worker processes on any host can claim "
+                           "(--chunk-size, --result-cache and --profile do not apply)")
+    dist.add_argument("--unit-minutes", type=float, default=distributed.DEFAULT_UNIT_AUDIO_SECONDS / 60,
+                      help="minutes of audio per work unit")
+    dist.add_argument("--lease-seconds", type=float, default=distributed.DEFAULT_LEASE_SECONDS,
+                      help="time after which the unit of an unresponsive worker is taken over")
+    return parser
+
+
+def resolve_indices(names):
+    """Maps index names or UI labels to index names."""
+    if not names:
+        return [index.name for index in INDICES]
+    by_label = {index.label: index.name for index in INDICES}
+    valid = {index.name for index in INDICES}
+    resolved = []
+    for name in names:
+        name = by_label.get(name, name)
+        if name not in valid:
+            raise SystemExit(f"Unknown acoustic index '{name}'. Available: {', '.join(sorted(valid))}")
+        resolved.append(name)
+    return resolved
+
+
+def load_dataset(args):
+    if args.from_parquet:
+        return dataset_store.load(args.dataset)
+    if not args.format_name:
+        raise SystemExit("--format-name is required to load audio files")
+    return audio_scan.get_audio_info(
+        args.dataset,
+        format_file_path=args.format_file,
+        format_name=args.format_name,
+        date_time_func=None,
+        store_duration=not args.no_duration,
+        perc_sample=args.sample_percentage / 100,
+        output_dir=args.output_dir,
+    )
+
+
+def segment_dataset(df, unit, output_dir, file_path_col, datetime_col, workers):
+    """``maui.utils.segment_audio_files`` split over ``workers`` processes by file."""
+    from maui import utils as maui_utils
+
+    segment = partial(
+        maui_utils.segment_audio_files,
+        min_duration=random_utils.unit_conversion(unit),
+        output_dir=output_dir,
+        file_path_col=file_path_col,
+        datetime_col=datetime_col,
+    )
+    os.makedirs(output_dir, exist_ok=True)
+    parts = [df.iloc[positions] for positions in np.array_split(np.arange(len(df)), min(len(df), workers * 4))]
+    if workers > 1 and len(parts) > 1:
+        with mp.Pool(processes=workers) as pool:
+            segmented = pool.map(segment, parts)
+    else:
+        segmented = [segment(part) for part in parts]
+    df_seg = pd.concat(segmented)
+    df_seg["duration"] = (df_seg["end_time"] - df_seg["start_time"]).dt.total_seconds()
+    return df_seg
+
+
+def audio_seconds(df, file_path_col):
+    durations, _ = tuning.probe_files(df, file_path_col)
+    return float(np.sum(durations))
+
+
+class Progress(object):
+    """Prints the progress of the index run at most every ``interval`` seconds."""
+    def __init__(self, interval=10.0):
+        self.interval = interval
+        self.started = time.time()
+        self.last = 0.0
+        self.last_done = None
+
+    def __call__(self, done, total):
+        now = time.time()
+        if done == self.last_done or (now - self.last < self.interval and done < total):
+            return
+        self.last, self.last_done = now, done
+        elapsed = now - self.started
+        rate = done / elapsed if elapsed > 0 else 0.0
+        eta = f"{(total - done) / rate:.0f} s" if rate > 0 else "--"
+        print(f"  {done}/{total} files  {rate:.2f} files/s  ETA {eta}", flush=True)
+
+
+def run_workers(run_dir, processes, lease_seconds, decoded_audio_cache=None, wait=True):
+    """
+    Runs ``processes`` distributed workers on this host and reports the
+    progress of the run. Returns ``distributed.status`` with the number of
+    local workers that exited with an error (``failed_workers``).
+    """
+    procs = [
+        mp.Process(
+            target=distributed.work, args=(run_dir,),
+            kwargs={"lease_seconds": lease_seconds, "wait": wait, "audio_cache": decoded_audio_cache},
+        )
+        for _ in range(processes)
+    ]
+    for proc in procs:
+        proc.start()
+    progress = Progress()
+    try:
+        while any(proc.is_alive() for proc in procs):
+            for proc in procs:
+                proc.join(timeout=1.0)
+            state = distributed.status(run_dir)
+            progress(state["rows_done"], state["rows"])
+    except KeyboardInterrupt:
+        for proc in procs:
+            proc.terminate()
+        raise
+    state = distributed.status(run_dir)
+    state["failed_workers"] = sum(proc.exitcode != 0 for proc in procs)
+    return state
+
+
+def report_unfinished(state, run_dir):
+    """Prints why a distributed run is not complete (see ``run_workers``)."""
+    if state["failed_workers"]:
+        print(f"Error: {state['failed_workers']} worker process(es) failed; see the tracebacks above.",
+              file=sys.stderr)
+    if state["pending"]:
+        units = ", ".join(str(unit) for unit in state["pending_units"][:20])
+        more = " ..." if state["pending"] > 20 else ""
+        print(f"Error: {state['pending']}/{state['units']} units not calculated ({units}{more}); "
+              f"{state['rows_done']}/{state['rows']} rows done in {run_dir}.", file=sys.stderr)
+
+
+def print_stats(stages):
+    print("\nThroughput")
+    print(f"{'stage':<12}{'wall (s)':>10}{'files':>9}{'files/s':>10}{'audio (h)':>11}{'x real time':>13}")
+    for name, wall, n_files, seconds in stages:
+        rate = n_files / wall if wall > 0 else 0.0
+        speed = seconds / wall if wall > 0 else 0.0
+        print(f"{name:<12}{wall:>10.1f}{n_files:>9d}{rate:>10.2f}{seconds / 3600:>11.2f}{speed:>13.1f}")
+
+
+def main(argv=None):
+    """Entry point of ``maui-indices``."""
+    args = build_parser().parse_args(argv)
+    os.makedirs(args.output_dir, exist_ok=True)
+    workers = args.workers or os.cpu_count() or 1
+    stages = []
+
+    t0 = time.time()
+    print(f"Loading {args.dataset}...")
+    df = load_dataset(args)
+    if not args.from_parquet:
+        dataset_store.save(df, dataset_store.path(args.output_dir, dataset_store.ORIGINAL), dataset_store.ORIGINAL)
+    file_path_col = "file_path"
+    stages.append(("load", time.time() - t0, len(df), audio_seconds(df, file_path_col) if file_path_col in df else 0.0))
+
+    if args.segment:
+        t0 = time.time()
+        print(f"Segmenting {len(df)} files ({args.segment})...")
+        df = segment_dataset(
+            df, args.segment, os.path.join(args.output_dir, "audio_segments"),
+            file_path_col, args.datetime_col, workers,
+        )
+        dataset_store.save(df, dataset_store.path(args.output_dir, dataset_store.SEGMENTED), dataset_store.SEGMENTED)
+        file_path_col = "segment_file_path"
+        stages.append(("segment", time.time() - t0, len(df), float(df["duration"].sum())))
+    file_path_col = args.file_path_col or file_path_col
+
+    aidx = AcousticIndices(compact=True, dtype=np.float32 if args.float32 else np.float64, profile=args.profile)
+    aidx.set_indices(resolve_indices(args.indices))
+
+    streaming_method = None
+    batch_method = None
+    if args.mode == "streaming":
+        streaming_method = partial(aidx.calculate_streaming, block_duration=args.block_duration)
+    elif args.mode == "batch":
+        batch_method = aidx.calculate_batch
+
+    tuner = None
+    if args.chunk_size is None:
+        tuner = tuning.AutoTuner.for_run(
+            df, file_path_col, aidx, mode=args.mode, block_duration=args.block_duration, n_cpus=workers
+        )
+
+    result_cache = None
+    if args.result_cache:
+        result_cache = ResultCache(
+            args.result_cache,
+            aidx.result_cache_entries(streaming=args.mode == "streaming"),
+            max_bytes=int(args.result_cache_size * 1024**3),
+        )
+    decoded_audio_cache = None
+    if args.audio_cache:
+        decoded_audio_cache = audio_cache.AudioCache(max_bytes=int(args.audio_cache_size * 1024**3))
+
+    t0 = time.time()
+    print(f"Calculating {', '.join(aidx.indices)} for {len(df)} files ({args.mode} mode)...")
+    dataset_path = dataset_store.path(args.output_dir, dataset_store.INDICES)
+    try:
+        if args.distributed:
+            try:
+                n_units = distributed.plan(
+                    df, file_path_col, aidx, dataset_path, mode=args.mode, block_duration=args.block_duration,
+                    unit_audio_seconds=args.unit_minutes * 60,
+                )
+            except ValueError as e:
+                print(f"Error: {e}", file=sys.stderr)
+                return 1
+            print(f"Planned {n_units} work units in {dataset_path}; other hosts can join with:")
+            print(f"  maui-indices-worker {os.path.abspath(dataset_path)}")
+            state = run_workers(dataset_path, workers, args.lease_seconds, decoded_audio_cache)
+            if state["failed_workers"] or state["pending"]:
+                report_unfinished(state, dataset_path)
+                print("Fix the error and run the same command again to resume from the completed units.",
+                      file=sys.stderr)
+                return 1
+        else:
+            runner.calculate_acoustic_indices(
+                df_init=df,
+                file_path_col=file_path_col,
+                acoustic_indices_methods=aidx.acoustic_indices_methods,
+                pre_calculation_method=aidx.pre_calculation_method,
+                parallel=workers > 1,
+                chunk_size=args.chunk_size,
+                temp_dir=args.temp_dir,
+                streaming_method=streaming_method,
+                batch_method=batch_method,
+                cache=result_cache,
+                profiler=aidx.profiler,
+                progress=Progress(),
+                checkpoint_key=runner.checkpoint_key(aidx, args.mode, args.block_duration),
+                tuner=tuner,
+                dataset_path=dataset_path,
+                audio_cache=decoded_audio_cache,
+            )
+    except KeyboardInterrupt:
+        print("\nInterrupted; run the same command again to resume from the completed chunks.")
+        return 130
+    stages.append(("indices", time.time() - t0, len(df), audio_seconds(df, file_path_col)))
+    print(f"Acoustic indices saved to {dataset_path}")
+
+    if aidx.profiler is not None:
+        summary = profiling.save_profile(aidx.profiler.to_frame(), args.output_dir)
+        print("\nStage profile")
+        print(summary.to_string(index=False))
+
+    print_stats(stages)
+    return 0
+
+
+def worker_main(argv=None):
+    """Entry point of ``maui-indices-worker``: joins a distributed index run."""
+    parser = argparse.ArgumentParser(
+        prog="maui-indices-worker",
+        description="Calculate work units of a distributed index run planned by maui-indices --distributed.",
+    )
+    parser.add_argument("run_dir", help="acoustic_indices_dataset directory of the run")
+    parser.add_argument("--processes", type=int, help="worker processes on this host (default: all cores)")
+    parser.add_argument("--lease-seconds", type=float, default=distributed.DEFAULT_LEASE_SECONDS,
+                        help="time after which the unit of an unresponsive worker is taken over")
+    parser.add_argument("--no-wait", action="store_true",
+                        help="exit when no unit is left to claim, instead of waiting for the other workers")
+    parser.add_argument("--audio-cache", action="store_true", help="cache the decoded audio on this host")
+    args = parser.parse_args(argv)
+
+    decoded_audio_cache = audio_cache.AudioCache() if args.audio_cache else None
+    t0 = time.time()
+    try:
+        state = run_workers(
+            args.run_dir, args.processes or os.cpu_count() or 1, args.lease_seconds,
+            decoded_audio_cache, wait=not args.no_wait,
+        )
+    except KeyboardInterrupt:
+        print("\nInterrupted; the leases of this host expire and its units are taken over.")
+        return 130
+    print(f"{state['done']}/{state['units']} units done in {time.time() - t0:.1f} s")
+    # With --no-wait, units still leased by other hosts are not an error
+    if state["failed_workers"] or (state["pending"] and not args.no_wait):
+        report_unfinished(state, args.run_dir)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    mp.freeze_support()
+    sys.exit(main())
@@ -3,18 +3,21 @@ import dash
 from dash import html, dcc, callback, Input, Output, State
 import dash_mantine_components as dmc
 import pandas as pd
+import numpy as np
 import json
 import os
+from functools import partial
 
 from acoustic_indices.acoustic_indices_calculation import AcousticIndices
-from maui import acoustic_indices as maui_acoustic_indices
+from acoustic_indices import runner, profiling, jobs, tuning
+from acoustic_indices.cache import ResultCache
 
-from utils import io_utils
+from utils import audio_cache, dataset_store
 
 dash.register_page(__name__, path="/acoustic-indices", name="Acoustic Indices")
 
 # Instantiate AcousticIndices
-AIdx = AcousticIndices()
+AIdx = AcousticIndices(compact=True)
 AVAILABLE_INDICES = AIdx.available_indices
 
 layout = dmc.Container([
@@ -65,7 +68,10 @@ layout = dmc.Container([
                                     children=[
                                         dmc.Radio(label="Sequential", value="sequential", mb="sm"),
                                         dmc.Radio(label="Parallel", value="parallel", mb="sm"),
+                                        dmc.Radio(label="Auto", value="auto", mb="sm"),
                                     ],
+                                    description="Auto picks the workers and chunk sizes from the file durations, "
+                                                "the available memory and the measured throughput; Chunk Size is ignored.",
                                     mb="md",
                                 ),
 
@@ -87,9 +93,86 @@ layout = dmc.Container([
                                     id="temp-directory",
                                     label="Temporary Directory",
                                     placeholder="Insert the temporary directory",
+                                    description="Scratch files of the runner. Completed chunks are checkpointed with the results, in <output directory>/acoustic_indices_dataset (acoustic_indices_dataset.partial while a run replaces earlier results); an interrupted run with the same dataset and indices resumes from them",
                                     value="./temp_dir_ac",
                                     mb="md",
                                 ),
+
+                                # Modo de cálculo: por arquivo, em lote (segmentos de mesmo tamanho) ou em blocos
+                                dmc.RadioGroup(
+                                    id="computation-mode",
+                                    label="Computation Mode",
+                                    description="Batch vectorizes equal-length segments; Block Streaming bounds memory on long files (matrix outputs such as aci_xx are skipped)",
+                                    value="file",
+                                    children=[
+                                        dmc.Radio(label="Per File", value="file", mb="sm"),
+                                        dmc.Radio(label="Batch (equal-length segments)", value="batch", mb="sm"),
+                                        dmc.Radio(label="Block Streaming", value="streaming", mb="sm"),
+                                    ],
+                                    mb="md",
+                                ),
+                                dmc.NumberInput(
+                                    id="streaming-block-duration",
+                                    label="Block Duration (s)",
+                                    value=60,
+                                    min=1,
+                                    step=10,
+                                ),
+
+                                # Precisão numérica dos espectrogramas
+                                dmc.Switch(
+                                    id="float32-mode",
+                                    label="Float32 Precision",
+                                    description="Compute spectrograms and indices in float32 (about half the memory). Noise-profile indices (spectral events and cover, Hf, Ht_per_bin) can differ by up to 10%, more on files with digital silence",
+                                    checked=False,
+                                ),
+
+                                # Cache persistente dos resultados por arquivo e índice
+                                dmc.Switch(
+                                    id="result-cache-switch",
+                                    label="Reuse Cached Results",
+                                    description="Only compute the (file, index) pairs missing from the on-disk result cache",
+                                    checked=True,
+                                ),
+                                dmc.TextInput(
+                                    id="result-cache-dir",
+                                    label="Result Cache Directory",
+                                    value="./index_cache",
+                                ),
+                                dmc.NumberInput(
+                                    id="result-cache-size",
+                                    label="Result Cache Size Limit (GB)",
+                                    description="Least recently used results are evicted above this size",
+                                    value=2,
+                                    min=0.1,
+                                    step=0.5,
+                                    decimalScale=1,
+                                ),
+
+                                # Cache do áudio decodificado, compartilhado com a página de espectrogramas
+                                dmc.Switch(
+                                    id="audio-cache-switch",
+                                    label="Cache Decoded Audio",
+                                    description=f"Decode each file once into {audio_cache.DEFAULT_CACHE_DIR} and read it back "
+                                                "memory-mapped (also used by the spectrogram viewer)",
+                                    checked=False,
+                                ),
+                                dmc.NumberInput(
+                                    id="audio-cache-size",
+                                    label="Decoded Audio Cache Size Limit (GB)",
+                                    value=10,
+                                    min=0.5,
+                                    step=1,
+                                    decimalScale=1,
+                                ),
+
+                                # Instrumentação por etapa (tempo e memória)
+                                dmc.Switch(
+                                    id="profile-mode",
+                                    label="Profile Stages",
+                                    description="Record wall time, CPU time and peak allocation of every spectrogram stage and index (slower)",
+                                    checked=False,
+                                ),
                             ])
                         ]),
                     ], value="processing-settings")
@@ -111,11 +194,25 @@ layout = dmc.Container([
                     leftSection=html.I(className="fas fa-eraser"),
                     size="md",
                     color="gray"
+                ),
+                dmc.Button(
+                    "Cancel",
+                    id="indices-cancel-btn",
+                    variant="outline",
+                    leftSection=html.I(className="fas fa-stop"),
+                    size="md",
+                    color="red",
+                    disabled=True
                 )
             ], gap="md")
         ], gap="md"),
     ], p="md", withBorder=False, radius="md", mb="xl", shadow="md"),
 
+    # Progresso do job em segundo plano (fora do dcc.Loading para não piscar a cada consulta)
+    dcc.Store(id="indices-job", storage_type="memory"),
+    dcc.Interval(id="indices-job-interval", interval=1000, disabled=True),
+    html.Div(id="indices-job-progress"),
+
     # Área de resultados ENVOLVIDA em dcc.Loading!
     dcc.Loading(
         id="loading-idx", type="dot",
@@ -152,8 +249,7 @@ def populate_file_path_column_choices(df_json_original, df_json_seg):
     if not isinstance(df_json, dict):
         return [], None
 
-    df = io_utils.load_df_complex_parquet(df_json['data_path'])
-    cols = df.columns
+    cols = dataset_store.read_columns(df_json['data_path'])
 
     options = [{"label": col, "value": col} for col in cols]
     default_value = "file_path" if "file_path" in cols else (cols[0] if cols else None)
@@ -194,10 +290,88 @@ def _preview(df_indices: pd.DataFrame):
         ], h=400),
     ])
 
+def _profile_table(summary: pd.DataFrame):
+    columns = {
+        "kind": "Kind", "stage": "Stage", "calls": "Calls", "wall_total_s": "Wall (s)",
+        "wall_mean_ms": "Mean wall (ms)", "cpu_total_s": "CPU (s)",
+        "peak_max_mb": "Peak alloc (MB)", "wall_share_pct": "Share (%)",
+    }
+    return dmc.Stack([
+        dmc.Title("Stage Profile", order=4),
+        dmc.Table([
+            dmc.TableThead([
+                dmc.TableTr([dmc.TableTh(label) for label in columns.values()])
+            ]),
+            dmc.TableTbody([
+                dmc.TableTr([
+                    dmc.TableTd(f"{val:.3f}" if isinstance(val, float) else str(val))
+                    for val in row
+                ]) for row in summary[list(columns)].itertuples(index=False)
+            ]),
+        ],
+        striped=True,
+        highlightOnHover=True,
+        withTableBorder=True),
+    ])
+
+def _run_indices_job(df, aidx, output_dir, progress, cancel_event, cache_config=None, **runner_kwargs):
+    """Job submitted to ``jobs.JOBS``: calculates, saves and profiles the indices."""
+    # O cache de resultados é criado na thread do job, que é onde o SQLite é usado
+    cache = ResultCache(**cache_config) if cache_config is not None else None
+    # Dataset particionado: cada chunk é gravado assim que calculado e pode
+    # ser lido durante o cálculo; nada é montado em memória
+    output_path = runner.calculate_acoustic_indices(
+        df_init=df,
+        acoustic_indices_methods=aidx.acoustic_indices_methods,
+        pre_calculation_method=aidx.pre_calculation_method,
+        profiler=aidx.profiler,
+        progress=progress,
+        cancel_event=cancel_event,
+        dataset_path=dataset_store.path(output_dir, dataset_store.INDICES),
+        cache=cache,
+        **runner_kwargs
+    )
+
+    print("-------------> calculado")
+
+    profile_summary = None
+    if aidx.profiler is not None:
+        profile_summary = profiling.save_profile(aidx.profiler.to_frame(), output_dir)
+    return {"data_path": output_path, "profile_summary": profile_summary}
+
+
+def _format_duration(seconds):
+    if seconds is None:
+        return "--"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:d}:{minutes:02d}:{seconds:02d}"
+
+
+def _job_progress(status):
+    percent = 100 * status["done"] / status["total"] if status["total"] else 0
+    return dmc.Paper([
+        dmc.Stack([
+            dmc.Text(f"Acoustic indices job {status['status']}", fw=500),
+            dmc.Progress(value=percent, size="lg", animated=status["status"] == jobs.RUNNING, striped=True),
+            dmc.Text(
+                f"{status['done']} / {status['total']} files  |  "
+                f"{status['files_per_s']:.2f} files/s  |  "
+                f"elapsed {_format_duration(status['elapsed_s'])}  |  "
+                f"ETA {_format_duration(status['eta_s'])}",
+                size="sm", c="dimmed"
+            ),
+        ], gap="xs")
+    ], p="md", withBorder=True, radius="md", mb="md")
+
+
 @callback(
     Output("results-container-idx", "children"),
     Output("indices-run-btn", "n_clicks"),
     Output("global-audio-df-idx", "data"),
+    Output("indices-job", "data"),
+    Output("indices-job-interval", "disabled"),
+    Output("indices-cancel-btn", "disabled"),
 
     Input("indices-run-btn", "n_clicks"),
 
@@ -209,89 +383,167 @@ def _preview(df_indices: pd.DataFrame):
     State("chunk-size", "value"),
     State("file-path-column", "value"),
     State("temp-directory", "value"),
+    State("computation-mode", "value"),
+    State("streaming-block-duration", "value"),
+    State("float32-mode", "checked"),
+    State("result-cache-switch", "checked"),
+    State("result-cache-dir", "value"),
+    State("result-cache-size", "value"),
+    State("profile-mode", "checked"),
+    State("audio-cache-switch", "checked"),
+    State("audio-cache-size", "value"),
     State("global-output-df-dir", "data"),
     prevent_initial_call=False
 )
 def calculate_and_show(n_clicks, df_json, df_json_seg, df_json_original, indices_map,
-                      processing_type, chunk_size, file_path_col, temp_dir, output_dir_json):
+                      processing_type, chunk_size, file_path_col, temp_dir, computation_mode,
+                      block_duration, float32_mode, use_cache, cache_dir, cache_size,
+                      profile_mode, use_audio_cache, audio_cache_size, output_dir_json):
+    no_job = (dash.no_update, True, True)
 
     if df_json_original is None:
         if not n_clicks:
             if df_json is None:
-                return dmc.Alert("Load the dataset before calculating acoustic indices.", color="yellow", title="Validation Error"), False, None
+                return dmc.Alert("Load the dataset before calculating acoustic indices.", color="yellow", title="Validation Error"), False, None, *no_job
             else:
 
-                return dmc.Alert("Load the dataset before calculating acoustic indices.", color="yellow", title="Validation Error"), False, df_json
+                return dmc.Alert("Load the dataset before calculating acoustic indices.", color="yellow", title="Validation Error"), False, df_json, *no_job
 
         else:
             if df_json is None:
-                return dmc.Alert("Load the dataset before calculating acoustic indices.", color="yellow", title="Validation Error"), False, None
+                return dmc.Alert("Load the dataset before calculating acoustic indices.", color="yellow", title="Validation Error"), False, None, *no_job
             else:
-                return dmc.Alert("Load the dataset before calculating acoustic indices.", color="yellow", title="Validation Error"), False, df_json
+                return dmc.Alert("Load the dataset before calculating acoustic indices.", color="yellow", title="Validation Error"), False, df_json, *no_job
 
     if not n_clicks:
         if df_json is None:
-            return dash.no_update, False, None
+            return dash.no_update, False, None, *no_job
         else:
             df_json_parse = json.loads(df_json)
-            df_indices = io_utils.load_df_complex_parquet(df_json_parse['data_path'])
-            return _preview(df_indices), False, df_json
+            df_indices = dataset_store.load(df_json_parse['data_path'])
+            return _preview(df_indices), False, df_json, *no_job
+
+    if not indices_map:
+        return dmc.Alert("Select at least one acoustic index.", color="yellow", title="Validation Error"), False, dash.no_update, *no_job
 
     if df_json_seg is None:
         df_json_original_parse = json.loads(df_json_original)
-        df = io_utils.load_df_complex_parquet(df_json_original_parse['data_path'])
+        df = dataset_store.load(df_json_original_parse['data_path'])
 
     else:
         df_json_seg_parse = json.loads(df_json_seg)
-        df = io_utils.load_df_complex_parquet(df_json_seg_parse['data_path'])
-
-        
+        df = dataset_store.load(df_json_seg_parse['data_path'])
 
     if df_json is not None:
         df_json_parse = json.loads(df_json)
-        df = io_utils.load_df_complex_parquet(df_json_parse['data_path'])
-    else:
-        df_indices = None
-
-    if n_clicks and indices_map:
-        indices = indices_map
-        AIdx.set_indices(indices)
-
-        # Ajusta parâmetros do cálculo conforme inputs
-        parallel_flag = False
-        if processing_type:
-            parallel_flag = processing_type.lower() == "parallel"
-
-        df_indices = maui_acoustic_indices.calculate_acoustic_indices(
-            df_init=df,
-            file_path_col=file_path_col,
-            acoustic_indices_methods=AIdx.acoustic_indices_methods,
-            pre_calculation_method=AIdx.pre_calculation_method,
-            parallel=parallel_flag,
-            chunk_size=chunk_size,
-            temp_dir=temp_dir
+        df = dataset_store.load(df_json_parse['data_path'])
+
+    # Uma instância por job: set_indices altera o plano de intermediários
+    aidx = AcousticIndices(
+        compact=True, dtype=np.float32 if float32_mode else np.float64, profile=bool(profile_mode)
+    )
+    aidx.set_indices(indices_map)
+
+    # Ajusta parâmetros do cálculo conforme inputs
+    parallel_flag = False
+    if processing_type:
+        parallel_flag = processing_type.lower() == "parallel"
+
+    tuner = None
+    if processing_type == "auto":
+        tuner = tuning.AutoTuner.for_run(
+            df, file_path_col, aidx, mode=computation_mode, block_duration=float(block_duration or 60)
         )
 
-        print("-------------> calculado")
-
-
-        output_dir_json_parse = json.loads(output_dir_json)
-        output_dir = output_dir_json_parse["output_dir"]
-        output_path = os.path.join(output_dir, "acoustic_indices_dataset.parquet")
-        
-        # io_utils.save_df_complex_parquet(df_indices, output_path)
-        df_indices.to_csv(output_path)
+    streaming_method = None
+    batch_method = None
+    if computation_mode == "streaming":
+        streaming_method = partial(aidx.calculate_streaming, block_duration=float(block_duration or 60))
+    elif computation_mode == "batch":
+        batch_method = aidx.calculate_batch
+
+    cache_config = None
+    if use_cache and cache_dir:
+        cache_config = dict(
+            cache_dir=cache_dir,
+            entries=aidx.result_cache_entries(streaming=computation_mode == "streaming"),
+            max_bytes=int(float(cache_size or 2) * 1024**3),
+        )
 
-        print("-------------> Salvo na memoria")
+    decoded_audio_cache = None
+    if use_audio_cache:
+        decoded_audio_cache = audio_cache.AudioCache(max_bytes=int(float(audio_cache_size or 10) * 1024**3))
+
+    # Identidade do cálculo: uma nova execução idêntica retoma das partes já salvas no dataset de
+    # índices do diretório de saída; uma execução diferente só substitui o resultado anterior ao terminar
+    checkpoint_key = runner.checkpoint_key(aidx, computation_mode, float(block_duration or 60))
+
+    output_dir = json.loads(output_dir_json)["output_dir"]
+    job_id = jobs.JOBS.submit(
+        _run_indices_job, len(df), df, aidx, output_dir,
+        file_path_col=file_path_col,
+        parallel=parallel_flag,
+        chunk_size=chunk_size,
+        temp_dir=temp_dir,
+        streaming_method=streaming_method,
+        batch_method=batch_method,
+        cache_config=cache_config,
+        checkpoint_key=checkpoint_key,
+        tuner=tuner,
+        audio_cache=decoded_audio_cache,
+    )
+    return dash.no_update, False, dash.no_update, {"job_id": job_id}, False, False
 
 
+@callback(
+    Output("indices-job-progress", "children"),
+    Output("results-container-idx", "children", allow_duplicate=True),
+    Output("global-audio-df-idx", "data", allow_duplicate=True),
+    Output("indices-job-interval", "disabled", allow_duplicate=True),
+    Output("indices-cancel-btn", "disabled", allow_duplicate=True),
+    Input("indices-job-interval", "n_intervals"),
+    State("indices-job", "data"),
+    prevent_initial_call=True
+)
+def poll_indices_job(n_intervals, job):
+    status = jobs.JOBS.status(job["job_id"]) if job else None
+    if status is None:
+        return None, dash.no_update, dash.no_update, True, True
+
+    if status["status"] in (jobs.QUEUED, jobs.RUNNING):
+        return _job_progress(status), dash.no_update, dash.no_update, False, False
+
+    if status["status"] == jobs.CANCELLED:
+        alert = dmc.Alert("The acoustic indices calculation was cancelled.", color="gray", title="Cancelled")
+        return _job_progress(status), alert, dash.no_update, True, True
+
+    if status["status"] == jobs.FAILED:
+        alert = dmc.Alert(status["error"], color="red", title="Acoustic indices calculation failed")
+        return _job_progress(status), alert, dash.no_update, True, True
+
+    result = jobs.JOBS.result(job["job_id"])
+    df_indices = dataset_store.load(result["data_path"])
+    return_dict = {
+        "indices_data_loaded": True,
+        "data_path": result["data_path"],
+        "version": dataset_store.version(result["data_path"]),
+    }
+    children = _preview(df_indices)
+    if result["profile_summary"] is not None:
+        children = dmc.Stack([children, _profile_table(result["profile_summary"])])
+    return _job_progress(status), children, json.dumps(return_dict), True, True
 
-    if df_indices is not None:
-        return_dict = {"indices_data_loaded": True, "data_path": output_path}
-    else:
-        None
 
-    return _preview(df_indices), False, json.dumps(return_dict)
+@callback(
+    Output("indices-cancel-btn", "disabled", allow_duplicate=True),
+    Input("indices-cancel-btn", "n_clicks"),
+    State("indices-job", "data"),
+    prevent_initial_call=True
+)
+def cancel_indices_job(n_clicks, job):
+    if job:
+        jobs.JOBS.cancel(job["job_id"])
+    return True
 
 
 @callback(
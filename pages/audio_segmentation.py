@@ -8,6 +8,7 @@ import os
 
 from utils import definitions
 from utils import random_utils
+from utils import dataset_store
 
 
 from maui import utils as maui_utils
@@ -101,14 +102,13 @@ def populate_column_choices(df_json):
     if isinstance(df_json, str):
         try:
             df_json = json.loads(df_json)
-            df = pd.read_parquet(df_json['data_path'])
+            cols = dataset_store.read_columns(df_json['data_path'])
         except Exception as e:
             return [], None
 
     if not isinstance(df_json, dict):
         return [], None
 
-    cols = list(df.columns)
     print(cols)
 
     options = [{"label": col, "value": col} for col in cols]
@@ -146,7 +146,7 @@ def calculate_and_show(n_clicks, df_json_original, df_json, file_path_col, datet
     if not n_clicks:
         if df_json is not None:
             df_json_parse = json.loads(df_json)
-            df = pd.read_parquet(df_json_parse['data_path'])
+            df = dataset_store.load(df_json_parse['data_path'])
             return dmc.Stack([
                 dmc.Alert(
                     "Loading already segmented dataset!",
@@ -183,11 +183,11 @@ def calculate_and_show(n_clicks, df_json_original, df_json, file_path_col, datet
         return dash.no_update, False, None
 
     df_json_original_parse = json.loads(df_json_original)
-    df = pd.read_parquet(df_json_original_parse['data_path'])
+    df = dataset_store.load(df_json_original_parse['data_path'])
 
     if df_json is not None:
         df_json_parse = json.loads(df_json)
-        df_json_seg = pd.read_parquet(df_json_parse['data_path'])
+        df_json_seg = dataset_store.load(df_json_parse['data_path'])
     else:
         df_json_seg = None
 
@@ -213,13 +213,12 @@ def calculate_and_show(n_clicks, df_json_original, df_json, file_path_col, datet
         )
         df_json_seg['duration'] = (df_json_seg['end_time'] - df_json_seg['start_time']).dt.total_seconds()
 
-        output_path = os.path.join(output_dir, "segmented_dataset.parquet")
-
-        df_json_seg.to_parquet(output_path)
+        output_path = dataset_store.path(output_dir, dataset_store.SEGMENTED)
+        data_version = dataset_store.save(df_json_seg, output_path, dataset_store.SEGMENTED)
 
 
     if df_json_seg is not None:
-        return_dict = {"indices_data_loaded": True, "data_path": output_path}
+        return_dict = {"indices_data_loaded": True, "data_path": output_path, "version": data_version}
     else:
         None
 
@@ -7,6 +7,8 @@ import pandas as pd
 import plotly.graph_objects as go
 from maui import eda
 
+from utils import dataset_store
+
 import json
 
 dash.register_page(__name__, path="/eda", name="Exploratory Data Analysis")
@@ -15,6 +17,8 @@ dash.register_page(__name__, path="/eda", name="Exploratory Data Analysis")
 VISUALIZACOES = {
     "Summary (card_summary)": {
         "func": eda.card_summary,
+        # Columns read by the function besides its parameters
+        "columns": ["file_path", "dt", "duration"],
         "params": [
             {"name": "categories", "type": "multi_column", "label": "Categories (max. 2)", "max": 2, "required": True}
         ],
@@ -22,6 +26,7 @@ VISUALIZACOES = {
     },
     "Heatmap (heatmap_analysis)": {
         "func": eda.heatmap_analysis,
+        "columns": ["file_path"],
         "params": [
             {"name": "x_axis", "type": "column", "label": "X Axis (categorical)", "required": True},
             {"name": "y_axis", "type": "column", "label": "Y Axis (categorical)", "required": True},
@@ -56,6 +61,7 @@ VISUALIZACOES = {
     },
     "Duration Distribution (duration_distribution)": {
         "func": eda.duration_distribution,
+        "columns": ["duration"],
         "params": [
             {"name": "time_unit", "type": "string", "label": "Time Unit", "default": "s"}
         ],
@@ -225,7 +231,7 @@ def render_param_inputs(viz, df_json):
     
     try:
         df_json = json.loads(df_json)
-        df = pd.read_parquet(df_json['data_path'])
+        columns = dataset_store.read_columns(df_json['data_path'])
 
         viz_info = VISUALIZACOES[viz]
         
@@ -245,7 +251,7 @@ def render_param_inputs(viz, df_json):
                                       style={"fontStyle": "italic"})
         else:
             param_components = dmc.Stack([
-                build_param_component(param, df.columns) for param in params
+                build_param_component(param, columns) for param in params
             ], gap="sm")
         
         return description, param_components
@@ -281,8 +287,10 @@ def generate_viz(n_clicks, df_json, viz_type, values, ids):
     
     try:
         df_json = json.loads(df_json)
-        df = pd.read_parquet(df_json['data_path'])
         params_map = {c['name']: v for c, v in zip(ids, values)}
+        # Only the columns the visualization uses are read
+        columns = dataset_store.used_columns(VISUALIZACOES[viz_type], params_map, dataset_store.read_columns(df_json['data_path']))
+        df = dataset_store.load(df_json['data_path'], columns=columns)
         
         # Data validation
         is_valid, validation_msg = validate_data_for_visualization(df, viz_type, params_map)
@@ -6,11 +6,18 @@ import dash_mantine_components as dmc
 import pandas as pd
 import os
 import json
+from contextlib import closing
 
-from utils import io_utils
+from acoustic_indices import jobs
+from acoustic_indices.runner import Cancelled
+from utils import audio_scan, dataset_store, filename_metadata
 
 dash.register_page(__name__, path="/load-data", name="Load Audio Data")
 
+# Cargas têm sua própria fila: não esperam por um cálculo de índices em andamento
+LOAD_JOBS = jobs.JobManager()
+PREVIEW_ROWS = 10
+
 layout = dmc.Container([
     dmc.Title("Load Audio Data", order=1, mb=30),
 
@@ -62,13 +69,24 @@ layout = dmc.Container([
                 description="Path to the directory that the generate dataframes will be stored",
             ),
 
-            dmc.Button(
-                "Load Audio Data",
-                id="load-data-button",
-                variant="filled",
-                size="lg",
-                loading=False,
-            ),
+            dmc.Group([
+                dmc.Button(
+                    "Load Audio Data",
+                    id="load-data-button",
+                    variant="filled",
+                    size="lg",
+                    loading=False,
+                ),
+                dmc.Button(
+                    "Cancel",
+                    id="load-cancel-btn",
+                    variant="outline",
+                    leftSection=html.I(className="fas fa-stop"),
+                    size="lg",
+                    color="red",
+                    disabled=True,
+                ),
+            ], gap="md"),
 
             dmc.Divider(),
 
@@ -121,27 +139,58 @@ layout = dmc.Container([
                     ),
                 ], gap="sm", mb="sm"),
                 
-                dmc.Button(
-                    "Create Date Column",
-                    id="create-date-column-btn"
-                ),
+                dmc.Group([
+                    dmc.Button(
+                        "Create Date Column",
+                        id="create-date-column-btn"
+                    ),
+                    # Colunas criadas ficam em arquivos separados até serem incorporadas ao dataset
+                    dmc.Button(
+                        "Compact Dataset",
+                        id="compact-dataset-btn",
+                        variant="outline",
+                        disabled=True,
+                    ),
+                ], gap="sm"),
             ], id="combine-date-block", style={"display": "none"}),  # hidden initially
 
             dmc.Space(h=10),
         ], gap="md"),
     ], p="md", withBorder=False, radius="md", mb=30, shadow="md"),
 
+    # Progresso da carga em segundo plano
+    dcc.Store(id="load-job", storage_type="memory"),
+    dcc.Interval(id="load-job-interval", interval=1000, disabled=True),
+    html.Div(id="load-job-progress"),
+
     html.Div(id="results-container"),
 ], size="xl", p=40)
 
 
-def _preview(df: pd.DataFrame, sample_perc: int):
+def _preview_table(df: pd.DataFrame):
+    return dmc.ScrollArea([
+        dmc.Table([
+            dmc.TableThead([
+                dmc.TableTr([dmc.TableTh(col) for col in df.columns])
+            ]),
+            dmc.TableTbody([
+                dmc.TableTr([
+                    dmc.TableTd(str(df.iloc[i, j])) for j in range(len(df.columns))
+                ]) for i in range(min(PREVIEW_ROWS, len(df)))
+            ]),
+        ], striped=True, highlightOnHover=True, withTableBorder=True),
+    ], h=400)
+
+
+def _preview(df: pd.DataFrame, sample_perc: int, n_rows: int = None):
+    # n_rows: total de linhas quando df é só o início do dataset
+    n_rows = len(df) if n_rows is None else n_rows
     return dmc.Stack([
-        dmc.Alert(f"Successfully loaded {len(df)} audio files!", title="Success", color="green"),
+        dmc.Alert(f"Successfully loaded {n_rows} audio files!", title="Success", color="green"),
         dmc.SimpleGrid([
             dmc.Paper([
                 dmc.Text("Total Files", size="sm", c="dimmed"),
-                dmc.Text(str(len(df)), size="xl", fw=700),
+                dmc.Text(str(n_rows), size="xl", fw=700),
             ], p="md", withBorder=True),
             dmc.Paper([
                 dmc.Text("Columns", size="sm", c="dimmed"),
@@ -153,18 +202,81 @@ def _preview(df: pd.DataFrame, sample_perc: int):
             ], p="md", withBorder=True),
         ], cols=3, mb="md"),
         dmc.Title("Dataset Preview", order=3, mb="md"),
-        dmc.ScrollArea([
-            dmc.Table([
-                dmc.TableThead([
-                    dmc.TableTr([dmc.TableTh(col) for col in df.columns])
-                ]),
-                dmc.TableTbody([
-                    dmc.TableTr([
-                        dmc.TableTd(str(df.iloc[i, j])) for j in range(len(df.columns))
-                    ]) for i in range(min(10, len(df)))
-                ]),
-            ], striped=True, highlightOnHover=True, withTableBorder=True),
-        ], h=400),
+        _preview_table(df),
+    ])
+
+
+def _run_load_job(path, yaml_cfg, fmt_name, store_dur, sample_perc, output_dir, progress, cancel_event):
+    """
+    Job submitted to ``LOAD_JOBS``: scans the directory in batches and saves
+    the dataset. Each batch publishes the file count, the directory being
+    read and the first rows parsed, so a wrong file name format shows up in
+    the first batch instead of at the end of the scan.
+    """
+    batches = []
+    n_files = 0
+    head = pd.DataFrame()
+    stream = audio_scan.iter_audio_info(
+        path,
+        format_file_path=yaml_cfg,
+        format_name=fmt_name,
+        date_time_func=None,
+        store_duration=store_dur,
+        perc_sample=sample_perc / 100,
+        output_dir=output_dir,
+    )
+    # closing: o manifesto é gravado mesmo se a carga for cancelada
+    with closing(stream):
+        for batch in stream:
+            if cancel_event.is_set():
+                raise Cancelled()
+            batches.append(batch)
+            n_files += len(batch)
+            if len(head) < PREVIEW_ROWS:
+                head = filename_metadata.concat(batches).head(PREVIEW_ROWS)
+            progress(n_files, partial={
+                "directory": os.path.dirname(batch["file_path"].iloc[-1]),
+                "preview": head,
+            })
+
+    df = filename_metadata.concat(batches)
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = dataset_store.path(output_dir, dataset_store.ORIGINAL)
+    data_version = dataset_store.save(df, output_path, dataset_store.ORIGINAL)
+    return {"data_path": output_path, "version": data_version}
+
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:d}:{minutes:02d}:{seconds:02d}"
+
+
+def _job_progress(status, partial):
+    running = status["status"] in (jobs.QUEUED, jobs.RUNNING)
+    details = [
+        f"{status['done']} files",
+        f"{status['files_per_s']:.1f} files/s",
+        f"elapsed {_format_duration(status['elapsed_s'])}",
+    ]
+    if partial:
+        details.append(partial["directory"])
+    return dmc.Paper([
+        dmc.Stack([
+            dmc.Text(f"Loading job {status['status']}", fw=500),
+            # Total desconhecido até o fim da listagem: barra indeterminada
+            dmc.Progress(value=100, size="lg", animated=running, striped=running),
+            dmc.Text("  |  ".join(details), size="sm", c="dimmed"),
+        ], gap="xs")
+    ], p="md", withBorder=True, radius="md", mb="md")
+
+
+def _partial_preview(partial):
+    if not partial or partial["preview"].empty:
+        return None
+    return dmc.Stack([
+        dmc.Title("Dataset Preview (first files parsed)", order=3, mb="md"),
+        _preview_table(partial["preview"]),
     ])
 
 
@@ -173,6 +285,9 @@ def _preview(df: pd.DataFrame, sample_perc: int):
     Output("load-data-button", "loading"),
     Output("global-audio-df", "data"),
     Output("global-output-df-dir", "data"),
+    Output("load-job", "data"),
+    Output("load-job-interval", "disabled"),
+    Output("load-cancel-btn", "disabled"),
     Input("load-data-button", "n_clicks"),
     State("global-audio-df", "data"),  # current loaded data (json)
     State("dataset-path-input", "value"),
@@ -189,8 +304,8 @@ def handle_load(n_clicks, df_json, path, yaml_cfg, fmt_name, store_dur, sample_p
     if not n_clicks:
         if df_json is not None:
             df_json_parse = json.loads(df_json)
-            df = io_utils.load_df_complex_parquet(df_json_parse['data_path'])
-            return _preview(df, sample_perc), False, df_json, dash.no_update
+            df = dataset_store.load(df_json_parse['data_path'])
+            return _preview(df, sample_perc), False, df_json, dash.no_update, dash.no_update, True, True
         raise dash.exceptions.PreventUpdate
 
     if not all([path, yaml_cfg, fmt_name]):
@@ -199,6 +314,9 @@ def handle_load(n_clicks, df_json, path, yaml_cfg, fmt_name, store_dur, sample_p
             False,
             dash.no_update,
             dash.no_update,
+            dash.no_update,
+            dash.no_update,
+            dash.no_update,
         )
 
     try:
@@ -213,49 +331,87 @@ def handle_load(n_clicks, df_json, path, yaml_cfg, fmt_name, store_dur, sample_p
             False,
             dash.no_update,
             dash.no_update,
+            dash.no_update,
+            dash.no_update,
+            dash.no_update,
         )
 
-    try:
-        df = maui.io.get_audio_info(
-            path,
-            format_file_path=yaml_cfg,
-            format_name=fmt_name,
-            date_time_func=None,
-            store_duration=store_dur,
-            perc_sample=sample_perc / 100,
-        )
-        os.makedirs(output_dir, exist_ok=True)
-        output_path = os.path.join(output_dir, "original_dataset.parquet")
+    # Só os cabeçalhos, em paralelo e em lotes; arquivos já lidos vêm do manifesto em output_dir
+    job_id = LOAD_JOBS.submit(
+        _run_load_job, None, path, yaml_cfg, fmt_name, store_dur, sample_perc, output_dir
+    )
+    job = {"job_id": job_id, "sample_perc": sample_perc, "output_dir": output_dir}
+    return None, True, dash.no_update, dash.no_update, job, False, False
 
-        # df.to_parquet(output_path)
-        io_utils.save_df_complex_parquet(df, output_path)
 
-    except Exception as e:
+@callback(
+    Output("load-job-progress", "children"),
+    Output("results-container", "children", allow_duplicate=True),
+    Output("load-data-button", "loading", allow_duplicate=True),
+    Output("global-audio-df", "data", allow_duplicate=True),
+    Output("global-output-df-dir", "data", allow_duplicate=True),
+    Output("load-job-interval", "disabled", allow_duplicate=True),
+    Output("load-cancel-btn", "disabled", allow_duplicate=True),
+    Input("load-job-interval", "n_intervals"),
+    State("load-job", "data"),
+    prevent_initial_call=True,
+)
+def poll_load_job(n_intervals, job):
+    status = LOAD_JOBS.status(job["job_id"]) if job else None
+    if status is None:
+        return None, dash.no_update, False, dash.no_update, dash.no_update, True, True
+
+    partial = LOAD_JOBS.partial(job["job_id"])
+    if status["status"] in (jobs.QUEUED, jobs.RUNNING):
         return (
-            dmc.Alert(f"Error loading data: {e}", color="red", title="Loading Error"),
-            False,
-            dash.no_update,
-            dash.no_update,
+            _job_progress(status, partial), _partial_preview(partial), True,
+            dash.no_update, dash.no_update, False, False,
         )
 
-    return_dict = {"original_data_loaded": True, "data_path": output_path}
-    output_dir_dict = {"output_dir": output_dir}
+    if status["status"] == jobs.CANCELLED:
+        alert = dmc.Alert("Loading was cancelled; no dataset was saved.", color="gray", title="Cancelled")
+        return _job_progress(status, partial), alert, False, dash.no_update, dash.no_update, True, True
+
+    if status["status"] == jobs.FAILED:
+        alert = dmc.Alert(f"Error loading data: {status['error']}", color="red", title="Loading Error")
+        return _job_progress(status, partial), alert, False, dash.no_update, dash.no_update, True, True
+
+    result = LOAD_JOBS.result(job["job_id"])
+    df = dataset_store.load(result["data_path"])
+    return_dict = {"original_data_loaded": True, "data_path": result["data_path"], "version": result["version"]}
+    output_dir_dict = {"output_dir": job["output_dir"]}
+    return (
+        _job_progress(status, partial), _preview(df, job["sample_perc"]), False,
+        json.dumps(return_dict), json.dumps(output_dir_dict), True, True,
+    )
+
 
-    return _preview(df, sample_perc), False, json.dumps(return_dict), json.dumps(output_dir_dict)
+@callback(
+    Output("load-cancel-btn", "disabled", allow_duplicate=True),
+    Input("load-cancel-btn", "n_clicks"),
+    State("load-job", "data"),
+    prevent_initial_call=True,
+)
+def cancel_load_job(n_clicks, job):
+    if job:
+        LOAD_JOBS.cancel(job["job_id"])
+    return True
 
 
 @callback(
     Output("combine-date-block", "style"),
     Output("combine-columns-select", "data"),
+    Output("compact-dataset-btn", "disabled"),
     Input("global-audio-df", "data"),
 )
 def toggle_combine_fields(df_json):
     if df_json:
         df_json = json.loads(df_json)
-        df = io_utils.load_df_complex_parquet(df_json['data_path'])
-        options = [{"value": col, "label": col} for col in df.columns]
-        return {"display": "block"}, options
-    return {"display": "none"}, []
+        columns = dataset_store.read_columns(df_json['data_path'])
+        options = [{"value": col, "label": col} for col in columns]
+        has_sidecars = bool(dataset_store.sidecar_columns(df_json['data_path']))
+        return {"display": "block"}, options, not has_sidecars
+    return {"display": "none"}, [], True
 
 
 @callback(
@@ -276,7 +432,8 @@ def create_date_column(n_clicks, cols, sep, fmt, out_name, truncate_level, df_js
         raise dash.exceptions.PreventUpdate
 
     df_json = json.loads(df_json)
-    df = io_utils.load_df_complex_parquet(df_json['data_path'])
+    # Só as colunas combinadas são lidas; a nova coluna é gravada sozinha
+    df = dataset_store.load(df_json['data_path'], columns=cols)
     try:
         combined = df[cols].astype(str).agg(sep.join, axis=1)
         dt_col = pd.to_datetime(combined, format=fmt, errors='coerce')
@@ -295,22 +452,42 @@ def create_date_column(n_clicks, cols, sep, fmt, out_name, truncate_level, df_js
             # Não formata, mantém como datetime completo
             pass
 
-        dt_col = dt_col.dt.to_pydatetime()
-
-        df[out_name] = dt_col
-
-        print(df.dtypes)
-
-        # df.to_parquet(df_json["data_path"])
-        io_utils.save_df_complex_parquet(df, df_json["data_path"])
+        data_version = dataset_store.add_column(df_json["data_path"], out_name, dt_col)
 
     except Exception as e:
         return dash.no_update, dmc.Alert(f"Error creating column: {e}", color="red")
 
+    # Prévia pelo início do arquivo e contagem pelos metadados: o custo não cresce com o dataset
+    df = dataset_store.head(df_json["data_path"], PREVIEW_ROWS)
+    n_rows = dataset_store.num_rows(df_json["data_path"])
 
-    return_dict = {"original_data_loaded": True, "data_path": df_json["data_path"]}
+    return_dict = {"original_data_loaded": True, "data_path": df_json["data_path"], "version": data_version}
 
     return (
         json.dumps(return_dict),
-        _preview(df, sample_perc),
-    )
\ No newline at end of file
+        _preview(df, sample_perc, n_rows),
+    )
+
+
+@callback(
+    Output("global-audio-df", "data", allow_duplicate=True),
+    Output("results-container", "children", allow_duplicate=True),
+    Input("compact-dataset-btn", "n_clicks"),
+    State("global-audio-df", "data"),
+    State("sample-percentage-slider", "value"),
+    prevent_initial_call=True,
+)
+def compact_dataset(n_clicks, df_json, sample_perc):
+    if not (n_clicks and df_json):
+        raise dash.exceptions.PreventUpdate
+
+    df_json = json.loads(df_json)
+    try:
+        data_version = dataset_store.compact(df_json["data_path"])
+    except Exception as e:
+        return dash.no_update, dmc.Alert(f"Error compacting dataset: {e}", color="red")
+
+    df = dataset_store.head(df_json["data_path"], PREVIEW_ROWS)
+    n_rows = dataset_store.num_rows(df_json["data_path"])
+    return_dict = {"original_data_loaded": True, "data_path": df_json["data_path"], "version": data_version}
+    return json.dumps(return_dict), _preview(df, sample_perc, n_rows)
\ No newline at end of file
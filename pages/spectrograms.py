@@ -6,19 +6,23 @@ import pandas as pd
 import numpy as np
 import re
 import json
+import os
 
 import plotly.graph_objects as go
 
 from acoustic_indices.acoustic_indices_calculation import AcousticIndices
 from utils import definitions
 from utils import random_utils
-from utils import io_utils
+from utils import dataset_store
+from utils import audio_cache
 
 
 from maui import acoustic_indices as maui_acoustic_indices
 from maui import visualizations
 from maui import utils as maui_utils
 
+from maad import sound, util
+
 
 
 dash.register_page(__name__, path="/spectrograms", name="Spectrograms")
@@ -80,6 +84,13 @@ layout = dmc.Container([
                                     
                                 ], gap="md"),
 
+                                dmc.Switch(
+                                    id="spectrogram-audio-cache",
+                                    label="Use Decoded Audio Cache",
+                                    description=f"Read the audio from {audio_cache.DEFAULT_CACHE_DIR}, decoding it only the first time",
+                                    checked=True,
+                                ),
+
                                 #dmc.Group([
                                 #    dmc.NumberInput(label="Altura (pixels)", id="spectrogram-height", value=500, min=100, max=2000),
                                 #    dmc.NumberInput(label="Largura (pixels)", id="spectrogram-width", value=1200, min=100, max=4000),
@@ -230,23 +241,17 @@ def populate_column_choices_fcs(df_json_original, df_json_seg, df_json_idx):
         return [], None
 
     df_json_parse = json.loads(df_json)
-    df_json = pd.read_csv(df_json_parse['data_path'])
-    #df_json = io_utils.load_df_complex_parquet(df_json_parse['data_path'])
-
-
+    # Só os nomes das colunas, lidos do rodapé dos arquivos
+    cols = dataset_store.read_columns(df_json_parse['data_path'])
 
+    cols_df_idx = []
     if isinstance(df_json_idx, str):
         try:
             df_json_idx_parse = json.loads(df_json_idx)
-            df_json_idx = pd.read_csv(df_json_idx_parse['data_path'])
-            #df_json_idx = io_utils.load_df_complex_parquet(df_json_idx_parse['data_path'])
+            cols_df_idx = dataset_store.read_columns(df_json_idx_parse['data_path'])
         except Exception as e:
             return [], None
 
-
-
-    cols = list(df_json.columns)
-    cols_df_idx = df_json_idx.columns
     cols_idx = list(set(cols_df_idx) - set(cols))
 
 
@@ -275,8 +280,7 @@ def _show_input_data_table(df_json_original, df_json_seg):
         return dash.no_update
 
     df_json_parse = json.loads(df_json)
-    df = pd.read_csv(df_json_parse['data_path'])
-    #df = io_utils.load_df_complex_parquet(df_json_parse['data_path'])
+    df = dataset_store.load(df_json_parse['data_path'])
 
     return dmc.Stack([
 
@@ -297,6 +301,26 @@ def _show_input_data_table(df_json_original, df_json_seg):
     ])
 
 
+def _spectrogram_plot(file_path, mode, window, nperseg, noverlap, cache=None):
+    """
+    Same figure as ``visualizations.spectrogram_plot``, but the audio comes
+    from the decoded audio cache when given.
+    """
+    s, fs = audio_cache.load(file_path, cache)
+    sxx, tn, fn, _ = sound.spectrogram(s, fs, nperseg=nperseg, noverlap=noverlap, mode=mode, window=window)
+    sxx_disp = util.power2dB(sxx) if mode == "psd" else util.amplitude2dB(sxx)
+
+    fig = go.Figure(
+        data=go.Heatmap(z=sxx_disp, x=tn, y=fn, colorscale="gray", hoverinfo=None)
+    )
+    fig.update_layout(
+        title=f"""Spectrogram generated from the file {os.path.basename(file_path)}""",
+        title_x=0.5,
+        height=500,
+    )
+    return fig
+
+
 @callback(
     Output("results-container-spectrogram", "figure"),
     Output("spectrogram-error-alert", "children"),
@@ -309,9 +333,11 @@ def _show_input_data_table(df_json_original, df_json_seg):
     State("spectrogram-window", "value"),
     State("spectrogram-nperseg", "value"),
     State("spectrogram-noverlap", "value"),
+    State("spectrogram-audio-cache", "checked"),
     prevent_initial_call=True
 )
-def _show_spectrogram(n_clicks_list, file_path_col, df_json_original, df_json_seg, mode, window, nperseg, noverlap):
+def _show_spectrogram(n_clicks_list, file_path_col, df_json_original, df_json_seg, mode, window, nperseg, noverlap,
+                      use_audio_cache):
 
     df_json = df_json_original
     if df_json_seg is not None:
@@ -324,20 +350,19 @@ def _show_spectrogram(n_clicks_list, file_path_col, df_json_original, df_json_se
     idx = trigger["index"]
 
     df_json_parse = json.loads(df_json)
-    df = pd.read_csv(df_json_parse['data_path'])
-    #df = io_utils.load_df_complex_parquet(df_json_parse['data_path'])
+    df = dataset_store.load(df_json_parse['data_path'], columns=[file_path_col])
     file_path = df.iloc[idx][file_path_col]
 
     noverlap = None if noverlap == "" else int(noverlap)
 
     try:
-        fig = visualizations.spectrogram_plot(
+        fig = _spectrogram_plot(
             file_path=file_path,
             mode=mode,
             window=window,
             nperseg=nperseg,
             noverlap=noverlap,
-            show_plot=False
+            cache=audio_cache.AudioCache() if use_audio_cache else None,
         )
         fig.update_layout(
             autosize=True,
@@ -353,6 +378,36 @@ def _show_spectrogram(n_clicks_list, file_path_col, df_json_original, df_json_se
 
 
 
+def _false_color_spectrogram(matrices, order=None):
+    """
+    Builds a false color spectrogram from three per-bin index matrices.
+
+    Each channel is normalized to 0-255 over the whole matrix, as in
+    ``maui.visualizations.false_color_spectrogram_plot``, but from the
+    ``(n_rows, n_bins)`` matrices of ``dataset_store.load_matrices`` instead
+    of a column of per-row arrays.
+
+    Parameters
+    ----------
+    matrices : list of np.ndarray
+        R, G and B matrices, one row per file.
+    order : np.ndarray, optional
+        Row order (chronological) of the spectrogram columns.
+
+    Returns
+    -------
+    np.ndarray
+        ``(n_bins, n_rows, 3)`` uint8 image.
+    """
+    channels = []
+    for matrix in matrices:
+        if order is not None:
+            matrix = matrix[order]
+        lo, hi = np.nanmin(matrix), np.nanmax(matrix)
+        scaled = 255 * (matrix.T - lo) / ((hi - lo) or 1)
+        channels.append(np.nan_to_num(scaled).astype(np.uint8))
+    return np.stack(channels, axis=-1)
+
 def _generate_fcs_fig(
     df: pd.DataFrame,
     fc_spectrogram: np.array,
@@ -476,50 +531,40 @@ def _show_fc_spectrogram(n_clicks, df_json, r_index, g_index, b_index, datetime_
         return dash.no_update, dash.no_update
 
     df_json_parse = json.loads(df_json)
-    df = pd.read_csv(df_json_parse['data_path'])
-    #df = io_utils.load_df_complex_parquet(df_json_parse['data_path'])
-
-
-
-    max_val = df[datetime_col].max().value
-    if max_val > 1e12:
-        # Provavelmente está em microssegundos ou nanosegundos, ajustar conforme necessário
-        timestamp_unit = 'us'  # ou 'ns'
-    elif max_val > 1e10:
-        # Provavelmente está em milissegundos
-        timestamp_unit = 'ms'
-    else:
-        # Provavelmente em segundos
-        timestamp_unit = 's'
-
-    df[datetime_col] = pd.to_datetime(df[datetime_col], unit=timestamp_unit)
+    indices = [r_index, g_index, b_index]
+    # Só a coluna de datas; as matrizes por bin vêm do arquivo mapeado em memória
+    df = dataset_store.load(df_json_parse['data_path'], columns=[datetime_col])
+
+    if not pd.api.types.is_datetime64_any_dtype(df[datetime_col]):
+        max_val = df[datetime_col].max()
+        if max_val > 1e12:
+            # Provavelmente está em microssegundos ou nanosegundos, ajustar conforme necessário
+            timestamp_unit = 'us'  # ou 'ns'
+        elif max_val > 1e10:
+            # Provavelmente está em milissegundos
+            timestamp_unit = 'ms'
+        else:
+            # Provavelmente em segundos
+            timestamp_unit = 's'
+
+        df[datetime_col] = pd.to_datetime(df[datetime_col], unit=timestamp_unit)
 
     print(datetime_col, r_index, g_index, b_index, unit)
 
-    print(df[datetime_col])
-    print(df[r_index])
-    print("df.loc[0, r_index]:",  type(df.loc[0, r_index]))
-    print("df.loc[0, r_index][0]:",  type(df.loc[0, r_index][0]))
-    print(df[g_index])
-    print(type(df.loc[0, g_index]))
-
-    print(df[b_index])
-    print(type(df.loc[0, b_index]))
-
-
     try:
         trunc_unit = "min"
         if unit != "scale_60":
             trunc_unit = "s"
+
+        matrices = dataset_store.load_matrices(df_json_parse['data_path'], indices)
+        order = np.argsort(df[datetime_col].to_numpy(), kind="stable")
+        if np.array_equal(order, np.arange(len(order))):
+            order = None
+        else:
+            df = df.iloc[order].reset_index(drop=True)
         df["timestamp"] = df[datetime_col].dt.floor(trunc_unit)
 
-        fcs = visualizations.false_color_spectrogram_plot(
-            df,
-            datetime_col = datetime_col,
-            indices = [r_index, g_index, b_index],
-            display = False,
-            unit = unit
-        )
+        fcs = _false_color_spectrogram([matrices[index] for index in indices], order)
 
         fig = _generate_fcs_fig(
             df = df,
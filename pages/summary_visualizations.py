@@ -7,6 +7,8 @@ import pandas as pd
 import plotly.graph_objects as go
 from maui import visualizations
 
+from utils import dataset_store
+
 import json
 
 dash.register_page(__name__, path="/summary-visualizations", name="Summary Visualizations")
@@ -163,9 +165,7 @@ def render_param_inputs(viz, df_idx_json):
         )
     try:
         df_idx_json_parse = json.loads(df_idx_json)
-        df = pd.read_csv(df_idx_json_parse['data_path'])
-        #df = pd.read_parquet(df_idx_json_parse['data_path'])
-        columns = list(df.columns)
+        columns = dataset_store.read_columns(df_idx_json_parse['data_path'])
         viz_info = VISUALIZATIONS[viz]
         description = dmc.Alert(
             viz_info["description"],
@@ -203,9 +203,10 @@ def generate_summary_viz(n_clicks, df_idx_json, viz_type, values, ids):
         return go.Figure(), dmc.Alert("Select the type of visualization.", color="orange", title="Attention"), False
     try:
         df_idx_json_parse = json.loads(df_idx_json)
-        df = pd.read_csv(df_idx_json_parse['data_path'])
-        #df = pd.read_parquet(df_idx_json_parse['data_path'])
         params_map = {comp_id['name']: v for comp_id, v in zip(ids, values)}
+        # Only the columns the visualization uses are read
+        columns = dataset_store.used_columns(VISUALIZATIONS[viz_type], params_map, dataset_store.read_columns(df_idx_json_parse['data_path']))
+        df = dataset_store.load(df_idx_json_parse['data_path'], columns=columns)
 
         func = VISUALIZATIONS[viz_type]["func"]
         if viz_type == "Radar Plot":
@@ -0,0 +1,41 @@
+import threading
+
+import numpy as np
+
+from acoustic_indices.cache import ResultCache
+
+
+def _run_in_thread(func):
+    result = {}
+
+    def target():
+        try:
+            result["value"] = func()
+        except Exception as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    if "error" in result:
+        raise result["error"]
+    return result.get("value")
+
+
+def test_cache_is_usable_from_another_thread(tmp_path):
+    audio = tmp_path / "a.wav"
+    audio.write_bytes(b"RIFF")
+    entries = {"ACI": ("fp", ["aci_sum"]), "ADI": ("fp", ["ADI"])}
+    # Constructed (and its connection opened) in this thread
+    cache = ResultCache(str(tmp_path / "cache"), entries)
+
+    _run_in_thread(lambda: cache.store(str(audio), {"aci_sum": np.float64(1.5)}))
+    cached, missing = _run_in_thread(lambda: cache.lookup(str(audio)))
+    assert cached == {"aci_sum": 1.5}
+    assert missing == ["ADI"]
+
+    cache.max_bytes = 1
+    _run_in_thread(cache.evict)
+    cached, missing = cache.lookup(str(audio))
+    assert cached == {}
+    assert missing == ["ACI", "ADI"]
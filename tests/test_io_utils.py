@@ -0,0 +1,53 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from utils import io_utils
+
+
+def _round_trip(df, tmp_path):
+    path = str(tmp_path / "df.parquet")
+    io_utils.save_df_complex_parquet(df, path)
+    return io_utils.load_df_complex_parquet(path), pq.read_schema(path)
+
+
+def test_dicts_with_different_keys_round_trip(tmp_path):
+    df = pd.DataFrame({"params": [{"a": 1}, {"b": 2}]})
+    loaded, schema = _round_trip(df, tmp_path)
+    assert loaded["params"].tolist() == [{"a": 1}, {"b": 2}]
+    assert "params" in json.loads(schema.metadata[b"complex_cols"])
+
+
+def test_dicts_with_same_keys_are_structs(tmp_path):
+    df = pd.DataFrame({"params": [{"a": 1, "b": 0.5}, {"b": np.nan, "a": 2}, np.nan]})
+    loaded, schema = _round_trip(df, tmp_path)
+    assert schema.field("params").type.num_fields == 2
+    first, second, third = loaded["params"]
+    assert first == {"a": 1, "b": 0.5}
+    assert second["a"] == 2 and np.isnan(second["b"])
+    assert np.isnan(third)
+
+
+def test_nan_cells_of_array_columns_round_trip(tmp_path):
+    df = pd.DataFrame({
+        "same_shape": [np.array([1.0, np.nan], dtype=np.float32), np.nan, np.ones(2, dtype=np.float32)],
+        "ragged": [np.arange(3.0), np.nan, np.arange(1.0)],
+    })
+    loaded, _ = _round_trip(df, tmp_path)
+    for col in df.columns:
+        assert np.isnan(loaded[col][1])
+        for i in (0, 2):
+            assert loaded[col][i].dtype == df[col][i].dtype
+            np.testing.assert_array_equal(loaded[col][i], df[col][i])
+
+
+def test_numeric_lists_are_float32(tmp_path):
+    df = pd.DataFrame({"values": [[0.5, np.nan], np.nan, [1, 2, 3]]})
+    loaded, schema = _round_trip(df, tmp_path)
+    assert schema.field("values").type.value_type == "float"
+    first, second, third = loaded["values"]
+    assert first[0] == 0.5 and np.isnan(first[1])
+    assert np.isnan(second)
+    assert third == [1.0, 2.0, 3.0]
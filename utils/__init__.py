@@ -28,5 +28,35 @@ try:
 except ImportError:
     import random_utils
 
+try:
+    from . import audio_cache
+except ImportError:
+    import audio_cache
+
+try:
+    from . import filename_metadata
+except ImportError:
+    import filename_metadata
+
+try:
+    from . import audio_scan
+except ImportError:
+    import audio_scan
+
+try:
+    from . import df_cache
+except ImportError:
+    import df_cache
+
+try:
+    from . import bin_store
+except ImportError:
+    import bin_store
+
+try:
+    from . import dataset_store
+except ImportError:
+    import dataset_store
+
 # Disponibilizar no namespace
-__all__ = ['io_utils', 'definitions', 'random_utils']
+__all__ = ['io_utils', 'definitions', 'random_utils', 'audio_cache', 'filename_metadata', 'audio_scan', 'df_cache', 'bin_store', 'dataset_store']
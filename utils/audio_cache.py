@@ -0,0 +1,128 @@
+"""
+Cache of decoded audio shared by the index runner and the spectrogram page.
+
+Each entry is the output of ``sound.load`` (optionally resampled) stored as an
+``.npy`` file keyed by the identity of the source file (resolved path, size
+and modification time) and the target sampling rate. Entries are read back
+as read-only memory maps, so a file is decoded once and every later reader,
+in any process, gets zero-copy slices of the page cache.
+
+Entries are evicted least recently used first when the cache exceeds
+``max_bytes``; a hit touches the modification time of its entry, which is
+the recency used for eviction.
+"""
+
+import glob
+import hashlib
+import os
+
+import numpy as np
+
+from maad import sound
+
+DEFAULT_CACHE_DIR = "./audio_cache"
+DEFAULT_MAX_BYTES = 10 * 1024**3
+
+# Eviction is checked after this fraction of max_bytes has been written
+_EVICTION_STEP = 0.01
+
+
+class AudioCache(object):
+    """
+    On-disk cache of decoded audio.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        Directory of the cache entries, created if needed.
+    max_bytes : int, optional
+        Size limit of the stored entries.
+    target_fs : int, optional
+        If given, signals are resampled to this rate before being stored.
+    dtype : numpy dtype, optional
+        Storage type. Defaults to the type returned by ``sound.load``
+        (float64), so cached signals are bit-identical to decoded ones.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, target_fs=None, dtype=None):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.target_fs = target_fs
+        self.dtype = dtype
+        self._written = 0
+
+    def _entry_prefix(self, file_path):
+        stat = os.stat(file_path)
+        identity = f"{os.path.realpath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}|{self.target_fs}|{self.dtype}"
+        return os.path.join(self.cache_dir, hashlib.sha1(identity.encode()).hexdigest())
+
+    def load(self, file_path):
+        """
+        Returns ``(s, fs)`` like ``sound.load``, decoding and storing the file
+        on a miss. ``s`` is a read-only memory map.
+        """
+        prefix = self._entry_prefix(file_path)
+        # The sampling rate is part of the entry name: <key>.<fs>.npy
+        for entry in glob.glob(prefix + ".*.npy"):
+            try:
+                s = np.load(entry, mmap_mode="r")
+            except (OSError, ValueError):
+                # Evicted or partially written by another process
+                continue
+            os.utime(entry)
+            return s, int(entry.rsplit(".", 2)[1])
+
+        s, fs = sound.load(file_path)
+        if len(s) == 0:
+            return s, fs
+        if self.target_fs is not None and fs != self.target_fs:
+            s, fs = sound.resample(s, fs, self.target_fs), self.target_fs
+        if self.dtype is not None:
+            s = s.astype(self.dtype)
+
+        entry = f"{prefix}.{int(fs)}.npy"
+        tmp_path = f"{entry}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, s)
+        os.replace(tmp_path, entry)
+        # Mapped before any eviction, which may remove the entry itself
+        s = np.load(entry, mmap_mode="r")
+        self._written += s.nbytes
+        if self._written >= self.max_bytes * _EVICTION_STEP:
+            self.evict()
+        return s, fs
+
+    def evict(self):
+        """Deletes the least recently used entries until the cache fits ``max_bytes``."""
+        self._written = 0
+        entries = []
+        for entry in glob.glob(os.path.join(self.cache_dir, "*.npy")):
+            try:
+                stat = os.stat(entry)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+        excess = sum(size for _, size, _ in entries) - self.max_bytes
+        for _, size, entry in sorted(entries):
+            if excess <= 0:
+                break
+            try:
+                os.remove(entry)
+            except OSError:
+                # Still mapped by a reader on Windows; evicted next time
+                continue
+            excess -= size
+
+    def clear(self):
+        for entry in glob.glob(os.path.join(self.cache_dir, "*.npy")):
+            try:
+                os.remove(entry)
+            except OSError:
+                continue
+
+
+def load(file_path, cache=None):
+    """``cache.load(file_path)``, or ``sound.load(file_path)`` when ``cache`` is None."""
+    if cache is None:
+        return sound.load(file_path)
+    return cache.load(file_path)
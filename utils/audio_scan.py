@@ -0,0 +1,238 @@
+"""
+Varredura de um diretório de áudio, equivalente a
+``maui.io.get_audio_info(..., store_duration=True)``, mas lendo só o
+cabeçalho de cada arquivo, em paralelo.
+
+A duração vem do cabeçalho RIFF/WAVE (número de frames e taxa de
+amostragem); só os arquivos cujo cabeçalho não pode ser lido são abertos com
+``audioread``, como no maui. O resultado de cada arquivo é guardado em um
+manifesto (``MANIFEST_NAME``, no diretório de saída) pela chave
+(caminho, tamanho, mtime): uma nova carga só lê os arquivos novos ou
+alterados.
+
+``iter_audio_info`` faz a mesma varredura em lotes, à medida que os arquivos
+são listados: o primeiro lote (e um erro no formato dos nomes) chega em
+segundos, mesmo em diretórios muito grandes.
+
+Os metadados dos nomes são extraídos por lote, com o formato compilado uma
+vez (ver ``filename_metadata``), e já vêm tipados.
+"""
+
+import glob
+import itertools
+import os
+import random
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+try:
+    from . import filename_metadata
+except ImportError:
+    import filename_metadata
+
+MANIFEST_NAME = "audio_manifest.parquet"
+# Varredura limitada pela latência de E/S (sistemas de arquivos de rede), não pela CPU
+DEFAULT_SCAN_THREADS = 32
+# Arquivos por lote de iter_audio_info
+DEFAULT_BATCH_SIZE = 500
+
+
+def wav_header(path):
+    """
+    Reads the format of a RIFF/WAVE file from its header only.
+
+    Returns
+    -------
+    dict or None
+        ``fs``, ``channels``, ``bits`` and ``n_frames``, or None if the file
+        cannot be read as WAV.
+    """
+    try:
+        with open(path, "rb") as f:
+            riff, _, wave = struct.unpack("<4sI4s", f.read(12))
+            if riff not in (b"RIFF", b"RF64") or wave != b"WAVE":
+                return None
+            header = None
+            while True:
+                chunk = f.read(8)
+                if len(chunk) < 8:
+                    return None
+                chunk_id, size = struct.unpack("<4sI", chunk)
+                if chunk_id == b"fmt ":
+                    fmt = f.read(size)
+                    _, channels, fs, _, block_align, bits = struct.unpack("<HHIIHH", fmt[:16])
+                    header = {"fs": fs, "channels": channels, "bits": bits, "block_align": block_align}
+                    f.seek(size % 2, os.SEEK_CUR)
+                elif chunk_id == b"data":
+                    if header is None:
+                        return None
+                    if size == 0xFFFFFFFF:
+                        # RF64: the real size is in the ds64 chunk; use the file size
+                        size = os.path.getsize(path) - f.tell()
+                    header["n_frames"] = size // max(header.pop("block_align"), 1)
+                    return header
+                else:
+                    f.seek(size + size % 2, os.SEEK_CUR)
+    except (OSError, struct.error):
+        return None
+
+
+def audio_duration(path):
+    """Duração em segundos de um arquivo de áudio, pelo cabeçalho quando possível."""
+    header = wav_header(path)
+    if header is not None and header["fs"] > 0:
+        return header["n_frames"] / header["fs"]
+    import audioread
+    with audioread.audio_open(path) as x:
+        return x.duration
+
+
+def load_manifest(output_dir):
+    """Retorna ``{caminho: (tamanho, mtime_ns, duração)}`` do manifesto de ``output_dir``."""
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    df = pd.read_parquet(path)
+    return {
+        p: (int(size), int(mtime), float(duration))
+        for p, size, mtime, duration in zip(df["file_path"], df["size"], df["mtime_ns"], df["duration"])
+    }
+
+
+def save_manifest(output_dir, manifest):
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    paths = list(manifest)
+    df = pd.DataFrame({
+        "file_path": paths,
+        "size": np.array([manifest[p][0] for p in paths], dtype=np.int64),
+        "mtime_ns": np.array([manifest[p][1] for p in paths], dtype=np.int64),
+        "duration": np.array([manifest[p][2] for p in paths], dtype=float),
+    })
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def probe_durations(paths, manifest=None, max_workers=DEFAULT_SCAN_THREADS, executor=None):
+    """
+    Durações dos arquivos ``paths``, lidas do ``manifest`` quando o arquivo
+    não mudou e do cabeçalho caso contrário. ``manifest`` é atualizado com
+    os arquivos lidos. ``executor`` reaproveita um pool de threads entre
+    chamadas; sem ele, um pool de ``max_workers`` threads é criado.
+
+    Returns
+    -------
+    durations : list of float
+    n_probed : int
+        Número de arquivos cujo cabeçalho foi lido.
+    """
+    manifest = {} if manifest is None else manifest
+
+    def probe(path):
+        stat = os.stat(path)
+        cached = manifest.get(path)
+        if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            return cached, False
+        return (stat.st_size, stat.st_mtime_ns, audio_duration(path)), True
+
+    if executor is None:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(probe, paths))
+    else:
+        results = list(executor.map(probe, paths))
+    n_probed = 0
+    for path, (entry, probed) in zip(paths, results):
+        manifest[path] = entry
+        n_probed += probed
+    return [entry[2] for entry, _ in results], n_probed
+
+
+def _list_audio_files(audio_path, perc_sample):
+    if os.path.isfile(audio_path):
+        return iter([audio_path])
+    if os.path.isdir(audio_path):
+        # iglob: os arquivos são entregues à medida que o diretório é lido
+        paths = glob.iglob(os.path.join(audio_path, "*.wav"))
+        return (p for p in paths if random.uniform(0, 1) < perc_sample)
+    raise Exception("The input must be a file or a directory")
+
+
+def iter_audio_info(audio_path, format_name, format_file_path=None, date_time_func=None,
+                    store_duration=True, perc_sample=1, output_dir=None, max_workers=DEFAULT_SCAN_THREADS,
+                    batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Varredura de ``get_audio_info`` em lotes: produz um DataFrame de até
+    ``batch_size`` arquivos por vez, com as mesmas colunas, à medida que o
+    diretório é listado. Um nome fora do formato levanta ``ValueError`` no
+    lote em que aparece.
+
+    O manifesto é gravado ao final, ou quando o gerador é fechado antes do
+    fim (ex.: carga cancelada), com os arquivos lidos até então.
+    """
+    file_format = filename_metadata.FileNameFormat(format_name, format_file_path, date_time_func)
+    paths_iter = _list_audio_files(audio_path, perc_sample)
+    manifest = load_manifest(output_dir) if store_duration and output_dir else {}
+    n_probed = 0
+    executor = ThreadPoolExecutor(max_workers=max_workers) if store_duration else None
+    try:
+        while True:
+            paths = list(itertools.islice(paths_iter, batch_size))
+            if not paths:
+                return
+
+            names = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+            df = file_format.parse(names)
+            unmatched = file_format.unmatched(df)
+            if unmatched.any():
+                path = paths[int(np.flatnonzero(unmatched.to_numpy())[0])]
+                raise ValueError(f"{path} does not match the file name format {format_name}")
+
+            if store_duration:
+                durations, probed = probe_durations(paths, manifest, executor=executor)
+                n_probed += probed
+                df["duration"] = np.asarray(durations, dtype=float)
+
+            df["file_path"] = pd.Series(paths, dtype="str")
+            yield df
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if output_dir and n_probed:
+            save_manifest(output_dir, manifest)
+
+
+def get_audio_info(audio_path, format_name, format_file_path=None, date_time_func=None,
+                   store_duration=True, perc_sample=1, output_dir=None, max_workers=DEFAULT_SCAN_THREADS):
+    """
+    Mesmas linhas e colunas de ``maui.io.get_audio_info`` (metadados do nome
+    do arquivo, ``duration`` e ``file_path``), com as durações lidas dos
+    cabeçalhos em paralelo e guardadas no manifesto de ``output_dir``, e os
+    metadados tipados (ver ``filename_metadata``).
+
+    Parameters
+    ----------
+    audio_path : str
+        Arquivo de áudio ou diretório com arquivos ``.wav``.
+    format_name : str
+        Formato do nome dos arquivos (ver ``maui.files_metadata``).
+    format_file_path : str, optional
+        YAML com os formatos; o do maui por padrão.
+    date_time_func : callable, optional
+        Função aplicada aos metadados de cada arquivo.
+    store_duration : bool, optional
+        Se True, inclui a duração de cada arquivo.
+    perc_sample : float, optional
+        Fração dos arquivos do diretório a carregar (amostra aleatória).
+    output_dir : str, optional
+        Diretório do manifesto. Sem ele, todos os cabeçalhos são lidos.
+    max_workers : int, optional
+        Threads de leitura dos cabeçalhos.
+    """
+    return filename_metadata.concat(iter_audio_info(
+        audio_path, format_name, format_file_path, date_time_func,
+        store_duration, perc_sample, output_dir, max_workers,
+    ))
@@ -0,0 +1,122 @@
+"""
+Matrizes por bin de frequência (``aci_per_bin``, ``Ht_per_bin``,
+``EVNspFract_per_bin``, ...) de um dataset de índices, em um arquivo Arrow
+IPC (Feather v2) lido por memory map.
+
+Cada coluna por bin vira uma ``fixed_size_list<float32>`` sobre um único
+buffer, e cada matriz volta como uma view numpy ``(n_linhas, n_bins)`` desse
+buffer, sem cópia e sem conversão por célula. As linhas seguem a ordem de
+``dataset_store.load`` (posição no DataFrame original); a coluna
+``DATASET_ROW_COL`` guarda essa posição. Células sem array (arquivos que
+falharam) viram linhas de NaN.
+
+O arquivo fica ao lado do dataset e guarda a versão do dataset de que foi
+gerado (``df_cache.version``); se o dataset mudou, é gerado de novo na
+próxima leitura.
+"""
+
+import os
+
+import numpy as np
+import pyarrow as pa
+
+try:
+    from . import df_cache, io_utils
+except ImportError:
+    import df_cache
+    import io_utils
+
+BINS_NAME = "per_bin.arrow"
+
+
+def store_path(data_path: str) -> str:
+    """Caminho do arquivo de matrizes de um dataset (diretório ou arquivo)."""
+    if os.path.isdir(data_path):
+        return os.path.join(data_path, BINS_NAME)
+    return os.path.splitext(data_path)[0] + "." + BINS_NAME
+
+
+def per_bin_columns(data_path: str) -> list:
+    """Colunas de arrays 1-D de um dataset de índices, lidas do schema."""
+    columns = []
+    for field in io_utils.read_schema(data_path):
+        if pa.types.is_fixed_size_list(field.type) or pa.types.is_list(field.type):
+            if not pa.types.is_list(field.type.value_type) and not pa.types.is_fixed_size_list(field.type.value_type):
+                columns.append(field.name)
+    return columns
+
+
+def stack_rows(values, dtype=np.float32) -> np.ndarray:
+    """Empilha arrays 1-D (um por linha) em uma matriz, com NaN nas linhas sem array."""
+    values = list(values)
+    arrays = [v for v in values if isinstance(v, np.ndarray)]
+    n_bins = max((len(a) for a in arrays), default=1)
+    matrix = np.full((len(values), n_bins), np.nan, dtype=dtype)
+    for i, v in enumerate(values):
+        if isinstance(v, np.ndarray):
+            matrix[i, :len(v)] = v
+    return matrix
+
+
+def write(data_path: str, columns=None) -> str:
+    """
+    Gera o arquivo de matrizes das ``columns`` por bin (todas por padrão) de
+    um dataset de índices e retorna seu caminho.
+    """
+    token = df_cache.version(data_path)
+    if columns is None:
+        columns = per_bin_columns(data_path)
+    df = io_utils.load_df_indices_parquet(data_path, columns=columns)
+
+    arrays = {}
+    for col in columns:
+        matrix = stack_rows(df[col])
+        arrays[col] = pa.FixedSizeListArray.from_arrays(pa.array(matrix.ravel()), max(matrix.shape[1], 1))
+    rows = np.arange(len(df))
+    if os.path.isdir(data_path):
+        parts_rows = io_utils.read_parts_rows(data_path)
+        if parts_rows:
+            rows = np.sort(np.concatenate(list(parts_rows.values())))
+    arrays[io_utils.DATASET_ROW_COL] = pa.array(rows.astype(np.int64))
+
+    table = pa.table(arrays, metadata={b"version": str(token).encode()})
+    path = store_path(data_path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            # Um único record batch: cada coluna é um buffer contínuo
+            writer.write_table(table, max_chunksize=max(len(df), 1))
+    os.replace(tmp_path, path)
+    return path
+
+
+def load(data_path: str, columns) -> dict:
+    """
+    Retorna ``{coluna: matriz (n_linhas, n_bins)}`` das colunas por bin de um
+    dataset de índices, como views somente leitura do arquivo mapeado em
+    memória. O arquivo é gerado (ou atualizado) se necessário.
+    """
+    available = per_bin_columns(data_path)
+    missing = [col for col in columns if col not in available]
+    if missing:
+        raise ValueError(f"Not per-bin index columns: {', '.join(missing)}")
+
+    path = store_path(data_path)
+    token = df_cache.version(data_path)
+    table = None
+    if os.path.exists(path):
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        stale = (table.schema.metadata or {}).get(b"version") != str(token).encode()
+        if stale or any(col not in table.column_names for col in columns):
+            table = None
+    if table is None:
+        write(data_path, available)
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+
+    matrices = {}
+    for col in columns:
+        column = table.column(col)
+        arr = column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+        n_bins = arr.type.list_size
+        matrices[col] = arr.flatten().to_numpy(zero_copy_only=True).reshape(len(arr), n_bins)
+    return matrices
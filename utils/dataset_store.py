@@ -0,0 +1,260 @@
+"""
+Leitura e escrita dos três artefatos de uma análise, usadas por todas as
+páginas e pela CLI:
+
+- ``original_dataset.parquet``: arquivos de áudio carregados (``ORIGINAL``);
+- ``segmented_dataset.parquet``: segmentos gerados (``SEGMENTED``);
+- ``acoustic_indices_dataset/``: índices, em Parquet particionado escrito
+  pelo runner (``INDICES``).
+
+Todos são Parquet com tipos definidos: as colunas conhecidas de cada artefato
+(``SCHEMAS``) são gravadas com o tipo Arrow do schema, então datas e durações
+nunca voltam como texto, e as colunas de arrays ficam como listas Arrow
+(ver ``io_utils``). As leituras passam pelo ``df_cache``.
+
+Colunas derivadas (ex.: a data criada na página de carregamento) são
+gravadas sozinhas, em sidecars ao lado do artefato, e juntadas na leitura;
+adicionar uma coluna custa só a escrita dela. ``compact`` as incorpora ao
+arquivo.
+"""
+
+import glob
+import os
+import shutil
+from urllib.parse import quote, unquote
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    from . import bin_store, df_cache, io_utils
+except ImportError:
+    import bin_store
+    import df_cache
+    import io_utils
+
+ORIGINAL = "original"
+SEGMENTED = "segmented"
+INDICES = "indices"
+
+FILE_NAMES = {
+    ORIGINAL: "original_dataset.parquet",
+    SEGMENTED: "segmented_dataset.parquet",
+    INDICES: "acoustic_indices_dataset",
+}
+
+# Colunas derivadas de <artefato>.parquet ficam em <artefato>.columns/<coluna>.parquet
+SIDECAR_SUFFIX = ".columns"
+
+# Tipos das colunas conhecidas de cada artefato; as demais seguem o DataFrame
+_TIMESTAMP = pa.timestamp("us")
+SCHEMAS = {
+    ORIGINAL: {
+        "file_path": pa.string(),
+        "timestamp_init": _TIMESTAMP,
+        "dt": _TIMESTAMP,
+        "duration": pa.float64(),
+    },
+    SEGMENTED: {
+        "file_path": pa.string(),
+        "segment_file_path": pa.string(),
+        "timestamp_init": _TIMESTAMP,
+        "start_time": _TIMESTAMP,
+        "end_time": _TIMESTAMP,
+        "dt": _TIMESTAMP,
+        "duration": pa.float64(),
+    },
+}
+
+
+def path(output_dir: str, artifact: str) -> str:
+    """Caminho de um artefato dentro do diretório de saída."""
+    return os.path.join(output_dir, FILE_NAMES[artifact])
+
+
+def conform(df: pd.DataFrame, artifact: str) -> pd.DataFrame:
+    """
+    Converte as colunas conhecidas de ``df`` para os tipos do schema do
+    artefato (ex.: datas lidas como texto viram timestamps).
+    """
+    converted = {}
+    for col, arrow_type in SCHEMAS.get(artifact, {}).items():
+        if col not in df.columns:
+            continue
+        if pa.types.is_timestamp(arrow_type):
+            if not pd.api.types.is_datetime64_any_dtype(df[col]):
+                converted[col] = pd.to_datetime(df[col], errors="coerce")
+        elif pa.types.is_floating(arrow_type):
+            if not pd.api.types.is_float_dtype(df[col]):
+                converted[col] = pd.to_numeric(df[col], errors="coerce").astype(float)
+        elif pa.types.is_string(arrow_type):
+            if not pd.api.types.is_string_dtype(df[col]):
+                converted[col] = df[col].astype(str)
+    return df.assign(**converted) if converted else df
+
+
+def artifact_of(data_path: str):
+    """Artefato (``ORIGINAL``, ``SEGMENTED`` ou ``INDICES``) de um caminho, pelo nome do arquivo."""
+    name = os.path.basename(os.path.normpath(data_path))
+    for artifact in (INDICES, SEGMENTED, ORIGINAL):
+        if name.startswith(os.path.splitext(FILE_NAMES[artifact])[0]):
+            return artifact
+    return None
+
+
+def sidecar_dir(data_path: str) -> str:
+    """Diretório das colunas derivadas (sidecars) de um artefato."""
+    return os.path.splitext(os.path.normpath(data_path))[0] + SIDECAR_SUFFIX
+
+
+def _sidecar_path(data_path: str, column: str) -> str:
+    return os.path.join(sidecar_dir(data_path), quote(str(column), safe="") + ".parquet")
+
+
+def sidecar_columns(data_path: str) -> dict:
+    """``{coluna: caminho}`` das colunas derivadas de um artefato, na ordem em que foram criadas."""
+    paths = glob.glob(os.path.join(sidecar_dir(data_path), "*.parquet"))
+    paths.sort(key=os.path.getmtime)
+    return {unquote(os.path.basename(p)[:-len(".parquet")]): p for p in paths}
+
+
+def num_rows(data_path: str) -> int:
+    """Número de linhas de um artefato, lido dos metadados, sem carregar os dados."""
+    if data_path.endswith(".csv"):
+        return len(pd.read_csv(data_path, usecols=[0]))
+    if os.path.isdir(data_path):
+        return sum(len(rows) for rows in io_utils.read_parts_rows(data_path).values())
+    return pq.read_metadata(data_path).num_rows
+
+
+def save(df: pd.DataFrame, data_path: str, artifact: str) -> str:
+    """
+    Grava o DataFrame de um artefato (``ORIGINAL`` ou ``SEGMENTED``) e
+    retorna a nova versão do arquivo, para ser gravada no store. As colunas
+    derivadas passam a fazer parte do arquivo (ver ``add_column``).
+    """
+    if artifact == INDICES:
+        raise ValueError("The indices dataset is written by acoustic_indices.runner")
+    df_cache.save_df_complex_parquet(conform(df, artifact), data_path)
+    shutil.rmtree(sidecar_dir(data_path), ignore_errors=True)
+    return version(data_path)
+
+
+def add_column(data_path: str, column: str, values) -> str:
+    """
+    Adiciona (ou substitui) uma coluna derivada de um artefato sem reescrevê-lo:
+    a coluna é gravada sozinha em um sidecar, alinhado às linhas do arquivo
+    pela posição, e juntada na leitura por ``load``. ``compact`` a incorpora
+    ao arquivo. Retorna a nova versão do artefato.
+    """
+    values = pd.Series(values)
+    n_rows = num_rows(data_path)
+    if len(values) != n_rows:
+        raise ValueError(f"Column '{column}' has {len(values)} rows; {data_path} has {n_rows}")
+    df = conform(pd.DataFrame({column: values.to_numpy()}), artifact_of(data_path))
+    os.makedirs(sidecar_dir(data_path), exist_ok=True)
+    path = _sidecar_path(data_path, column)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    io_utils.save_df_complex_parquet(df, tmp_path)
+    os.replace(tmp_path, path)
+    return version(data_path)
+
+
+def compact(data_path: str) -> str:
+    """
+    Reescreve um artefato com suas colunas derivadas e remove os sidecars.
+    Retorna a nova versão do artefato.
+    """
+    if not sidecar_columns(data_path):
+        return version(data_path)
+    return save(load(data_path), data_path, artifact_of(data_path))
+
+
+def _load_base(data_path: str, columns=None) -> pd.DataFrame:
+    if os.path.isdir(data_path) or (artifact_of(data_path) == INDICES and not data_path.endswith(".csv")):
+        return df_cache.load_df_indices_parquet(data_path, columns=columns)
+    if data_path.endswith(".csv"):
+        df = pd.read_csv(data_path, usecols=columns)
+        return conform(df, artifact_of(data_path)) if artifact_of(data_path) else df
+    return df_cache.load_df_complex_parquet(data_path, columns=columns)
+
+
+def load(data_path: str, columns=None) -> pd.DataFrame:
+    """
+    Carrega um artefato pelo caminho guardado no store, com as colunas
+    ``columns`` (todas por padrão), incluindo as colunas derivadas.
+
+    Diretórios são datasets de índices. Arquivos CSV de versões antigas são
+    lidos e convertidos para os tipos do schema.
+    """
+    sidecars = sidecar_columns(data_path)
+    if columns is not None:
+        sidecars = {col: p for col, p in sidecars.items() if col in columns}
+        base_columns = [col for col in columns if col not in sidecars]
+        df = _load_base(data_path, columns=base_columns)
+    else:
+        df = _load_base(data_path)
+        if sidecars:
+            # Colunas substituídas por sidecars não são lidas do arquivo
+            df = df.drop(columns=[col for col in sidecars if col in df.columns])
+    for col, path in sidecars.items():
+        df[col] = df_cache.load_df_complex_parquet(path)[col].set_axis(df.index)
+    if columns is not None:
+        df = df[[col for col in columns if col in df.columns]]
+    return df
+
+
+def head(data_path: str, n: int = 10) -> pd.DataFrame:
+    """
+    As primeiras ``n`` linhas de um artefato, com as colunas derivadas, lendo
+    só o início dos arquivos (para prévias).
+    """
+    if os.path.isdir(data_path) or data_path.endswith(".csv") or artifact_of(data_path) == INDICES:
+        return load(data_path).head(n)
+    sidecars = sidecar_columns(data_path)
+    df = io_utils.head_df_complex_parquet(data_path, n)
+    df = df.drop(columns=[col for col in sidecars if col in df.columns])
+    for col, path in sidecars.items():
+        df[col] = io_utils.head_df_complex_parquet(path, n)[col].set_axis(df.index)
+    return df
+
+
+def load_matrices(data_path: str, columns) -> dict:
+    """
+    Matrizes ``(n_linhas, n_bins)`` das colunas por bin de um dataset de
+    índices, como views do arquivo mapeado em memória (ver ``bin_store``).
+    As linhas seguem a ordem de ``load``.
+    """
+    return bin_store.load(data_path, columns)
+
+
+def read_columns(data_path: str) -> list:
+    """Nomes das colunas de um artefato, com as derivadas, sem carregar os dados."""
+    columns = io_utils.read_columns(data_path)
+    return columns + [col for col in sidecar_columns(data_path) if col not in columns]
+
+
+def used_columns(viz_info: dict, params_map: dict, columns) -> list:
+    """
+    Colunas de ``columns`` lidas por uma visualização das páginas (entrada
+    de ``VISUALIZACOES``/``VISUALIZATIONS``) com os parâmetros escolhidos:
+    as fixas (``"columns"``) e as dos parâmetros de coluna, na ordem do
+    dataset.
+    """
+    used = set(viz_info.get("columns", []))
+    for param in viz_info["params"]:
+        value = params_map.get(param["name"]) or param.get("default")
+        if param["type"] == "column" and value:
+            used.add(value)
+        elif param["type"] == "multi_column" and value:
+            used.update(value)
+    return [col for col in columns if col in used]
+
+
+def version(data_path: str) -> str:
+    """Versão atual de um artefato e de suas colunas derivadas (ver ``df_cache.version``)."""
+    token = df_cache.version(data_path)
+    for path in sidecar_columns(data_path).values():
+        token = f"{token}+{df_cache.version(path)}"
+    return token
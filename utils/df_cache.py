@@ -0,0 +1,176 @@
+"""
+Cache, compartilhado pelo processo, dos DataFrames apontados pelos stores
+globais (``global-audio-df``, ``global-audio-df-seg``, ``global-audio-df-idx``).
+
+Os stores guardam só o ``data_path``; sem o cache, cada callback de cada
+página relia e reconvertia o arquivo. Cada entrada é validada pela versão do
+arquivo (mtime e tamanho, ou os das partes de um dataset particionado), então
+uma escrita feita por qualquer caminho invalida a entrada. As entradas são
+descartadas da menos usada para a mais usada quando o total passa de
+``max_bytes``.
+
+Alterar as colunas ou os valores de um DataFrame retornado não altera o
+cache. Com o copy-on-write do pandas (sempre ativo a partir do pandas 3;
+opção ``mode.copy_on_write`` no pandas 2) a cópia retornada é rasa; sem ele,
+é uma cópia completa. Os objetos guardados em células (numpy arrays, listas,
+dicts) são compartilhados com o cache em qualquer caso: os numpy arrays são
+marcados como somente leitura, e listas e dicts não devem ser alterados no
+lugar.
+"""
+
+import glob
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+try:
+    from . import io_utils
+except ImportError:
+    import io_utils
+
+DEFAULT_MAX_BYTES = 2 * 1024**3
+_PANDAS_3 = int(pd.__version__.split(".")[0]) >= 3
+
+
+def _copy(df: pd.DataFrame) -> pd.DataFrame:
+    """Cópia de uma entrada que pode ser alterada sem afetar o cache."""
+    if _PANDAS_3 or pd.options.mode.copy_on_write is True:
+        return df.copy(deep=False)
+    return df.copy(deep=True)
+
+
+def _freeze_arrays(df: pd.DataFrame):
+    """Marca como somente leitura os numpy arrays guardados em células, compartilhados pelas cópias."""
+    for col in df.columns:
+        if df[col].dtype == object:
+            for v in df[col]:
+                if isinstance(v, np.ndarray):
+                    v.setflags(write=False)
+
+
+def version(path: str) -> str:
+    """
+    Retorna um token que muda a cada escrita de ``path`` (arquivo ou dataset
+    particionado), ou None se o caminho não existe.
+    """
+    if os.path.isdir(path):
+        parts = sorted(glob.glob(os.path.join(path, io_utils.DATASET_PART_PATTERN)))
+        stats = [os.stat(p) for p in parts]
+        return f"{len(parts)}-{max((s.st_mtime_ns for s in stats), default=0)}-{sum(s.st_size for s in stats)}"
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+
+def frame_nbytes(df: pd.DataFrame) -> int:
+    """Memória aproximada de um DataFrame, incluindo arrays guardados em células."""
+    nbytes = int(df.memory_usage(index=True, deep=False).sum())
+    for col in df.columns:
+        if df[col].dtype == object:
+            nbytes += sum(v.nbytes if isinstance(v, np.ndarray) else 64 for v in df[col])
+    return nbytes
+
+
+class DataFrameCache(object):
+    """
+    Cache LRU de DataFrames carregados de disco.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        Limite de memória das entradas.
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, path, loader, columns=None):
+        """
+        Retorna ``loader(path, columns=columns)``, da memória se o arquivo não
+        mudou desde a última leitura.
+
+        Uma projeção é servida pela entrada completa, se ela estiver no cache.
+        """
+        key_path = os.path.realpath(path)
+        token = version(path)
+        projection = None if columns is None else tuple(columns)
+
+        with self._lock:
+            for key in ((key_path, loader, None), (key_path, loader, projection)):
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if entry[0] != token:
+                    self._drop(key)
+                    continue
+                self._entries.move_to_end(key)
+                df = entry[1]
+                if key[2] is None and projection is not None:
+                    df = df[[col for col in projection if col in df.columns]]
+                return _copy(df)
+
+        # Lido fora do lock: outras leituras não esperam por este arquivo
+        df = loader(path, columns=columns)
+        _freeze_arrays(df)
+        nbytes = frame_nbytes(df)
+        with self._lock:
+            key = (key_path, loader, projection)
+            self._drop(key)
+            if nbytes <= self.max_bytes:
+                self._entries[key] = (token, df, nbytes)
+                self._nbytes += nbytes
+                self._evict()
+        return _copy(df)
+
+    def invalidate(self, path):
+        """Descarta as entradas de ``path``."""
+        key_path = os.path.realpath(path)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == key_path]:
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._nbytes -= entry[2]
+
+    def _evict(self):
+        while self._nbytes > self.max_bytes and self._entries:
+            _, (_, _, nbytes) = self._entries.popitem(last=False)
+            self._nbytes -= nbytes
+
+
+# Cache do processo do servidor Dash
+CACHE = DataFrameCache()
+
+
+def load_df_complex_parquet(path: str, columns=None) -> pd.DataFrame:
+    """``io_utils.load_df_complex_parquet`` servido pelo cache."""
+    return CACHE.get(path, io_utils.load_df_complex_parquet, columns)
+
+
+def load_df_indices_parquet(path: str, columns=None) -> pd.DataFrame:
+    """``io_utils.load_df_indices_parquet`` servido pelo cache."""
+    return CACHE.get(path, io_utils.load_df_indices_parquet, columns)
+
+
+def save_df_complex_parquet(df: pd.DataFrame, path: str) -> str:
+    """
+    ``io_utils.save_df_complex_parquet`` seguido da invalidação de ``path``.
+    Retorna a nova versão do arquivo, para ser gravada no store.
+    """
+    io_utils.save_df_complex_parquet(df, path)
+    CACHE.invalidate(path)
+    return version(path)
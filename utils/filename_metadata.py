@@ -0,0 +1,109 @@
+"""
+Metadados dos nomes de arquivo, pelos formatos do YAML do maui
+(``maui.files_metadata``), extraídos de uma coluna inteira de nomes de uma
+vez.
+
+O maui lê o YAML, monta e compila a expressão regular a cada arquivo, e
+devolve todos os campos como texto. Aqui o formato é lido e compilado uma
+vez (``FileNameFormat``) e aplicado à série de nomes com ``str.extract``
+(Arrow, com o dtype ``str`` do pandas). Os campos recebem o tipo declarado
+no YAML:
+
+- ``String``: categórico (poucos valores distintos: sítios, gravadores,
+  ambientes);
+- ``Integer``: inteiro;
+- demais tipos (``Date``, ``Time``, ...): categórico do texto, como no maui,
+  para que possam ser combinados na página de carregamento.
+
+A data/hora de início (``timestamp_init``) do ``LEEC_FILE_FORMAT`` vira uma
+coluna datetime, como no maui.
+"""
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+LEEC_FILE_FORMAT = "LEEC_FILE_FORMAT"
+
+
+class FileNameFormat(object):
+    """
+    Formato de nome de arquivo do YAML, compilado uma vez.
+
+    Parameters
+    ----------
+    format_name : str
+        Nome do formato no YAML.
+    format_file_path : str, optional
+        YAML com os formatos; o do maui por padrão.
+    date_time_func : callable, optional
+        Função aplicada aos metadados de cada arquivo (dict -> dict), como em
+        ``maui.files_metadata.extract_metadata``. Ignorada no
+        ``LEEC_FILE_FORMAT``.
+    """
+    def __init__(self, format_name, format_file_path=None, date_time_func=None):
+        from maui.files_metadata import get_format_config
+
+        config = get_format_config(format_name, format_file_path)
+        self.format_name = format_name
+        self.date_time_func = date_time_func
+        self.tags = config["metadata_tag_info"]
+
+        # Mesma substituição do maui; (?:...) limita a âncora ao início do nome, como re.match
+        pattern = config["file_name_format"]
+        for key, tag_info in self.tags.items():
+            pattern = pattern.replace(key, tag_info["format"])
+        self.pattern = f"^(?:{pattern})"
+
+    def parse(self, names) -> pd.DataFrame:
+        """
+        Metadados de cada nome (sem extensão) de ``names``, uma linha por
+        nome, com as colunas dos campos do formato. Nomes fora do formato
+        ficam com NaN (ver ``unmatched``).
+        """
+        names = pd.Series(names, dtype="str").reset_index(drop=True)
+        groups = names.str.extract(self.pattern, expand=True)
+        # dict(zip(...)) no maui: campos ou grupos a mais são descartados
+        keys = list(self.tags)[:groups.shape[1]]
+        df = groups.iloc[:, :len(keys)].set_axis(keys, axis=1)
+
+        if self.format_name == LEEC_FILE_FORMAT:
+            df["timestamp_init"] = pd.to_datetime(
+                df["date"] + " " + df["time"], format="%Y%m%d %H%M%S", errors="coerce"
+            ).astype("datetime64[us]")
+        elif self.date_time_func is not None:
+            records = [
+                self.date_time_func(values) if matched else values
+                for values, matched in zip(df.to_dict("records"), df.notna().all(axis=1))
+            ]
+            df = pd.DataFrame.from_records(records, index=df.index)
+
+        for key in keys:
+            if key in df.columns and pd.api.types.is_string_dtype(df[key]):
+                df[key] = self._cast(df[key], self.tags[key].get("type"))
+        return df
+
+    def unmatched(self, metadata: pd.DataFrame) -> pd.Series:
+        """Máscara das linhas de ``parse`` cujo nome não segue o formato."""
+        keys = [key for key in self.tags if key in metadata.columns]
+        return metadata[keys].isna().any(axis=1)
+
+    @staticmethod
+    def _cast(col, tag_type):
+        if tag_type == "Integer" and col.notna().all():
+            return pd.to_numeric(col).astype("int64")
+        return col.astype("category")
+
+
+def concat(frames) -> pd.DataFrame:
+    """
+    ``pd.concat`` de lotes de ``parse`` que mantém os categóricos: as
+    categorias dos lotes são unidas em vez de a coluna virar texto.
+    """
+    frames = list(frames)
+    if not frames:
+        return pd.DataFrame()
+    df = pd.concat(frames, ignore_index=True)
+    for col in frames[0].columns:
+        if all(col in f.columns and isinstance(f[col].dtype, pd.CategoricalDtype) for f in frames):
+            df[col] = union_categoricals([f[col] for f in frames], sort_categories=True)
+    return df
@@ -1,9 +1,16 @@
 import pandas as pd
 import numpy as np
 import json
+import os
+import glob
 import pyarrow as pa
 import pyarrow.parquet as pq
 
+# Coluna com a posição de cada linha no DataFrame original, gravada em cada
+# parte de um dataset de índices (as partes não seguem a ordem das linhas)
+DATASET_ROW_COL = "__row__"
+DATASET_PART_PATTERN = "part-*.parquet"
+
 def convert_to_serializable(obj):
     """
     Converte objetos numpy para tipos nativos Python (lista, float, int).
@@ -33,39 +40,353 @@ def is_numpy_scalar(val):
     """
     return isinstance(val, (np.generic,)) and not isinstance(val, np.ndarray)
 
-def save_df_complex_parquet(df: pd.DataFrame, path: str):
+def _cell_kinds(col_series: pd.Series):
+    """
+    Percorre todas as células de uma coluna e retorna os tipos encontrados
+    (``'ndarray'``, ``'list'``, ``'dict'``, ``'numpy'`` para escalares numpy,
+    ``'scalar'`` para os demais; nulos são ignorados) e os pares
+    (dtype, ndim) dos numpy arrays.
+    """
+    kinds = set()
+    array_types = set()
+    for val in col_series:
+        if isinstance(val, np.ndarray):
+            kinds.add("ndarray")
+            array_types.add((val.dtype, val.ndim))
+        elif isinstance(val, (list, tuple)):
+            kinds.add("list")
+        elif isinstance(val, dict):
+            kinds.add("dict")
+        elif is_numpy_scalar(val):
+            kinds.add("numpy")
+        elif not pd.isna(val):
+            kinds.add("scalar")
+    return kinds, array_types
+
+def _n_null(col_series: pd.Series) -> int:
+    return sum(1 for val in col_series if not is_complex_list_array(val) and pd.isna(val))
+
+def _numeric_lists(col_series: pd.Series):
+    """
+    As listas de uma coluna como numpy arrays 1-D (nulos mantidos), ou None
+    se alguma não for uma lista plana de números.
+    """
+    cells = []
+    for val in col_series:
+        if not isinstance(val, (list, tuple)):
+            cells.append(val)
+            continue
+        arr = np.asarray(val)
+        if arr.ndim != 1 or (arr.size and arr.dtype.kind not in "iuf"):
+            return None
+        cells.append(arr)
+    return cells
 
+def complex_to_arrow(col_series: pd.Series):
+    """
+    Converte uma coluna ``object`` em uma coluna Arrow nativa. O tipo nativo
+    só é usado se todas as células não nulas forem do mesmo tipo (numpy
+    arrays numéricos de mesmo dtype e ndim, listas, ou dicts com as mesmas
+    chaves); nenhum valor presente vira nulo.
+
+    Listas planas de números viram ``list<float32>``; as demais listas usam
+    o tipo inferido pelo Arrow. Os NaN dentro das células são mantidos.
+
+    Returns
+    -------
+    (pa.Array, str) or (None, None)
+        A coluna e o tipo original das células ('ndarray', 'list' ou
+        'dict'), ou None se a coluna for heterogênea ou se o Arrow não
+        conseguir representá-la (ex.: listas heterogêneas).
+    """
+    kinds, array_types = _cell_kinds(col_series)
+    # Nulos da coluna como None: o from_pandas do Arrow também anularia os NaN dentro das células
+    cells = [val if is_complex_list_array(val) else None for val in col_series]
+    try:
+        if kinds == {"ndarray"} and len(array_types) == 1:
+            (dtype, _), = array_types
+            if dtype.kind not in "biuf":
+                return None, None
+            # Arrays numéricos num único buffer, no dtype das células (float32 fica float32)
+            arrow_col, kind = ndarrays_to_arrow(col_series, dtype=dtype), "ndarray"
+        elif kinds == {"list"}:
+            numeric = _numeric_lists(col_series)
+            if numeric is not None:
+                arrow_col = ndarrays_to_arrow(numeric, dtype=np.float32)
+            else:
+                arrow_col = pa.array(cells)
+            kind = "list"
+        elif kinds == {"dict"}:
+            # Struct só com as mesmas chaves em todas as células: a união das
+            # chaves acrescentaria chaves nulas aos dicts que não as têm
+            if len({frozenset(val) for val in col_series if isinstance(val, dict)}) != 1:
+                return None, None
+            arrow_col, kind = pa.array(cells), "dict"
+        else:
+            return None, None
+    except (pa.ArrowException, TypeError, ValueError):
+        return None, None
+    # Só os nulos da coluna podem ser nulos no Arrow
+    if arrow_col.null_count != _n_null(col_series):
+        return None, None
+    return arrow_col, kind
 
-    df_copy = df.copy()
+def save_df_complex_parquet(df: pd.DataFrame, path: str):
+    """
+    Salva um DataFrame com colunas compostas (listas, dicts, numpy arrays)
+    usando os tipos aninhados do Arrow (``list``, ``fixed_size_list``,
+    ``struct``). Só as colunas que o Arrow não consegue representar são
+    serializadas como JSON, célula a célula.
+    """
+    columns = {}
+    nested_cols = {}
     complex_cols = []
-    
-    for col in df_copy.columns:
-        col_series = df_copy[col]
-        # Se coluna tem lista, array ou dict em alguma célula: serializa JSON (string)
-        if col_series.apply(is_complex_list_array).any():
-            df_copy[col] = col_series.apply(lambda x: json.dumps(convert_to_serializable(x)))
-            complex_cols.append(col)
+
+    for col in df.columns:
+        col_series = df[col]
+        # Só colunas object podem ter células compostas ou escalares numpy
+        if col_series.dtype != object:
+            continue
+        kinds, _ = _cell_kinds(col_series)
+        if kinds & {"ndarray", "list", "dict"}:
+            arrow_col, kind = complex_to_arrow(col_series)
+            if arrow_col is not None:
+                columns[str(col)] = arrow_col
+                nested_cols[str(col)] = kind
+            else:
+                # Formato antigo: JSON (string) por célula
+                columns[str(col)] = pa.array(
+                    col_series.apply(lambda x: json.dumps(convert_to_serializable(x))), type=pa.string()
+                )
+                complex_cols.append(col)
         # Se coluna tem só escalares numpy, converte pra float/int (tipo nativo)
-        elif col_series.apply(is_numpy_scalar).any():
+        elif "numpy" in kinds:
             # Converte toda a série para tipos nativos para evitar salvar como string
-            df_copy[col] = col_series.apply(convert_to_serializable)
+            columns[str(col)] = pa.array(col_series.apply(convert_to_serializable), from_pandas=True)
         # Caso contrário, deixa como está (tipo simples já suportado)
-    
-    table = pa.Table.from_pandas(df_copy)
-    metadata = table.schema.metadata or {}
-    metadata = dict(metadata)
+
+    table = pa.Table.from_pandas(df.drop(columns=[c for c in df.columns if str(c) in columns]))
+    for name, arrow_col in columns.items():
+        table = table.append_column(name, arrow_col)
+    # Ordem original das colunas (o índice do pandas, se gravado, fica no fim)
+    names = [str(col) for col in df.columns]
+    table = table.select(names + [n for n in table.column_names if n not in names])
+
+    metadata = dict(table.schema.metadata or {})
     # Salva quais colunas foram serializadas para JSON (complexas)
     metadata[b'complex_cols'] = json.dumps(complex_cols).encode()
+    # Tipo original das colunas aninhadas, para restaurá-lo na leitura
+    metadata[b'nested_cols'] = json.dumps(nested_cols).encode()
     table = table.replace_schema_metadata(metadata)
-    
+
     pq.write_table(table, path)
 
-def load_df_complex_parquet(path: str) -> pd.DataFrame:
-    table = pq.read_table(path)
+def load_df_complex_parquet(path: str, columns=None, filters=None) -> pd.DataFrame:
+    """
+    Carrega um DataFrame salvo por ``save_df_complex_parquet``, inclusive no
+    formato antigo, em que todas as colunas compostas eram JSON.
+
+    ``columns`` e ``filters`` (formato de ``pyarrow.parquet.read_table``,
+    ex.: ``[("duration", ">", 10)]``) são aplicados pelo pyarrow, que só lê
+    as colunas e os row groups necessários.
+    """
+    table = pq.read_table(path, columns=columns, filters=filters, use_pandas_metadata=True)
+    return _complex_table_to_df(table)
+
+def head_df_complex_parquet(path: str, n: int, columns=None) -> pd.DataFrame:
+    """
+    As primeiras ``n`` linhas de um arquivo salvo por
+    ``save_df_complex_parquet``, lendo só o início do primeiro row group.
+    """
+    parquet_file = pq.ParquetFile(path)
+    batch = next(parquet_file.iter_batches(batch_size=max(n, 1), columns=columns), None)
+    if batch is None:
+        return load_df_complex_parquet(path, columns=columns)
+    # O lote não traz os metadados do arquivo (tipos das colunas compostas, índice do pandas)
+    table = pa.Table.from_batches([batch.slice(0, n)])
+    return _complex_table_to_df(table.replace_schema_metadata(parquet_file.schema_arrow.metadata))
+
+def _complex_table_to_df(table) -> pd.DataFrame:
     metadata = table.schema.metadata or {}
     complex_cols = json.loads(metadata.get(b'complex_cols', b'[]').decode())
-    df = table.to_pandas()
+    nested_cols = json.loads(metadata.get(b'nested_cols', b'{}').decode())
+    # Só as colunas lidas
+    complex_cols = [col for col in complex_cols if col in table.column_names]
+    nested_cols = {col: kind for col, kind in nested_cols.items() if col in table.column_names}
+
+    converted = {}
+    for col, kind in nested_cols.items():
+        column = table.column(col)
+        if kind in ("list", "dict"):
+            values = column.to_pylist()
+        elif pa.types.is_fixed_size_list(column.type):
+            values = arrow_to_ndarrays(column)
+        else:
+            # Arrays de shapes diferentes ou com células nulas
+            dtype = column.type
+            while pa.types.is_list(dtype) or pa.types.is_fixed_size_list(dtype):
+                dtype = dtype.value_type
+            values = [None if v is None else np.asarray(v, dtype=dtype.to_pandas_dtype())
+                      for v in column.to_pylist()]
+        # Células nulas voltam como NaN, como no formato JSON
+        converted[col] = [np.nan if v is None else v for v in values]
+    df = table.drop_columns(list(converted)).to_pandas()
+    for col, values in converted.items():
+        df[col] = pd.Series(values, index=df.index, dtype=object)
+    df = df[[c for c in table.column_names if c in df.columns]]
+
     # Desserializa colunas complexas que estavam como JSON string
     for col in complex_cols:
         df[col] = df[col].apply(json.loads)
     return df
+
+def ndarrays_to_arrow(values, dtype=np.float32) -> pa.Array:
+    """
+    Converte uma sequência de numpy arrays (um por linha) em uma coluna Arrow.
+
+    Arrays com o mesmo shape viram ``fixed_size_list`` (aninhada para 2-D)
+    sobre um único buffer contíguo; shapes diferentes viram ``list``. Células
+    nulas (ex.: NaN de arquivos que falharam) viram nulos; como o Parquet não
+    aceita nulos em ``fixed_size_list``, essas colunas usam ``list``. Qualquer
+    outro valor levanta ``TypeError``, em vez de ser gravado como nulo.
+    """
+    values = list(values)
+    for v in values:
+        if not isinstance(v, np.ndarray) and (is_complex_list_array(v) or not pd.isna(v)):
+            raise TypeError(f"Expected a numpy array or a null cell, got {type(v).__name__}")
+    valid = np.array([isinstance(v, np.ndarray) for v in values], dtype=bool)
+    arrays = [v for v in values if isinstance(v, np.ndarray)]
+    mask = None if valid.all() else pa.array(~valid)
+
+    if mask is None and len({a.shape for a in arrays}) == 1:
+        out = pa.array(np.stack(arrays).astype(dtype, copy=False).ravel())
+        for size in reversed(arrays[0].shape):
+            out = pa.FixedSizeListArray.from_arrays(out, size)
+        return out
+
+    lengths = [len(v) if ok else 0 for v, ok in zip(values, valid)]
+    offsets = pa.array(np.concatenate([[0], np.cumsum(lengths)]).astype(np.int32))
+    if arrays and arrays[0].ndim > 1:
+        inner = ndarrays_to_arrow([row for a in arrays for row in a], dtype)
+    elif arrays:
+        inner = pa.array(np.concatenate(arrays).astype(dtype, copy=False))
+    else:
+        inner = pa.array([], type=pa.from_numpy_dtype(dtype))
+    return pa.ListArray.from_arrays(offsets, inner, mask=mask)
+
+def arrow_to_ndarrays(column) -> np.ndarray:
+    """
+    Converte uma coluna Arrow ``fixed_size_list`` em um array de objetos cujas
+    células são views (sem cópia) de um único bloco numpy.
+    """
+    arr = column.combine_chunks() if isinstance(column, pa.ChunkedArray) else column
+    shape = []
+    values = arr
+    while pa.types.is_fixed_size_list(values.type):
+        shape.append(values.type.list_size)
+        values = values.values
+    block = values.to_numpy(zero_copy_only=False).reshape((len(arr), *shape))
+
+    out = np.empty(len(arr), dtype=object)
+    is_null = arr.is_null().to_numpy(zero_copy_only=False)
+    for i in range(len(arr)):
+        out[i] = None if is_null[i] else block[i]
+    return out
+
+def save_df_indices_parquet(df: pd.DataFrame, path: str):
+    """
+    Salva um DataFrame de índices mantendo colunas de numpy arrays como
+    colunas Arrow tipadas (float32), sem passar por listas Python ou JSON.
+    """
+    array_cols = [
+        col for col in df.columns
+        if df[col].dtype == object and any(isinstance(v, np.ndarray) for v in df[col])
+    ]
+    table = pa.Table.from_pandas(df.drop(columns=array_cols), preserve_index=False)
+    columns = dict(zip(table.column_names, table.columns))
+    columns.update({str(col): ndarrays_to_arrow(df[col]) for col in array_cols})
+    table = pa.table(
+        {str(col): columns[str(col)] for col in df.columns},
+        metadata=table.schema.metadata,
+    )
+
+    pq.write_table(table, path)
+
+def load_df_indices_parquet(path: str, columns=None, filters=None) -> pd.DataFrame:
+    """
+    Carrega um DataFrame salvo por ``save_df_indices_parquet``. Colunas
+    ``fixed_size_list`` voltam como numpy arrays (views de um bloco contíguo).
+
+    Se ``path`` for um diretório, carrega o dataset particionado escrito pelo
+    runner (ver ``load_df_indices_parts``); durante um cálculo, retorna as
+    linhas já gravadas.
+
+    ``columns`` e ``filters`` são aplicados pelo pyarrow, como em
+    ``load_df_complex_parquet``.
+    """
+    if os.path.isdir(path):
+        return load_df_indices_parts(
+            sorted(glob.glob(os.path.join(path, DATASET_PART_PATTERN))), columns=columns, filters=filters
+        )
+    table = pq.read_table(path, columns=columns, filters=filters)
+    fixed_cols = [
+        field.name for field in table.schema if pa.types.is_fixed_size_list(field.type)
+    ]
+    df = table.drop_columns(fixed_cols).to_pandas()
+    for col in fixed_cols:
+        df[col] = arrow_to_ndarrays(table.column(col))
+    return df[table.column_names]
+
+def load_df_indices_parts(paths, columns=None, filters=None) -> pd.DataFrame:
+    """
+    Concatena partes salvas por ``save_df_indices_parquet`` com a coluna
+    ``DATASET_ROW_COL``, restaurando a ordem original das linhas. As partes
+    são lidas uma a uma porque os tipos Arrow das colunas de arrays podem
+    variar entre elas.
+    """
+    if columns is not None and paths and DATASET_ROW_COL in pq.read_schema(paths[0]).names:
+        # A posição das linhas é lida junto para restaurar a ordem
+        columns = [col for col in columns if col != DATASET_ROW_COL] + [DATASET_ROW_COL]
+    frames = [load_df_indices_parquet(p, columns=columns, filters=filters) for p in paths]
+    if not frames:
+        return pd.DataFrame()
+    df = pd.concat(frames, ignore_index=True)
+    if DATASET_ROW_COL in df.columns:
+        df = df.sort_values(DATASET_ROW_COL, kind="stable").drop(columns=DATASET_ROW_COL)
+    return df.reset_index(drop=True)
+
+def read_schema(path: str) -> pa.Schema:
+    """
+    Retorna o schema Arrow de um arquivo Parquet, ou da primeira parte de um
+    dataset particionado, lendo só o rodapé do arquivo.
+    """
+    if os.path.isdir(path):
+        parts = sorted(glob.glob(os.path.join(path, DATASET_PART_PATTERN)))
+        if not parts:
+            return pa.schema([])
+        path = parts[0]
+    return pq.read_schema(path)
+
+def read_columns(path: str) -> list:
+    """
+    Retorna os nomes das colunas de um DataFrame salvo (Parquet, dataset
+    particionado ou CSV) sem carregar os dados. Colunas internas (índice do
+    pandas e ``DATASET_ROW_COL``) ficam de fora.
+    """
+    if path.endswith(".csv"):
+        return list(pd.read_csv(path, nrows=0).columns)
+    schema = read_schema(path)
+    hidden = {DATASET_ROW_COL}
+    pandas_metadata = schema.pandas_metadata or {}
+    hidden.update(col for col in pandas_metadata.get("index_columns", []) if isinstance(col, str))
+    return [name for name in schema.names if name not in hidden]
+
+def read_parts_rows(path: str) -> dict:
+    """
+    Retorna ``{caminho: posições}`` das partes de um dataset particionado,
+    lendo só a coluna ``DATASET_ROW_COL`` de cada parte.
+    """
+    return {
+        p: pq.read_table(p, columns=[DATASET_ROW_COL]).column(0).to_numpy()
+        for p in sorted(glob.glob(os.path.join(path, DATASET_PART_PATTERN)))
+    }